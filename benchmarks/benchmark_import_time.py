@@ -0,0 +1,105 @@
+# Copyright (c) 2019 Leiden University Medical Center
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Measures the time it takes to import biowdl_input_converter in a new python
+process with ``python -X importtime``. This is the startup cost of every
+biowdl-input-converter invocation. Exits with an error when the median
+ratio of import times exceeds the budget.
+
+Wall clock import times differ a lot between machines and runs, so the
+budget is relative. Every process first imports the standard library
+modules that the package needs, then the package. The budget is the
+maximum ratio of the import time of the package, which is then only its
+own modules and any module it imports eagerly, to the import time of those
+standard library modules in the same process.
+
+Usage: python benchmarks/benchmark_import_time.py [-h] ...
+"""
+
+import argparse
+import statistics
+import subprocess  # nosec
+import sys
+from typing import Dict, Tuple
+
+# The standard library modules that the package always imports. They are
+# imported before the package and are the baseline of the measurement.
+BASELINE_MODULES = ("argparse", "collections", "csv", "dataclasses", "json",
+                    "pathlib", "re", "threading", "typing")
+
+# The median ratio is about 0.93 with the lazy imports in place. Importing
+# PyYAML eagerly again raises it to about 1.45, so the budget sits between.
+DEFAULT_BUDGET = 1.2
+
+
+def import_times() -> Tuple[float, float]:
+    """
+    :return: The cumulative import times of the package and of the baseline
+    modules in one process, in milliseconds.
+    """
+    result = subprocess.run(  # nosec
+        [sys.executable, "-X", "importtime", "-c",
+         f"import {', '.join(BASELINE_MODULES)}; "
+         f"import biowdl_input_converter"],
+        stderr=subprocess.PIPE, check=True, universal_newlines=True)
+    cumulative_times = {}  # type: Dict[str, int]
+    for line in result.stderr.splitlines():
+        # Lines look like: "import time: self | cumulative | module". The
+        # modules that are imported by other modules are indented, and
+        # their time is part of the cumulative time of those modules.
+        _, cumulative, module = line.split("|")
+        # The first line is a header.
+        if cumulative.strip().isdigit() and not module.startswith("  "):
+            cumulative_times[module.strip()] = int(cumulative)
+    if "biowdl_input_converter" not in cumulative_times:
+        raise RuntimeError("biowdl_input_converter not found in the output "
+                           "of python -X importtime.")
+    # Baseline modules that were imported by an earlier baseline module are
+    # already counted.
+    baseline = sum(cumulative_times.get(module, 0)
+                   for module in BASELINE_MODULES)
+    return cumulative_times["biowdl_input_converter"] / 1000, baseline / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-r", "--repeat", type=int, default=20,
+                        help="The number of processes to measure. "
+                             "Default: 20")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET,
+                        help=f"The maximum median ratio of the import time "
+                             f"of the package to the import time of the "
+                             f"baseline modules. Default: {DEFAULT_BUDGET}")
+    args = parser.parse_args()
+    times = [import_times() for _ in range(args.repeat)]
+    ratios = [package / baseline for package, baseline in times]
+    median = statistics.median(ratios)
+    print(f"Import time: median {statistics.median(t[0] for t in times):.1f} "
+          f"ms, baseline modules median "
+          f"{statistics.median(t[1] for t in times):.1f} ms")
+    print(f"Ratio: median {median:.2f}, min {min(ratios):.2f}, "
+          f"max {max(ratios):.2f}, budget {args.budget:.2f}")
+    if median > args.budget:
+        sys.exit("Import time exceeds the budget.")
+
+
+if __name__ == "__main__":
+    main()
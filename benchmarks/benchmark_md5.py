@@ -0,0 +1,92 @@
+# Copyright (c) 2019 Leiden University Medical Center
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Compares the md5 hashing of biowdl_input_converter.utils.file_md5sum with the
+previous implementation, which read the file in 64 KiB blocks with read.
+
+The files are in the page cache after the first run of the previous
+implementation, which measures the CPU cost of hashing. file_md5sum drops the
+hashed files from the page cache, so it is measured with drop_cache disabled
+to compare the same situation. Use --drop-cache to include it.
+
+Usage: python benchmarks/benchmark_md5.py [-h] ...
+"""
+
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List
+
+from biowdl_input_converter.utils import file_md5sum
+
+DEFAULT_SIZES = (64 * 1024, 16 * 2 ** 20, 512 * 2 ** 20)
+
+
+def previous_file_md5sum(filepath: Path, blocksize: int = 64 * 1024) -> str:
+    """The implementation of file_md5sum before readinto was used."""
+    hasher = hashlib.md5()  # nosec: only used for file integrity
+    with open(filepath, "rb") as file_handler:
+        for block in iter(lambda: file_handler.read(blocksize), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def best_time(function: Callable[[], str], repeat: int) -> float:
+    times = []  # type: List[float]
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-s", "--sizes", type=int, nargs="+",
+                        default=list(DEFAULT_SIZES),
+                        help="The file sizes in bytes.")
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                        help="How often each file is hashed. Default: 5")
+    parser.add_argument("--drop-cache", action="store_true",
+                        help="Let file_md5sum drop the files from the page "
+                             "cache.")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tempdir:
+        for size in args.sizes:
+            path = Path(tempdir, f"{size}.bin")
+            path.write_bytes(os.urandom(size))
+            previous = best_time(lambda: previous_file_md5sum(path),
+                                 args.repeat)
+            current = best_time(
+                lambda: file_md5sum(path, drop_cache=args.drop_cache),
+                args.repeat)
+            assert previous_file_md5sum(path) == file_md5sum(path)
+            print(f"{size:>12} bytes: previous "
+                  f"{size / previous / 2 ** 20:8.1f} MiB/s, file_md5sum "
+                  f"{size / current / 2 ** 20:8.1f} MiB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Copyright (c) 2019 Leiden University Medical Center
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Measures the memory that is used by the SampleGroup of a synthetic CSV
+samplesheet.
+
+Usage: python benchmarks/benchmark_memory.py [-h] ...
+"""
+
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+from biowdl_input_converter.input_conversions import \
+    samplesheet_csv_to_samplegroup
+
+from generate_samplesheet import generate_samplesheet
+
+
+DEFAULT_READGROUPS = 1_000_000
+
+
+def argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Measure the memory that is used by the SampleGroup of "
+                    "a synthetic CSV samplesheet.")
+    parser.add_argument("-n", "--readgroups", type=int,
+                        default=DEFAULT_READGROUPS,
+                        help=f"The number of readgroups. "
+                             f"Default: {DEFAULT_READGROUPS}")
+    return parser
+
+
+def main():
+    readgroups = argument_parser().parse_args().readgroups
+    with tempfile.TemporaryDirectory() as tempdir:
+        samplesheet = Path(tempdir, "samplesheet.csv")
+        generate_samplesheet(samplesheet, readgroups, "csv", Path(tempdir),
+                             extra_columns=True, md5sums=True)
+        tracemalloc.start()
+        samplegroup = samplesheet_csv_to_samplegroup(samplesheet)
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    print(f"{readgroups} readgroups in {len(samplegroup.samples)} samples: "
+          f"{size / 2 ** 20:.1f} MiB, peak {peak / 2 ** 20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
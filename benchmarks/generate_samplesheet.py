@@ -0,0 +1,180 @@
+# Copyright (c) 2019 Leiden University Medical Center
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Generates synthetic samplesheets in CSV, TSV, YAML and JSON format.
+
+Every sample has two libraries with four readgroups each. Optionally the
+samplesheet has additional columns and md5sums, and the read files are
+created on disk so the file checks can be run on the samplesheet.
+
+Usage: python benchmarks/generate_samplesheet.py [-h] ...
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import yaml
+
+FORMATS = ("csv", "tsv", "yaml", "json")
+READGROUPS_PER_LIBRARY = 4
+LIBRARIES_PER_SAMPLE = 2
+
+
+def read_content(number: int) -> bytes:
+    return f"@read{number}\nACGT\n+\nIIII\n".encode()
+
+
+def readgroup_rows(readgroups: int, data_dir: Path, extra_columns: bool,
+                   md5sums: bool) -> Iterator[Dict[str, Optional[str]]]:
+    """
+    Yields one row per readgroup with the columns of a CSV samplesheet.
+    """
+    per_sample = READGROUPS_PER_LIBRARY * LIBRARIES_PER_SAMPLE
+    for number in range(readgroups):
+        sample = number // per_sample
+        row = {
+            "sample": f"s{sample}",
+            "library": f"lib{number // READGROUPS_PER_LIBRARY % 2}",
+            "readgroup": f"rg{number % READGROUPS_PER_LIBRARY}",
+            "R1": str(data_dir / f"{number}_R1.fq"),
+            "R2": str(data_dir / f"{number}_R2.fq"),
+        }  # type: Dict[str, Optional[str]]
+        if md5sums:
+            md5sum = hashlib.md5(read_content(number)).hexdigest()  # nosec
+            row["R1_md5"] = md5sum
+            row["R2_md5"] = md5sum
+        if extra_columns:
+            # Additional properties only need to be set once per sample.
+            first_of_sample = number % per_sample == 0
+            row["control"] = (f"s{sample - 1}" if first_of_sample and sample
+                              else None)
+            row["batch"] = f"batch{sample % 10}" if first_of_sample else None
+        yield row
+
+
+def create_read_files(readgroups: int, data_dir: Path):
+    """Creates the read files for a samplesheet in data_dir."""
+    data_dir.mkdir(parents=True, exist_ok=True)
+    for number in range(readgroups):
+        for read in ("R1", "R2"):
+            path = data_dir / f"{number}_{read}.fq"
+            if not path.exists():
+                path.write_bytes(read_content(number))
+
+
+def write_delimited(path: Path, rows: Iterator[Dict[str, Optional[str]]],
+                    delimiter: str):
+    with path.open("w") as samplesheet:
+        header = None  # type: Optional[List[str]]
+        for row in rows:
+            if header is None:
+                header = list(row.keys())
+                samplesheet.write(delimiter.join(header) + "\n")
+            samplesheet.write(delimiter.join(
+                row[column] or "" for column in header) + "\n")
+
+
+def rows_to_structure(rows: Iterator[Dict[str, Optional[str]]]
+                      ) -> Dict[str, Any]:
+    """Converts the rows to the structure of a BioWDL YAML samplesheet."""
+    samples = {}  # type: Dict[Optional[str], Dict[str, Any]]
+    for row in rows:
+        sample = samples.setdefault(row["sample"], {"id": row["sample"],
+                                                    "libraries": []})
+        for key in ("control", "batch"):
+            if row.get(key) is not None:
+                sample[key] = row[key]
+        libraries = sample["libraries"]
+        if not libraries or libraries[-1]["id"] != row["library"]:
+            libraries.append({"id": row["library"], "readgroups": []})
+        reads = {key: row[key] for key in ("R1", "R1_md5", "R2", "R2_md5")
+                 if key in row}
+        libraries[-1]["readgroups"].append({"id": row["readgroup"],
+                                            "reads": reads})
+    return {"samples": list(samples.values())}
+
+
+def generate_samplesheet(path: Path, readgroups: int, fileformat: str,
+                         data_dir: Path, extra_columns: bool = False,
+                         md5sums: bool = False):
+    """
+    Writes a synthetic samplesheet.
+    :param path: The samplesheet path.
+    :param readgroups: The number of readgroups in the samplesheet.
+    :param fileformat: csv, tsv, yaml or json.
+    :param data_dir: The directory that contains the read files.
+    :param extra_columns: Add additional properties to the samples.
+    :param md5sums: Add md5sums for the reads.
+    """
+    rows = readgroup_rows(readgroups, data_dir, extra_columns, md5sums)
+    if fileformat == "csv":
+        write_delimited(path, rows, ",")
+    elif fileformat == "tsv":
+        write_delimited(path, rows, "\t")
+    elif fileformat == "yaml":
+        with path.open("w") as samplesheet:
+            yaml.dump(rows_to_structure(rows), samplesheet,
+                      Dumper=getattr(yaml, "CSafeDumper", yaml.SafeDumper))
+    elif fileformat == "json":
+        with path.open("w") as samplesheet:
+            json.dump(rows_to_structure(rows), samplesheet)
+    else:
+        raise ValueError(f"Unknown format: {fileformat}")
+
+
+def argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic samplesheet.")
+    parser.add_argument("output", type=Path,
+                        help="The samplesheet to write.")
+    parser.add_argument("-n", "--readgroups", type=int, default=1000,
+                        help="The number of readgroups. Default: 1000")
+    parser.add_argument("-f", "--format", choices=FORMATS,
+                        help="The samplesheet format. Default: detected from "
+                             "the output suffix.")
+    parser.add_argument("--data-dir", type=Path, default=Path("data"),
+                        help="The directory for the read files. "
+                             "Default: data")
+    parser.add_argument("--extra-columns", action="store_true",
+                        help="Add additional properties to the samples.")
+    parser.add_argument("--md5sums", action="store_true",
+                        help="Add md5sums for the reads.")
+    parser.add_argument("--create-files", action="store_true",
+                        help="Create the read files in the data directory.")
+    return parser
+
+
+def main():
+    args = argument_parser().parse_args()
+    fileformat = args.format or args.output.suffix.lstrip(".")
+    data_dir = Path(os.path.abspath(args.data_dir))
+    generate_samplesheet(args.output, args.readgroups, fileformat, data_dir,
+                         args.extra_columns, args.md5sums)
+    if args.create_files:
+        create_read_files(args.readgroups, data_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# Copyright (c) 2019 Leiden University Medical Center
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Times every stage of the conversion on synthetic samplesheets and writes the
+results as JSON, so the performance of releases can be compared.
+
+Usage: python benchmarks/run_benchmarks.py [-h] ...
+"""
+
+import argparse
+import collections
+import gc
+import io
+import itertools
+import json
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from biowdl_input_converter import input_conversions, output_conversions, \
+    utils, validation
+
+from generate_samplesheet import FORMATS, create_read_files, \
+    generate_samplesheet
+
+DEFAULT_SIZES = (10, 1000, 100_000)
+CHOICES = {"with": (True,), "without": (False,), "both": (False, True)}
+
+
+def package_version() -> str:
+    try:
+        from importlib import metadata
+    # importlib.metadata is not available on python 3.7.
+    except ImportError:
+        return "unknown"
+    try:
+        return metadata.version("biowdl-input-converter")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def best_time(function: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    """
+    Runs a function repeatedly with the garbage collector enabled.
+    :return: The fastest and all wall clock times in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {"seconds": min(times), "all_seconds": times}
+
+
+def benchmark_samplesheet(samplesheet: Path, fileformat: str,
+                          md5sums: bool, repeat: int
+                          ) -> Dict[str, Dict[str, Any]]:
+    """Times all stages of the conversion on one samplesheet."""
+    stages = {}  # type: Dict[str, Callable[[], Any]]
+    if fileformat in ("csv", "tsv"):
+        stages["csv_to_dict_generator"] = lambda: collections.deque(
+            utils.csv_to_dict_generator(samplesheet), maxlen=0)
+        parse = input_conversions.samplesheet_csv_to_samplegroup
+    elif fileformat == "json":
+        parse = input_conversions.biowdl_json_to_samplegroup
+    else:
+        parse = input_conversions.biowdl_yaml_to_samplegroup
+    stages[parse.__name__] = lambda: parse(samplesheet)
+    samplegroup = parse(samplesheet)
+    stages["check_existence_list_of_files"] = \
+        lambda: utils.check_existence_list_of_files(samplegroup.files())
+    if md5sums:
+        stages["check_md5sums"] = lambda: utils.check_md5sums(
+            samplegroup.files_and_md5sums())
+    stages["check_duplicate_files"] = \
+        lambda: utils.check_duplicate_files(samplegroup.files())
+    stages["validate_samplegroup"] = lambda: validation.validate_samplegroup(
+        samplegroup, file_md5_check=md5sums)
+    stages["samplegroup_to_biowdl_old_json"] = \
+        lambda: output_conversions.samplegroup_to_biowdl_old_json(samplegroup)
+    stages["samplegroup_to_biowdl_new_json"] = \
+        lambda: output_conversions.samplegroup_to_biowdl_new_json(samplegroup)
+    stages["write_biowdl_new_json"] = lambda: \
+        output_conversions.write_biowdl_new_json(samplegroup, io.StringIO())
+    return {name: best_time(stage, repeat) for name, stage in stages.items()}
+
+
+def argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Benchmark biowdl-input-converter on synthetic "
+                    "samplesheets.")
+    parser.add_argument("-n", "--sizes", type=int, nargs="+",
+                        default=list(DEFAULT_SIZES),
+                        help=f"The numbers of readgroups in the samplesheets. "
+                             f"Default: {' '.join(map(str, DEFAULT_SIZES))}")
+    parser.add_argument("-f", "--formats", nargs="+", choices=FORMATS,
+                        default=list(FORMATS),
+                        help="The samplesheet formats. Default: all")
+    parser.add_argument("--extra-columns", choices=CHOICES, default="both",
+                        help="Benchmark samplesheets with and/or without "
+                             "additional properties. Default: both")
+    parser.add_argument("--md5sums", choices=CHOICES, default="both",
+                        help="Benchmark samplesheets with and/or without "
+                             "md5sums. Default: both")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="How often each stage is run. Default: 3")
+    parser.add_argument("-o", "--output",
+                        help="The JSON file with the results. Default: "
+                             "stdout")
+    return parser
+
+
+def main():
+    args = argument_parser().parse_args()
+    results = []  # type: List[Dict[str, Any]]
+    with tempfile.TemporaryDirectory() as tempdir:
+        data_dir = Path(tempdir, "data")
+        create_read_files(max(args.sizes), data_dir)
+        for size, fileformat, extra_columns, md5sums in itertools.product(
+                args.sizes, args.formats, CHOICES[args.extra_columns],
+                CHOICES[args.md5sums]):
+            samplesheet = Path(tempdir, f"samplesheet.{fileformat}")
+            generate_samplesheet(samplesheet, size, fileformat, data_dir,
+                                 extra_columns, md5sums)
+            print(f"Benchmarking {size} readgroups, {fileformat}, "
+                  f"extra columns: {extra_columns}, md5sums: {md5sums}",
+                  file=sys.stderr)
+            stages = benchmark_samplesheet(samplesheet, fileformat, md5sums,
+                                           args.repeat)
+            for stage, timing in stages.items():
+                results.append(dict(readgroups=size, format=fileformat,
+                                    extra_columns=extra_columns,
+                                    md5sums=md5sums, stage=stage, **timing))
+
+    report = {
+        "version": package_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as output_h:
+            json.dump(report, output_h, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -52,5 +52,6 @@ setup(
         "pyyaml"
     ],
     entry_points={"console_scripts": [
-        "biowdl-input-converter = biowdl_input_converter:main"]}
+        "biowdl-input-converter = biowdl_input_converter:main",
+        "biowdl-input-converter-batch = biowdl_input_converter.batch:main"]}
 )
@@ -21,29 +21,41 @@
 """
 biowdl-input-converter converts samplesheets to json files that are readable
 by cromwell.
+
+Modules that are only needed for some options are imported when they are
+used, so the command line tool starts quickly.
 """
 
 import argparse
+import contextlib
+import json
+import os
+import sys
 from pathlib import Path
+from typing import Callable, Optional, Sequence, TYPE_CHECKING, TextIO
 
 from . import input_conversions, output_conversions
-from .utils import check_duplicate_files, check_existence_list_of_files, \
-    check_md5sums
+from .cache import DEFAULT_MAX_ENTRIES, Md5Cache, ResultCache
+from .samplestructure import ReadGroup, SampleGroup
+from .timings import Timings
+from .utils import DIGEST_ALGORITHMS, DUPLICATE_CHECK_MODES, JSON_BACKENDS, \
+    StatCache
+from .validation import FilePrefetcher, generate_missing_checksums, \
+    record_file_sizes, validate_samplegroup
 
+if TYPE_CHECKING:
+    import concurrent.futures
 
-def argument_parser() -> argparse.ArgumentParser:
-    parser = argparse.ArgumentParser(
-        description="Parse samplesheets for BioWDL pipelines.")
-    parser.add_argument("samplesheet", type=str,
-                        help="The input samplesheet. Format will be "
-                             "automatically detected from file suffix "
-                             "if --format argument not provided")
+
+def add_conversion_arguments(parser: argparse.ArgumentParser):
+    """
+    Adds the options for the conversion and the checks of the samplesheets,
+    which are shared by the command line tools.
+    :param parser: The parser to add the options to.
+    """
     parser.add_argument("-f", "--format", type=str,
                         help="The input samplesheet format - "
                               "tsv, csv, json, or yaml")
-    parser.add_argument("-o", "--output",
-                        help="The output file to which the json is written. "
-                             "Default: stdout")
     parser.add_argument("--validate", action="store_true",
                         help="Do not generate output but only validate the "
                              "samplesheet.")
@@ -58,18 +70,304 @@ def argument_parser() -> argparse.ArgumentParser:
                         dest="duplicate_check",
                         help="Skip the checks for duplicate files in the "
                              "samplesheet.")
+    parser.add_argument("--duplicate-check-mode",
+                        choices=DUPLICATE_CHECK_MODES, default="path",
+                        help="How files are compared when checking for "
+                             "duplicates. 'path' compares the normalized "
+                             "paths. 'inode' compares the device and inode "
+                             "of the files, which also finds the same file "
+                             "reached through a symlink or hardlink. "
+                             "Default: path")
     parser.add_argument("--check-file-md5sums", action="store_true",
                         help="Do a md5sum check for reads which have md5sums "
-                             "added in the samplesheet.")
+                             "added in the samplesheet. Other checksums in "
+                             "the samplesheet, such as R1_sha256, are "
+                             "checked in the same read.")
+    parser.add_argument("--generate-md5sums", action="store_true",
+                        help="Calculate the md5sums of reads which have no "
+                             "md5sum in the samplesheet and add them to the "
+                             "output. This uses the same threads and md5 "
+                             "cache as --check-file-md5sums.")
+    parser.add_argument("--generate-checksums", nargs="+", default=[],
+                        choices=DIGEST_ALGORITHMS, metavar="ALGORITHM",
+                        help=f"Calculate these checksums for reads which "
+                             f"do not have them in the samplesheet and add "
+                             f"them to the output as columns such as "
+                             f"R1_sha256. All checksums of a file are "
+                             f"calculated in one read. crc32c requires the "
+                             f"crc32c package. Choose from: "
+                             f"{', '.join(DIGEST_ALGORITHMS)}.")
+    parser.add_argument("--check-gzip", action="store_true",
+                        help="Check the integrity of files with a .gz or "
+                             ".bgz suffix, like 'gzip -t'. Every member of "
+                             "multi-member files such as BGZF is checked. "
+                             "Files that are hashed for --check-file-md5sums "
+                             "or --generate-md5sums are checked in the same "
+                             "read. All invalid files are reported "
+                             "together.")
+    parser.add_argument("--record-sizes", action="store_true",
+                        help="Add the sizes of the reads in bytes to the "
+                             "output as R1_size and R2_size, and the total "
+                             "size of each readgroup and sample as "
+                             "total_size. Pipelines can use these instead "
+                             "of looking up the sizes of the files.")
+    parser.add_argument("-t", "--threads", "--md5-workers", type=int,
+                        default=1,
+                        help="The number of files that are hashed at the "
+                             "same time when checking md5sums. Default: 1")
+    parser.add_argument("--threads-per-device", type=int,
+                        help="The number of files on the same device that "
+                             "are hashed at the same time. Files on each "
+                             "device are hashed in inode order. Use 1 for "
+                             "spinning disks. Default: no limit")
+    parser.add_argument("--md5-cache", type=str,
+                        help="A SQLite database that stores the md5sums of "
+                             "files that were checked before. Unchanged "
+                             "files are not hashed again. The database is "
+                             "created if it does not exist.")
+    parser.add_argument("--md5-cache-size", type=int,
+                        default=DEFAULT_MAX_ENTRIES,
+                        help=f"The maximum number of md5sums in the md5 "
+                             f"cache. The least recently used md5sums are "
+                             f"removed first. Default: {DEFAULT_MAX_ENTRIES}")
+    parser.add_argument("--json-backend", choices=("auto",) + JSON_BACKENDS,
+                        default="auto",
+                        help="The library that is used to parse JSON "
+                             "samplesheets. 'auto' selects the fastest "
+                             "library that is installed. The JSON output is "
+                             "always written with the json module. "
+                             "Default: auto")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Check the files while the samplesheet is "
+                             "parsed, instead of after parsing. The "
+                             "output and the reported problems are the "
+                             "same. --threads sets the number of workers "
+                             "that check the files.")
+
+
+def argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Parse samplesheets for BioWDL pipelines.")
+    parser.add_argument("samplesheet", type=str,
+                        help="The input samplesheet. Format will be "
+                             "automatically detected from file suffix "
+                             "if --format argument not provided")
+    parser.add_argument("-o", "--output",
+                        help="The output file to which the json is written. "
+                             "Default: stdout")
+    parser.add_argument("--shard-dir", metavar="DIR",
+                        help="Write the samples to JSON files in DIR, with "
+                             "--samples-per-shard samples in each file. "
+                             "Each file has the same structure as the "
+                             "complete JSON. The output is then an index "
+                             "with the path and sample ids of every file. "
+                             "DIR is created if it does not exist. Shard "
+                             "files from an earlier run in DIR are "
+                             "removed.")
+    parser.add_argument("--samples-per-shard", type=int, default=1,
+                        help="The maximum number of samples in each file "
+                             "in --shard-dir. Default: 1")
+    parser.add_argument("--write-samplesheet", metavar="FILE",
+                        help="Write the samplesheet, with the checksums from "
+                             "--generate-md5sums and --generate-checksums, "
+                             "to FILE. The format is "
+                             "detected from the file suffix: csv, tsv, yaml, "
+                             "yml or json.")
+    add_conversion_arguments(parser)
+    parser.add_argument("--timings", nargs="?", const="-", metavar="FILE",
+                        help="Measure the wall clock time, CPU time, number "
+                             "of items and processed bytes of each stage. A "
+                             "summary is printed to stderr, or written as "
+                             "JSON to FILE if given.")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Also measure the peak memory usage of each "
+                             "stage for --timings. This slows down the "
+                             "conversion.")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="Profile the conversion with cProfile and write "
+                             "the statistics to FILE. The statistics can be "
+                             "read with the pstats module.")
+    parser.add_argument("--result-cache", metavar="FILE",
+                        help="A SQLite database that stores the JSON of "
+                             "earlier conversions. When the samplesheet, "
+                             "the options and the size, modification time "
+                             "and inode of every file in it did not change, "
+                             "the stored JSON is used without parsing or "
+                             "checking the samplesheet again. The database "
+                             "is created if it does not exist.")
     return parser
 
 
+def _filetype(samplesheet: Path, fileformat: Optional[str]) -> str:
+    if fileformat is not None:
+        return fileformat.lower().replace('.', '')
+    return samplesheet.suffix.lower().replace('.', '')
+
+
+def parse_samplesheet(samplesheet: Path,
+                      fileformat: Optional[str] = None,
+                      json_backend: str = "auto",
+                      on_readgroup: Optional[
+                          Callable[[ReadGroup], None]] = None
+                      ) -> SampleGroup:
+    """
+    Converts a samplesheet file to a SampleGroup without checking the files.
+    :param samplesheet:
+    :param fileformat: tsv, csv, yaml, yml, json
+    :param json_backend: The library used to parse JSON samplesheets
+    :param on_readgroup: called with every readgroup after it is parsed
+    :return: a SampleGroup object
+    """
+    filetype = _filetype(samplesheet, fileformat)
+    if filetype in ["tsv", "csv"]:
+        return input_conversions.samplesheet_csv_to_samplegroup(
+            samplesheet, on_readgroup=on_readgroup)
+    elif filetype in ["yaml", "yml"]:
+        return input_conversions.biowdl_yaml_to_samplegroup(
+            samplesheet, on_readgroup=on_readgroup)
+    elif filetype == "json":
+        return input_conversions.biowdl_json_to_samplegroup(
+            samplesheet, json_backend=json_backend,
+            on_readgroup=on_readgroup)
+    raise NotImplementedError(
+        f"Unsupported extension: {samplesheet.suffix}")
+
+
+def samplesheet_to_samplegroup(samplesheet: Path,
+                               fileformat: Optional[str] = None,
+                               file_presence_check: bool = True,
+                               file_md5_check: bool = False,
+                               file_duplication_check: bool = True,
+                               generate_md5sums: bool = False,
+                               file_gzip_check: bool = False,
+                               generate_checksums: Sequence[str] = (),
+                               record_sizes: bool = False,
+                               duplicate_check_mode: str = "path",
+                               threads: int = 1,
+                               threads_per_device: Optional[int] = None,
+                               md5_cache: Optional[Md5Cache] = None,
+                               json_backend: str = "auto",
+                               timings: Optional[Timings] = None,
+                               stat_cache: Optional[StatCache] = None,
+                               executor: Optional[
+                                   "concurrent.futures.Executor"] = None,
+                               pipelined: bool = False
+                               ) -> SampleGroup:
+    """
+    Converts a samplesheet file to a SampleGroup and checks the files in it.
+    All problems with the files are raised together, as a FileNotFoundError
+    if files are missing and as a ValueError otherwise.
+    :param samplesheet:
+    :param fileformat: tsv, csv, yaml, yml, json
+    :param file_presence_check: Check if the files in the samplesheet are
+    present
+    :param file_md5_check: Check if the md5sums for the files are correct
+    :param file_duplication_check: Check if files occur more than once
+    :param generate_md5sums: Calculate the md5sums of files without an
+    md5sum after the checks
+    :param file_gzip_check: Check the integrity of gzip files
+    :param generate_checksums: Calculate these checksums for files without
+    them after the checks, in the same read as the md5sums
+    :param record_sizes: Record the sizes of the files in the readgroups
+    :param duplicate_check_mode: How files are compared in the duplication
+    check: path or inode
+    :param threads: The number of files that are hashed simultaneously
+    :param threads_per_device: The number of files on one device that are
+    hashed simultaneously
+    :param md5_cache: A cache with md5sums of previously checked files
+    :param json_backend: The library used to parse JSON samplesheets
+    :param timings: Records the time spent in each stage
+    :param stat_cache: Reuses directory listings and stat results of files
+    that were checked before
+    :param executor: Hashes the files instead of a new thread pool
+    :param pipelined: Check the files in worker threads while the
+    samplesheet is parsed. The result is the same.
+    :return: a SampleGroup object
+    """
+    if timings is None:
+        timings = Timings()
+    scanned_files = None
+
+    with timings.stage("parse") as stage:
+        with contextlib.ExitStack() as stack:
+            on_readgroup = None  # type: Optional[Callable[[ReadGroup], None]]
+            if pipelined:
+                if stat_cache is None:
+                    stat_cache = StatCache()
+                prefetcher = stack.enter_context(FilePrefetcher(
+                    file_presence_check=file_presence_check,
+                    file_md5_check=file_md5_check,
+                    file_duplication_check=file_duplication_check,
+                    duplicate_check_mode=duplicate_check_mode,
+                    threads=threads,
+                    md5_cache=md5_cache,
+                    stat_cache=stat_cache,
+                    file_gzip_check=file_gzip_check))
+                on_readgroup = prefetcher.add
+                scanned_files = prefetcher.scanned_files
+            samplegroup = parse_samplesheet(samplesheet, fileformat,
+                                            json_backend, on_readgroup)
+        stage.items = sum(len(library.readgroups) for sample in samplegroup
+                          for library in sample)
+        stage.bytes = os.path.getsize(samplesheet)
+
+    report = validate_samplegroup(
+        samplegroup,
+        file_presence_check=file_presence_check,
+        file_md5_check=file_md5_check,
+        file_duplication_check=file_duplication_check,
+        duplicate_check_mode=duplicate_check_mode,
+        threads=threads,
+        threads_per_device=threads_per_device,
+        md5_cache=md5_cache,
+        executor=executor,
+        stat_cache=stat_cache,
+        timings=timings,
+        file_gzip_check=file_gzip_check,
+        scanned_files=scanned_files)
+    report.raise_for_problems()
+    algorithms = tuple(dict.fromkeys(
+        (("md5",) if generate_md5sums else ()) + tuple(generate_checksums)))
+    if algorithms:
+        with timings.stage("generate_checksums") as stage:
+            stage.items, stage.bytes = generate_missing_checksums(
+                samplegroup,
+                algorithms,
+                threads=threads,
+                threads_per_device=threads_per_device,
+                md5_cache=md5_cache,
+                executor=executor,
+                stat_cache=stat_cache,
+                known_digests=report.digests)
+    if record_sizes:
+        with timings.stage("record_sizes") as stage:
+            stage.bytes = record_file_sizes(samplegroup, threads=threads,
+                                            stat_cache=stat_cache)
+            stage.items = report.files
+    return samplegroup
+
+
 def samplesheet_to_json(samplesheet: Path,
-                        fileformat: str = None,
+                        fileformat: Optional[str] = None,
                         old_style_json: bool = False,
                         file_presence_check: bool = True,
                         file_md5_check: bool = False,
-                        file_duplication_check: bool = True) -> str:
+                        file_duplication_check: bool = True,
+                        generate_md5sums: bool = False,
+                        file_gzip_check: bool = False,
+                        generate_checksums: Sequence[str] = (),
+                        record_sizes: bool = False,
+                        duplicate_check_mode: str = "path",
+                        threads: int = 1,
+                        threads_per_device: Optional[int] = None,
+                        md5_cache: Optional[Md5Cache] = None,
+                        json_backend: str = "auto",
+                        timings: Optional[Timings] = None,
+                        stat_cache: Optional[StatCache] = None,
+                        executor: Optional[
+                            "concurrent.futures.Executor"] = None,
+                        result_cache: Optional[ResultCache] = None,
+                        pipelined: bool = False) -> str:
     """
     Converts a samplesheet file to JSON
     :param samplesheet:
@@ -78,60 +376,228 @@ def samplesheet_to_json(samplesheet: Path,
     :param file_presence_check: Check if the files in the samplesheet are
     present
     :param file_md5_check: Check if the md5sums for the files are correct
+    :param file_duplication_check: Check if files occur more than once
+    :param generate_md5sums: Calculate the md5sums of files without an
+    md5sum after the checks
+    :param file_gzip_check: Check the integrity of gzip files
+    :param generate_checksums: Calculate these checksums for files without
+    them after the checks, in the same read as the md5sums
+    :param record_sizes: Record the sizes of the files in the readgroups
+    :param duplicate_check_mode: How files are compared in the duplication
+    check: path or inode
+    :param threads: The number of files that are hashed simultaneously
+    :param threads_per_device: The number of files on one device that are
+    hashed simultaneously
+    :param md5_cache: A cache with md5sums of previously checked files
+    :param json_backend: The library used to parse JSON samplesheets
+    :param timings: Records the time spent in each stage
+    :param stat_cache: Reuses directory listings and stat results of files
+    that were checked before
+    :param executor: Hashes the files instead of a new thread pool
+    :param result_cache: Returns the JSON of an earlier conversion of the
+    same samplesheet with the same options, if none of the files in the
+    samplesheet changed. New results are stored in the cache.
+    :param pipelined: Check the files in worker threads while the
+    samplesheet is parsed. The result is the same.
     :return: a JSON string presenting the BioWDL JSON.
     """
-    if fileformat is not None:
-        filetype = fileformat.lower().replace('.', '')
-    else:
-        filetype = samplesheet.suffix.lower().replace('.', '')
+    if timings is None:
+        timings = Timings()
+    if result_cache is not None:
+        with timings.stage("result_cache") as stage:
+            samplesheet_bytes = samplesheet.read_bytes()
+            # The options that change the output or the checks. Hashing
+            # options, such as threads, are left out.
+            key = result_cache.key(samplesheet_bytes, dict(
+                filetype=_filetype(samplesheet, fileformat),
+                old_style_json=old_style_json,
+                file_presence_check=file_presence_check,
+                file_md5_check=file_md5_check,
+                file_duplication_check=file_duplication_check,
+                generate_md5sums=generate_md5sums,
+                file_gzip_check=file_gzip_check,
+                generate_checksums=list(generate_checksums),
+                record_sizes=record_sizes,
+                duplicate_check_mode=duplicate_check_mode))
+            cached_json = result_cache.get(key)
+            stage.bytes = len(samplesheet_bytes)
+        if cached_json is not None:
+            return cached_json
+        # The files are fingerprinted with the stat results of the checks.
+        if stat_cache is None:
+            stat_cache = StatCache()
+    samplegroup = samplesheet_to_samplegroup(
+        samplesheet,
+        fileformat=fileformat,
+        file_presence_check=file_presence_check,
+        file_md5_check=file_md5_check,
+        file_duplication_check=file_duplication_check,
+        generate_md5sums=generate_md5sums,
+        file_gzip_check=file_gzip_check,
+        generate_checksums=generate_checksums,
+        record_sizes=record_sizes,
+        duplicate_check_mode=duplicate_check_mode,
+        threads=threads,
+        threads_per_device=threads_per_device,
+        md5_cache=md5_cache,
+        json_backend=json_backend,
+        timings=timings,
+        stat_cache=stat_cache,
+        executor=executor,
+        pipelined=pipelined)
+    with timings.stage("output") as stage:
+        output_json = samplegroup_to_json(samplegroup, old_style_json)
+        stage.items = len(samplegroup.samples)
+        stage.bytes = len(output_json)
+    if result_cache is not None:
+        result_cache.set(key, samplegroup.files(), output_json, stat_cache)
+        result_cache.commit()
+    return output_json
+
+
+def samplegroup_to_json(samplegroup: SampleGroup,
+                        old_style_json: bool = False) -> str:
+    """
+    :param samplegroup: a SampleGroup object
+    :param old_style_json: Return a BioWDL old-style pipeline JSON
+    :return: a JSON string presenting the BioWDL JSON.
+    """
+    if old_style_json:
+        return output_conversions.samplegroup_to_biowdl_old_json(samplegroup)
+    return output_conversions.samplegroup_to_biowdl_new_json(samplegroup)
 
-    if filetype in ["tsv", "csv"]:
-        samplegroup = input_conversions.samplesheet_csv_to_samplegroup(
-            samplesheet)
-    # JSON can also be parsed by a YAML parser.
-    elif filetype in ["yaml", "yml", "json"]:
-        samplegroup = input_conversions.biowdl_yaml_to_samplegroup(
-            samplesheet)
-    else:
-        raise NotImplementedError(
-            f"Unsupported extension: {samplesheet.suffix}")
-
-    if file_presence_check:
-        check_existence_list_of_files(samplegroup.files())
-    if file_md5_check:
-        files_with_sums = ((file, sum) for file, sum in
-                           samplegroup.files_and_md5sums()
-                           if sum is not None)
-        check_md5sums(files_with_sums)
-    if file_duplication_check:
-        check_duplicate_files(samplegroup.files())
 
+def write_json(samplegroup: SampleGroup, output: TextIO,
+               old_style_json: bool = False):
+    """
+    Writes the BioWDL JSON for a SampleGroup to a file. The JSON is written
+    one sample at a time, so the complete JSON string is never in memory.
+    :param samplegroup: a SampleGroup object
+    :param output: a file object to write to.
+    :param old_style_json: Write a BioWDL old-style pipeline JSON
+    """
     if old_style_json:
-        output_json = output_conversions.samplegroup_to_biowdl_old_json(
-            samplegroup)
+        output_conversions.write_biowdl_old_json(samplegroup, output)
     else:
-        output_json = output_conversions.samplegroup_to_biowdl_new_json(
-            samplegroup)
-    return output_json
+        output_conversions.write_biowdl_new_json(samplegroup, output)
+    output.write("\n")
+
+
+def write_samplesheet_file(samplegroup: SampleGroup, path: Path,
+                           fileformat: Optional[str] = None):
+    """
+    Writes a SampleGroup to a samplesheet file.
+    :param samplegroup: a SampleGroup object
+    :param path: the samplesheet file
+    :param fileformat: tsv, csv, yaml, yml, json. Detected from the file
+    suffix by default.
+    """
+    # Checked before the file is created.
+    filetype = _filetype(path, fileformat)
+    if filetype not in output_conversions.SAMPLESHEET_FORMATS:
+        raise NotImplementedError(
+            f"Unsupported samplesheet format: {fileformat or path.suffix}")
+    with path.open("w", newline="") as samplesheet_h:
+        output_conversions.write_samplesheet(samplegroup, samplesheet_h,
+                                             filetype)
 
 
 def main():
-    args = argument_parser().parse_args()
-
-    output_json = samplesheet_to_json(
-        samplesheet=Path(args.samplesheet),
-        old_style_json=args.old_style_json,
-        file_presence_check=args.file_check,
-        file_duplication_check=args.duplicate_check,
-        file_md5_check=args.check_file_md5sums)
-
-    # Only generate output if not validating.
-    if not args.validate:
-        if args.output is not None:
-            with open(args.output, "w") as output_h:
-                output_h.write(output_json + "\n")
-        else:
-            print(output_json)
+    parser = argument_parser()
+    args = parser.parse_args()
+    for option in ("write_samplesheet", "shard_dir"):
+        if args.result_cache is not None and \
+                getattr(args, option) is not None:
+            parser.error(f"--result-cache can not be combined with "
+                         f"--{option.replace('_', '-')}.")
+    if args.samples_per_shard < 1:
+        parser.error("--samples-per-shard must be at least 1.")
+    if args.write_samplesheet is not None and \
+            _filetype(Path(args.write_samplesheet), None) not in \
+            output_conversions.SAMPLESHEET_FORMATS:
+        parser.error(f"--write-samplesheet must end in one of: "
+                     f"{', '.join(output_conversions.SAMPLESHEET_FORMATS)}.")
+
+    timings = Timings(trace_memory=args.trace_memory)
+    try:
+        profiler = None
+        if args.profile is not None:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        md5_cache = None
+        if args.md5_cache is not None:
+            md5_cache = Md5Cache(args.md5_cache,
+                                 max_entries=args.md5_cache_size)
+        result_cache = None
+        if args.result_cache is not None:
+            result_cache = ResultCache(args.result_cache)
+        conversion_options = dict(
+            samplesheet=Path(args.samplesheet),
+            fileformat=args.format,
+            file_presence_check=args.file_check,
+            file_duplication_check=args.duplicate_check,
+            duplicate_check_mode=args.duplicate_check_mode,
+            file_md5_check=args.check_file_md5sums,
+            generate_md5sums=args.generate_md5sums,
+            file_gzip_check=args.check_gzip,
+            generate_checksums=args.generate_checksums,
+            record_sizes=args.record_sizes,
+            threads=args.threads,
+            threads_per_device=args.threads_per_device,
+            md5_cache=md5_cache,
+            json_backend=args.json_backend,
+            timings=timings,
+            pipelined=args.pipeline)
+        try:
+            if result_cache is None:
+                samplegroup = samplesheet_to_samplegroup(**conversion_options)
+            else:
+                # The cached result is the complete JSON string.
+                output_json = samplesheet_to_json(
+                    old_style_json=args.old_style_json,
+                    result_cache=result_cache, **conversion_options)
+        finally:
+            if md5_cache is not None:
+                md5_cache.close()
+            if result_cache is not None:
+                result_cache.close()
+
+        if args.write_samplesheet is not None:
+            write_samplesheet_file(samplegroup, Path(args.write_samplesheet))
+
+        # Only generate output if not validating.
+        if not args.validate:
+            with timings.stage("output") as stage:
+                with contextlib.ExitStack() as stack:
+                    output_h = (sys.stdout if args.output is None else
+                                stack.enter_context(open(args.output, "w")))
+                    if args.shard_dir is not None:
+                        shard_dir = Path(args.shard_dir)
+                        shard_dir.mkdir(parents=True, exist_ok=True)
+                        index = output_conversions.write_sharded_json(
+                            samplegroup, shard_dir, args.samples_per_shard,
+                            args.old_style_json)
+                        json.dump(index, output_h)
+                        output_h.write("\n")
+                        stage.items = len(samplegroup.samples)
+                    elif result_cache is None:
+                        write_json(samplegroup, output_h, args.old_style_json)
+                        stage.items = len(samplegroup.samples)
+                    else:
+                        output_h.write(output_json + "\n")
+    finally:
+        timings.close()
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+    if args.timings == "-":
+        print(timings.summary(), file=sys.stderr)
+    elif args.timings is not None:
+        with open(args.timings, "w") as timings_h:
+            json.dump(timings.as_dict(), timings_h, indent=2)
 
 
 if __name__ == "__main__":
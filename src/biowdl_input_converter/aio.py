@@ -0,0 +1,231 @@
+# Copyright (c) 2019 Leiden University Medical Center
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Converts samplesheets from an asyncio event loop, for instance in a web
+service. The parsing, the checks of the files and the output run in an
+executor, so the event loop is never blocked. The parsing and output code is
+the same as for samplesheet_to_json.
+
+This module is not imported with the package, because importing asyncio
+slows down the start of the command line tools.
+"""
+
+import asyncio
+import functools
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Sequence, TYPE_CHECKING, \
+    Tuple
+
+from . import parse_samplesheet, samplegroup_to_json
+from .cache import Md5Cache
+from .samplestructure import SampleGroup
+from .utils import StatCache
+from .validation import FileTasks, files_without_checksums, \
+    generate_missing_checksums, record_file_sizes, validate_samplegroup
+
+if TYPE_CHECKING:
+    import concurrent.futures
+
+# The default number of files that are checked at the same time.
+DEFAULT_MAX_CONCURRENCY = 8
+
+# Called with the stage, the number of finished tasks and the number of
+# tasks. The stages are check_files and generate_checksums.
+ProgressCallback = Callable[[str, int, int], None]
+
+
+async def _run_tasks(tasks: Sequence[Tuple[Any, ...]],
+                     stage: str,
+                     executor: Optional["concurrent.futures.Executor"],
+                     max_concurrency: int,
+                     progress: Optional[ProgressCallback]):
+    """
+    Runs FileTasks in the executor, at most max_concurrency at the same
+    time. When this is cancelled, the tasks that did not start are skipped.
+    Running tasks can not be interrupted and finish in the executor.
+    """
+    loop = asyncio.get_event_loop()
+    total = len(tasks)
+    done = 0
+    if progress is not None:
+        progress(stage, done, total)
+    task_iterator = iter(tasks)
+
+    async def worker():
+        nonlocal done
+        for task in task_iterator:
+            await loop.run_in_executor(executor, FileTasks.run, task)
+            done += 1
+            if progress is not None:
+                progress(stage, done, total)
+
+    workers = [asyncio.ensure_future(worker())
+               for _ in range(max(min(max_concurrency, total), 1))]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        for worker_future in workers:
+            worker_future.cancel()
+
+
+async def samplesheet_to_samplegroup_async(
+        samplesheet: Path,
+        fileformat: Optional[str] = None,
+        file_presence_check: bool = True,
+        file_md5_check: bool = False,
+        file_duplication_check: bool = True,
+        generate_md5sums: bool = False,
+        file_gzip_check: bool = False,
+        generate_checksums: Sequence[str] = (),
+        record_sizes: bool = False,
+        duplicate_check_mode: str = "path",
+        md5_cache: Optional[Md5Cache] = None,
+        json_backend: str = "auto",
+        stat_cache: Optional[StatCache] = None,
+        executor: Optional["concurrent.futures.Executor"] = None,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        progress: Optional[ProgressCallback] = None) -> SampleGroup:
+    """
+    Converts a samplesheet file to a SampleGroup and checks the files in it
+    without blocking the event loop. See samplesheet_to_samplegroup for the
+    other parameters and the errors.
+    :param executor: Runs the parsing, the checks and the hashing. The
+    default executor of the event loop if not given.
+    :param max_concurrency: The number of files that are checked or hashed
+    at the same time.
+    :param progress: Called in the event loop after every file check with
+    the stage, the number of finished checks and the number of checks.
+    :return: a SampleGroup object
+    """
+    loop = asyncio.get_event_loop()
+    if stat_cache is None:
+        stat_cache = StatCache()
+    samplegroup = await loop.run_in_executor(
+        executor, parse_samplesheet, samplesheet, fileformat, json_backend)
+
+    file_tasks = FileTasks(
+        file_presence_check=file_presence_check,
+        file_md5_check=file_md5_check,
+        file_duplication_check=file_duplication_check,
+        duplicate_check_mode=duplicate_check_mode,
+        md5_cache=md5_cache,
+        stat_cache=stat_cache,
+        file_gzip_check=file_gzip_check)
+
+    def check_tasks() -> List[Tuple[Any, ...]]:
+        return [task for sample in samplegroup for library in sample
+                for readgroup in library
+                for task in file_tasks.tasks(readgroup)]
+    tasks = await loop.run_in_executor(executor, check_tasks)
+    await _run_tasks(tasks, "check_files", executor, max_concurrency,
+                     progress)
+    # The validation only reads files that the tasks could not read. It
+    # does not get the executor, because it runs in it and would wait for
+    # itself if the executor has one thread.
+    report = await loop.run_in_executor(executor, functools.partial(
+        validate_samplegroup,
+        samplegroup,
+        file_presence_check=file_presence_check,
+        file_md5_check=file_md5_check,
+        file_duplication_check=file_duplication_check,
+        duplicate_check_mode=duplicate_check_mode,
+        md5_cache=md5_cache,
+        stat_cache=stat_cache,
+        file_gzip_check=file_gzip_check,
+        scanned_files=file_tasks.scanned_files))
+    report.raise_for_problems()
+
+    algorithms = tuple(dict.fromkeys(
+        (("md5",) if generate_md5sums else ()) + tuple(generate_checksums)))
+    if algorithms:
+        # The files were checked for gzip errors already.
+        generate_tasks = FileTasks(md5_cache=md5_cache, stat_cache=stat_cache)
+        files = await loop.run_in_executor(
+            executor, files_without_checksums, samplegroup, algorithms,
+            report.digests)
+        await _run_tasks(
+            [(generate_tasks.scan, file, file_algorithms)
+             for file, file_algorithms in files.items()],
+            "generate_checksums", executor, max_concurrency, progress)
+        known_digests = dict(report.digests)
+        known_digests.update(
+            (file, scanned.digests)
+            for file, scanned in generate_tasks.scanned_files.items())
+        await loop.run_in_executor(executor, functools.partial(
+            generate_missing_checksums,
+            samplegroup,
+            algorithms,
+            md5_cache=md5_cache,
+            stat_cache=stat_cache,
+            known_digests=known_digests))
+    if record_sizes:
+        await loop.run_in_executor(executor, functools.partial(
+            record_file_sizes, samplegroup, threads=max_concurrency,
+            stat_cache=stat_cache))
+    if md5_cache is not None:
+        await loop.run_in_executor(executor, md5_cache.commit)
+    return samplegroup
+
+
+async def samplesheet_to_json_async(
+        samplesheet: Path,
+        fileformat: Optional[str] = None,
+        old_style_json: bool = False,
+        file_presence_check: bool = True,
+        file_md5_check: bool = False,
+        file_duplication_check: bool = True,
+        generate_md5sums: bool = False,
+        file_gzip_check: bool = False,
+        generate_checksums: Sequence[str] = (),
+        record_sizes: bool = False,
+        duplicate_check_mode: str = "path",
+        md5_cache: Optional[Md5Cache] = None,
+        json_backend: str = "auto",
+        stat_cache: Optional[StatCache] = None,
+        executor: Optional["concurrent.futures.Executor"] = None,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        progress: Optional[ProgressCallback] = None) -> str:
+    """
+    Converts a samplesheet file to JSON without blocking the event loop.
+    See samplesheet_to_json and samplesheet_to_samplegroup_async for the
+    parameters.
+    :return: a JSON string presenting the BioWDL JSON.
+    """
+    samplegroup = await samplesheet_to_samplegroup_async(
+        samplesheet,
+        fileformat=fileformat,
+        file_presence_check=file_presence_check,
+        file_md5_check=file_md5_check,
+        file_duplication_check=file_duplication_check,
+        generate_md5sums=generate_md5sums,
+        file_gzip_check=file_gzip_check,
+        generate_checksums=generate_checksums,
+        record_sizes=record_sizes,
+        duplicate_check_mode=duplicate_check_mode,
+        md5_cache=md5_cache,
+        json_backend=json_backend,
+        stat_cache=stat_cache,
+        executor=executor,
+        max_concurrency=max_concurrency,
+        progress=progress)
+    return await asyncio.get_event_loop().run_in_executor(
+        executor, samplegroup_to_json, samplegroup, old_style_json)
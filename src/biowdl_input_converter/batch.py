@@ -0,0 +1,305 @@
+# Copyright (c) 2019 Leiden University Medical Center
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Converts many samplesheets in one process. The samplesheets share one pool
+of threads for hashing files, one md5 cache and one cache of directory
+listings and stat results, so files and directories that occur in several
+samplesheets are only looked up once. Samplesheets are converted
+concurrently. A samplesheet that fails is reported, but does not stop the
+conversion of the other samplesheets.
+"""
+
+import argparse
+import os
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence
+
+from . import add_conversion_arguments, samplesheet_to_samplegroup, \
+    write_json, write_samplesheet_file
+from .cache import Md5Cache
+from .utils import StatCache
+
+
+@dataclass()
+class BatchResult:
+    """The outcome of the conversion of one samplesheet."""
+    samplesheet: Path
+    # None when only validating.
+    output: Optional[Path] = None
+    error: Optional[Exception] = None
+    # The samplesheet with generated md5sums, if it was written.
+    samplesheet_output: Optional[Path] = None
+
+
+def read_manifest(manifest: Path) -> List[Path]:
+    """
+    Reads a manifest with one samplesheet per line. Empty lines and lines
+    starting with # are ignored. Relative paths are relative to the
+    directory of the manifest.
+    :param manifest: a pathlib.Path to the manifest.
+    :return: The samplesheets in the manifest.
+    """
+    samplesheets = []
+    with manifest.open("r") as manifest_h:
+        for line in manifest_h:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                samplesheets.append(manifest.parent / line)
+    return samplesheets
+
+
+def output_paths(samplesheets: Iterable[Path], output_dir: Path,
+                 suffix: Optional[str] = ".json") -> List[Path]:
+    """
+    Names the output of each samplesheet after the samplesheet.
+    :param samplesheets: The samplesheets.
+    :param output_dir: The directory for the outputs.
+    :param suffix: The suffix of the outputs. None keeps the suffix of the
+    samplesheet.
+    :return: The output paths in the same order as the samplesheets.
+    """
+    outputs = [output_dir / (samplesheet.name if suffix is None
+                             else samplesheet.stem + suffix)
+               for samplesheet in samplesheets]
+    seen = set()
+    duplicated_outputs = []
+    for output in outputs:
+        if output in seen:
+            duplicated_outputs.append(output)
+        seen.add(output)
+    if len(duplicated_outputs) > 0:
+        raise ValueError(f"Multiple samplesheets would be written to: "
+                         f"{', '.join(map(str, duplicated_outputs))}. "
+                         f"Samplesheets should have unique file names.")
+    return outputs
+
+
+def convert_samplesheets(samplesheets: Sequence[Path],
+                         output_dir: Optional[Path] = None,
+                         samplesheet_output_dir: Optional[Path] = None,
+                         fileformat: Optional[str] = None,
+                         old_style_json: bool = False,
+                         file_presence_check: bool = True,
+                         file_md5_check: bool = False,
+                         file_duplication_check: bool = True,
+                         generate_md5sums: bool = False,
+                         file_gzip_check: bool = False,
+                         generate_checksums: Sequence[str] = (),
+                         record_sizes: bool = False,
+                         duplicate_check_mode: str = "path",
+                         jobs: int = 1,
+                         threads: int = 1,
+                         threads_per_device: Optional[int] = None,
+                         md5_cache: Optional[Md5Cache] = None,
+                         json_backend: str = "auto",
+                         stat_cache: Optional[StatCache] = None,
+                         pipelined: bool = False
+                         ) -> List[BatchResult]:
+    """
+    Converts samplesheets to JSON files in output_dir. Errors are recorded
+    in the results instead of raised.
+    :param samplesheets: The samplesheets.
+    :param output_dir: The directory for the JSON files. Every JSON file is
+    named after its samplesheet. When None the samplesheets are only
+    validated.
+    :param samplesheet_output_dir: Write the samplesheets, with the
+    checksums from generate_md5sums and generate_checksums, to this
+    directory. The samplesheets keep their file names.
+    :param fileformat: tsv, csv, yaml, yml, json
+    :param old_style_json: Write BioWDL old-style pipeline JSON
+    :param file_presence_check: Check if the files in the samplesheets are
+    present
+    :param file_md5_check: Check if the md5sums for the files are correct
+    :param file_duplication_check: Check if files occur more than once in a
+    samplesheet
+    :param generate_md5sums: Calculate the md5sums of files without an
+    md5sum after the checks
+    :param file_gzip_check: Check the integrity of gzip files
+    :param generate_checksums: Calculate these checksums for files without
+    them after the checks
+    :param record_sizes: Record the sizes of the files in the readgroups
+    :param duplicate_check_mode: How files are compared in the duplication
+    check: path or inode
+    :param jobs: The number of samplesheets that are converted
+    simultaneously
+    :param threads: The number of files that are hashed simultaneously, for
+    all samplesheets together
+    :param threads_per_device: The number of files on one device that are
+    hashed simultaneously, for each samplesheet
+    :param md5_cache: A cache with md5sums of previously checked files
+    :param json_backend: The library used to parse JSON samplesheets
+    :param stat_cache: A cache for directory listings and stat results. A
+    new cache is used for the batch if not given.
+    :param pipelined: Check the files of each samplesheet in a worker
+    thread while it is parsed.
+    :return: a BatchResult for every samplesheet, in the same order.
+    """
+    if stat_cache is None:
+        stat_cache = StatCache()
+    outputs = ([None] * len(samplesheets) if output_dir is None
+               else output_paths(samplesheets, output_dir)
+               )  # type: Sequence[Optional[Path]]
+    samplesheet_outputs = (
+        [None] * len(samplesheets) if samplesheet_output_dir is None
+        else output_paths(samplesheets, samplesheet_output_dir, suffix=None)
+    )  # type: Sequence[Optional[Path]]
+    for directory in (output_dir, samplesheet_output_dir):
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+
+    import concurrent.futures
+
+    def convert(samplesheet: Path, output: Optional[Path],
+                samplesheet_output: Optional[Path],
+                md5_executor: concurrent.futures.Executor) -> None:
+        samplegroup = samplesheet_to_samplegroup(
+            samplesheet,
+            fileformat=fileformat,
+            file_presence_check=file_presence_check,
+            file_md5_check=file_md5_check,
+            file_duplication_check=file_duplication_check,
+            generate_md5sums=generate_md5sums,
+            file_gzip_check=file_gzip_check,
+            generate_checksums=generate_checksums,
+            record_sizes=record_sizes,
+            duplicate_check_mode=duplicate_check_mode,
+            threads_per_device=threads_per_device,
+            md5_cache=md5_cache,
+            json_backend=json_backend,
+            stat_cache=stat_cache,
+            executor=md5_executor,
+            pipelined=pipelined)
+        if output is not None:
+            with output.open("w") as output_h:
+                write_json(samplegroup, output_h, old_style_json)
+        if samplesheet_output is not None:
+            write_samplesheet_file(samplegroup, samplesheet_output,
+                                   fileformat)
+
+    # Separate pools, so samplesheets waiting for their hashes never occupy
+    # the threads that do the hashing.
+    with concurrent.futures.ThreadPoolExecutor(max(threads, 1)) \
+            as md5_executor, \
+            concurrent.futures.ThreadPoolExecutor(max(jobs, 1)) \
+            as samplesheet_executor:
+        futures = [samplesheet_executor.submit(convert, *paths, md5_executor)
+                   for paths in zip(samplesheets, outputs,
+                                    samplesheet_outputs)]
+        results = []
+        for samplesheet, output, samplesheet_output, future in zip(
+                samplesheets, outputs, samplesheet_outputs, futures):
+            error = future.exception()
+            results.append(BatchResult(
+                samplesheet, output,
+                error if isinstance(error, Exception) else None,
+                samplesheet_output))
+    return results
+
+
+def argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Convert many samplesheets for BioWDL pipelines in one "
+                    "process.")
+    parser.add_argument("samplesheets", type=str, nargs="*",
+                        help="The input samplesheets. Formats will be "
+                             "automatically detected from the file suffixes "
+                             "if --format argument not provided")
+    parser.add_argument("-m", "--manifest", action="append", default=[],
+                        help="A file with one samplesheet per line. Relative "
+                             "paths are relative to the directory of the "
+                             "manifest. Can be given multiple times.")
+    parser.add_argument("-o", "--output-dir",
+                        help="The directory to which the json files are "
+                             "written. Each json file is named after its "
+                             "samplesheet. Required unless --validate is "
+                             "given.")
+    parser.add_argument("--samplesheet-output-dir",
+                        help="Write the samplesheets, with the checksums "
+                             "from --generate-md5sums and "
+                             "--generate-checksums, to this directory. The "
+                             "samplesheets keep their file names.")
+    parser.add_argument("-j", "--jobs", type=int,
+                        default=min(os.cpu_count() or 1, 8),
+                        help="The number of samplesheets that are converted "
+                             "at the same time. Default: the number of CPUs "
+                             "up to 8")
+    add_conversion_arguments(parser)
+    return parser
+
+
+def main():
+    parser = argument_parser()
+    args = parser.parse_args()
+    samplesheets = [Path(samplesheet) for samplesheet in args.samplesheets]
+    for manifest in args.manifest:
+        samplesheets.extend(read_manifest(Path(manifest)))
+    if len(samplesheets) == 0:
+        parser.error("no samplesheets given")
+    if args.output_dir is None and not args.validate:
+        parser.error("--output-dir is required unless --validate is given")
+    output_dir = None if args.validate else Path(args.output_dir)
+
+    md5_cache = None
+    if args.md5_cache is not None:
+        md5_cache = Md5Cache(args.md5_cache, max_entries=args.md5_cache_size)
+    try:
+        try:
+            results = convert_samplesheets(
+                samplesheets,
+                output_dir=output_dir,
+                samplesheet_output_dir=(
+                    None if args.samplesheet_output_dir is None
+                    else Path(args.samplesheet_output_dir)),
+                fileformat=args.format,
+                old_style_json=args.old_style_json,
+                file_presence_check=args.file_check,
+                file_md5_check=args.check_file_md5sums,
+                file_duplication_check=args.duplicate_check,
+                generate_md5sums=args.generate_md5sums,
+                file_gzip_check=args.check_gzip,
+                generate_checksums=args.generate_checksums,
+                record_sizes=args.record_sizes,
+                duplicate_check_mode=args.duplicate_check_mode,
+                jobs=args.jobs,
+                threads=args.threads,
+                threads_per_device=args.threads_per_device,
+                md5_cache=md5_cache,
+                json_backend=args.json_backend,
+                pipelined=args.pipeline)
+        except ValueError as error:
+            parser.error(str(error))
+    finally:
+        if md5_cache is not None:
+            md5_cache.close()
+
+    failed = [result for result in results if result.error is not None]
+    for result in failed:
+        print(f"{result.samplesheet}: {type(result.error).__name__}: "
+              f"{result.error}", file=sys.stderr)
+    if len(failed) > 0:
+        sys.exit(f"{len(failed)} of {len(results)} samplesheets failed.")
+
+
+if __name__ == "__main__":
+    main()
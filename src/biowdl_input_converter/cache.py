@@ -0,0 +1,351 @@
+# Copyright (c) 2019 Leiden University Medical Center
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Persistent caches that allow skipping work that was done in earlier runs.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Mapping, Optional, \
+    TYPE_CHECKING, Tuple, Union
+
+if TYPE_CHECKING:
+    from .utils import StatCache
+
+Fingerprint = Tuple[str, int, int, int, int]
+# The size, modification time, inode and device of a file.
+StatFingerprint = Tuple[int, int, int, int]
+
+DEFAULT_MAX_ENTRIES = 1_000_000
+DEFAULT_MAX_RESULTS = 1000
+# Part of every result cache key. Increase it when the output of a
+# conversion changes, so results of older versions are not used.
+RESULT_FORMAT_VERSION = 1
+
+
+class _SQLiteCache:
+    """
+    A cache in a SQLite database. The least recently used entries are
+    removed when the cache grows beyond max_entries. A cache can be shared
+    between threads.
+
+    A write locks the whole database for other processes until it is
+    committed. Subclasses therefore keep their writes short, so a cache
+    can be shared by concurrent jobs.
+    """
+    # The table with the entries, which has a last_used column.
+    _table = ""
+    _schema = ""
+
+    def __init__(self, path: Union[str, os.PathLike], max_entries: int):
+        import sqlite3
+        self.max_entries = max_entries
+        # A generous timeout, as the cache may be shared by concurrent jobs.
+        self.connection = sqlite3.connect(str(path), timeout=60,
+                                          check_same_thread=False)
+        # The connection is shared, so a transaction can not be interleaved
+        # with statements from other threads.
+        self._lock = threading.RLock()
+        self.connection.executescript(self._schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute(
+                f"SELECT COUNT(*) FROM {self._table}").fetchone()[0]
+
+    def _write_pending(self):
+        """Writes changes that were kept in memory, in the transaction of
+        commit."""
+
+    def commit(self):
+        """
+        Remove the least recently used entries that do not fit in the cache
+        and write all changes to disk.
+        """
+        with self._lock:
+            self._write_pending()
+            excess = self.connection.execute(
+                f"SELECT COUNT(*) FROM {self._table}"
+            ).fetchone()[0] - self.max_entries
+            # Only the oldest entries are read, through the index on
+            # last_used.
+            if excess > 0:
+                self.connection.execute(
+                    f"DELETE FROM {self._table} WHERE rowid IN (SELECT rowid "
+                    f"FROM {self._table} ORDER BY last_used LIMIT ?)",
+                    (excess,))
+            self.connection.commit()
+
+    def close(self):
+        with self._lock:
+            self.commit()
+            self.connection.close()
+
+
+class Md5Cache(_SQLiteCache):
+    """
+    Stores md5sums in a SQLite database. A file is identified by its
+    fingerprint: real path, size, modification time, inode and device. When
+    any of these change the md5sum is calculated again.
+
+    The least recently used entries are removed when the cache grows beyond
+    max_entries. A cache can be shared between threads.
+
+    New md5sums and the use of stored md5sums are kept in memory and
+    written in one short transaction by commit, or when PENDING_WRITES
+    changes are waiting. Other jobs that use the same database are
+    therefore not locked out while files are hashed.
+    """
+    _table = "md5sums"
+    _schema = """
+        CREATE TABLE IF NOT EXISTS md5sums (
+            realpath TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            device INTEGER NOT NULL,
+            md5sum TEXT NOT NULL,
+            last_used REAL NOT NULL,
+            PRIMARY KEY (realpath, size, mtime_ns, inode, device));
+        CREATE INDEX IF NOT EXISTS md5sums_last_used
+            ON md5sums (last_used);
+    """
+
+    # The number of waiting changes after which they are committed.
+    PENDING_WRITES = 1000
+
+    def __init__(self, path: Union[str, os.PathLike],
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        super().__init__(path, max_entries)
+        # New md5sums by real path, with their fingerprint and time of use.
+        self._new = {}  # type: Dict[str, Tuple[Fingerprint, str, float]]
+        # The time of use of stored md5sums by fingerprint.
+        self._used = {}  # type: Dict[Fingerprint, float]
+
+    def __len__(self):
+        with self._lock:
+            self.commit()
+            return super().__len__()
+
+    @staticmethod
+    def fingerprint(filepath: Union[str, os.PathLike],
+                    stat: Optional[os.stat_result] = None
+                    ) -> Optional[Fingerprint]:
+        """
+        Create the fingerprint for a file.
+        :param filepath: a pathlib.Path to the file.
+        :param stat: the os.stat result of the file, if it is already known.
+        :return: a fingerprint or None if the file can not be accessed.
+        """
+        if stat is None:
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                return None
+        return (os.path.realpath(filepath), stat.st_size, stat.st_mtime_ns,
+                stat.st_ino, stat.st_dev)
+
+    def get(self, fingerprint: Optional[Fingerprint]) -> Optional[str]:
+        """
+        Look up a md5sum.
+        :param fingerprint: a fingerprint created with Md5Cache.fingerprint.
+        :return: the md5sum or None if it is not in the cache.
+        """
+        if fingerprint is None:
+            return None
+        with self._lock:
+            new = self._new.get(fingerprint[0])
+            if new is not None:
+                # Stored entries for this path are replaced on commit.
+                if new[0] != fingerprint:
+                    return None
+                self._new[fingerprint[0]] = (fingerprint, new[1],
+                                             time.time())
+                return new[1]
+            # A read does not lock the database for other jobs.
+            result = self.connection.execute(
+                "SELECT md5sum FROM md5sums WHERE realpath=? AND size=? AND "
+                "mtime_ns=? AND inode=? AND device=?",
+                fingerprint).fetchone()
+            if result is None:
+                return None
+            self._used[fingerprint] = time.time()
+            self._commit_if_many_pending()
+        return result[0]
+
+    def set(self, fingerprint: Optional[Fingerprint], md5sum: str):
+        """
+        Store a md5sum. The fingerprint should be taken before the file was
+        hashed, so a file that changes during hashing is not cached with the
+        new fingerprint.
+        :param fingerprint: a fingerprint created with Md5Cache.fingerprint.
+        :param md5sum: the md5sum.
+        """
+        if fingerprint is None:
+            return
+        with self._lock:
+            self._new[fingerprint[0]] = (fingerprint, md5sum, time.time())
+            self._commit_if_many_pending()
+
+    def _commit_if_many_pending(self):
+        if len(self._new) + len(self._used) >= self.PENDING_WRITES:
+            self.commit()
+
+    def _write_pending(self):
+        self.connection.executemany(
+            "UPDATE md5sums SET last_used=? WHERE realpath=? AND size=? "
+            "AND mtime_ns=? AND inode=? AND device=?",
+            [(last_used, *fingerprint)
+             for fingerprint, last_used in self._used.items()])
+        # Entries for earlier versions of the files will never be used
+        # again.
+        self.connection.executemany(
+            "DELETE FROM md5sums WHERE realpath=?",
+            [(realpath,) for realpath in self._new])
+        self.connection.executemany(
+            "INSERT INTO md5sums VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(*fingerprint, md5sum, last_used)
+             for fingerprint, md5sum, last_used in self._new.values()])
+        self._new.clear()
+        self._used.clear()
+
+
+def stat_fingerprint(stat: Optional[os.stat_result]
+                     ) -> Optional[StatFingerprint]:
+    """
+    :param stat: the os.stat result of a file, or None if it can not be
+    accessed.
+    :return: the size, modification time, inode and device of the file.
+    """
+    if stat is None:
+        return None
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino, stat.st_dev
+
+
+class ResultCache(_SQLiteCache):
+    """
+    Stores the results of conversions in a SQLite database. A result is
+    identified by a key of the samplesheet contents and the conversion
+    options. It is only used while every file in the samplesheet has the
+    same stat fingerprint as when the result was stored, so a changed,
+    added or removed file invalidates the result.
+
+    The least recently used entries are removed when the cache grows beyond
+    max_entries. A cache can be shared between threads.
+    """
+    _table = "results"
+    _schema = """
+        CREATE TABLE IF NOT EXISTS results (
+            key TEXT PRIMARY KEY,
+            files TEXT NOT NULL,
+            result TEXT NOT NULL,
+            last_used REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS results_last_used
+            ON results (last_used);
+    """
+
+    def __init__(self, path: Union[str, os.PathLike],
+                 max_entries: int = DEFAULT_MAX_RESULTS):
+        super().__init__(path, max_entries)
+
+    @staticmethod
+    def key(samplesheet: bytes, options: Mapping[str, Any]) -> str:
+        """
+        :param samplesheet: the contents of the samplesheet.
+        :param options: the conversion options that change the result. The
+        values must be JSON serializable.
+        :return: a key for the result of the conversion.
+        """
+        import hashlib
+        hasher = hashlib.sha256(samplesheet)
+        hasher.update(json.dumps(
+            [RESULT_FORMAT_VERSION, options], sort_keys=True).encode())
+        return hasher.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a result. Every file of the result is stat'ed to check that
+        it did not change. A result with changed files is removed.
+        :param key: a key created with ResultCache.key.
+        :return: the result or None if it is not in the cache or files
+        changed.
+        """
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT files, result FROM results WHERE key=?",
+                (key,)).fetchone()
+        if row is None:
+            return None
+        files, result = row
+        for path, fingerprint in json.loads(files):
+            try:
+                stat = os.stat(path)  # type: Optional[os.stat_result]
+            except OSError:
+                stat = None
+            current = stat_fingerprint(stat)
+            if current != (None if fingerprint is None
+                           else tuple(fingerprint)):
+                with self._lock:
+                    self.connection.execute(
+                        "DELETE FROM results WHERE key=?", (key,))
+                    self.connection.commit()
+                return None
+        # Committed right away, so a cache that stays open, for instance in
+        # a service, does not lock the database for other jobs.
+        with self._lock:
+            self.connection.execute(
+                "UPDATE results SET last_used=? WHERE key=?",
+                (time.time(), key))
+            self.connection.commit()
+        return result
+
+    def set(self, key: str, files: Iterable[str], result: str,
+            stat_cache: Optional["StatCache"] = None):
+        """
+        Store a result with the fingerprints of its files. The fingerprints
+        should be taken before the files were checked, for instance by
+        passing the StatCache of the checks, so a file that changes during
+        the conversion invalidates the result.
+        :param key: a key created with ResultCache.key.
+        :param files: the files in the samplesheet.
+        :param result: the result of the conversion.
+        :param stat_cache: the stat results of the conversion.
+        """
+        if stat_cache is None:
+            from .utils import StatCache
+            stat_cache = StatCache()
+        fingerprints = [
+            (path, stat_fingerprint(stat_cache.stat(path)))
+            for path in dict.fromkeys(files)
+        ]  # type: List[Tuple[str, Optional[StatFingerprint]]]
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                (key, json.dumps(fingerprints), result, time.time()))
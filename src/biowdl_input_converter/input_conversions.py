@@ -22,102 +22,218 @@
 All conversions to samplestructure.SampleGroup from a variety of formats.
 """
 
+import json
+import re
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Callable, Dict, Optional
 
-import yaml
+from .samplestructure import CHECKSUM_COLUMNS, EMPTY_PROPERTIES, Library, \
+    ReadGroup, Sample, SampleGroup
+from .utils import csv_rows_generator, gc_paused, json_loads_function
 
-from .samplestructure import Library, ReadGroup, Sample, SampleGroup
-from .utils import csv_to_dict_generator
 
-
-def biowdl_yaml_to_samplegroup(yaml_file: Path) -> SampleGroup:
+def biowdl_yaml_to_samplegroup(yaml_file: Path,
+                               on_readgroup: Optional[
+                                   Callable[[ReadGroup], None]] = None
+                               ) -> SampleGroup:
     """
            Converts BioWDL samplesheets to SampleGroup
            :param yaml_file: Path to a yaml file
+           :param on_readgroup: See biowdl_dict_to_samplegroup.
            :return: a SampleGroup class
            """
+    import yaml
+    # The libyaml based loader is a lot faster than the python implementation.
+    # It is not available when PyYAML was installed without libyaml.
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
     with yaml_file.open("r") as yaml_h:
-        samplesheet_dict = yaml.safe_load(yaml_h)
+        samplesheet_dict = yaml.load(yaml_h, Loader=loader)  # nosec
+    return biowdl_dict_to_samplegroup(samplesheet_dict, on_readgroup)
+
+
+def biowdl_json_to_samplegroup(json_file: Path, json_backend: str = "auto",
+                               on_readgroup: Optional[
+                                   Callable[[ReadGroup], None]] = None
+                               ) -> SampleGroup:
+    """
+    Converts BioWDL samplesheets in JSON format to SampleGroup
+    :param json_file: Path to a json file
+    :param json_backend: The JSON library used for parsing. orjson, ujson
+    or json. 'auto' selects the fastest library that is installed.
+    :param on_readgroup: See biowdl_dict_to_samplegroup.
+    :return: a SampleGroup class
+    """
+    json_bytes = json_file.read_bytes()
+    loads = json_loads_function(json_backend)
+    # Faster libraries may convert integers that do not fit in 64 bits to
+    # floats. The json module is used when the file contains such numbers.
+    if re.search(rb"[0-9]{19}", json_bytes):
+        loads = json.loads
+    try:
+        samplesheet_dict = loads(json_bytes)
+    except ValueError:
+        if loads is json.loads:
+            raise
+        # The json module accepts some input that faster libraries reject,
+        # such as NaN or very large integers.
+        samplesheet_dict = json.loads(json_bytes)
+    return biowdl_dict_to_samplegroup(samplesheet_dict, on_readgroup)
+
 
+@gc_paused()
+def biowdl_dict_to_samplegroup(samplesheet_dict: Dict[str, Any],
+                               on_readgroup: Optional[
+                                   Callable[[ReadGroup], None]] = None
+                               ) -> SampleGroup:
+    """
+    Converts a BioWDL samplesheet structure, as loaded from YAML or JSON, to
+    SampleGroup. The dictionaries in the structure are modified.
+    :param samplesheet_dict: the samplesheet structure
+    :param on_readgroup: called with every readgroup after it is added.
+    :return: a SampleGroup class
+    """
     # We iterate through all levels of the dictionary here. pop() is used
     # here because it removes properties we know exist. Additional
     # properties remain. These are added as is.
     samplegroup = SampleGroup()
+    checksum_columns = frozenset(CHECKSUM_COLUMNS)
     for sample_dict in samplesheet_dict["samples"]:  # type: Dict[str, Any]
         sample = Sample(id=sample_dict.pop("id"))
+        sample_dict.pop("total_size", None)
         for lib_dict in sample_dict.pop("libraries"):  # type: Dict[str, Any]
             library = Library(id=lib_dict.pop("id"))
             for rg_dict in lib_dict.pop("readgroups"):  # type: Dict[str, Any]
-                read_struct = rg_dict.pop("reads")  # type: Dict[str, str]
-                library.append(ReadGroup(
+                read_struct = rg_dict.pop("reads")  # type: Dict[str, Any]
+                # Sizes of earlier conversions. The totals are calculated
+                # from the sizes of the reads.
+                rg_dict.pop("total_size", None)
+                checksums = {key: value for key, value in read_struct.items()
+                             if key in checksum_columns}
+                readgroup = ReadGroup(
                     id=rg_dict.pop("id"),
                     R1=read_struct["R1"],
                     R1_md5=read_struct.get("R1_md5", None),
                     R2=read_struct.get("R2", None),
                     R2_md5=read_struct.get("R2_md5", None),
-                    additional_properties=rg_dict
-                ))
-            library.additional_properties.update(lib_dict)
+                    additional_properties=rg_dict or EMPTY_PROPERTIES,
+                    checksums=checksums or EMPTY_PROPERTIES,
+                    R1_size=read_struct.get("R1_size", None),
+                    R2_size=read_struct.get("R2_size", None)
+                )
+                library.append(readgroup)
+                if on_readgroup is not None:
+                    on_readgroup(readgroup)
+            if lib_dict:
+                library.additional_properties = lib_dict
             sample.append(library)
-        sample.additional_properties.update(sample_dict)
+        if sample_dict:
+            sample.additional_properties = sample_dict
         samplegroup.append(sample)
     return samplegroup
 
 
-def samplesheet_csv_to_samplegroup(samplesheet_file: Path) -> SampleGroup:
+# The samplesheet does not create reference cycles, so the garbage collector
+# only slows down building the SampleGroup.
+@gc_paused()
+def samplesheet_csv_to_samplegroup(samplesheet_file: Path,
+                                   on_readgroup: Optional[
+                                       Callable[[ReadGroup], None]] = None
+                                   ) -> SampleGroup:
     """
     Converts a samplesheet file to a SampleGroup class
     :param samplesheet_file: a pathlib.Path to a file.
+    :param on_readgroup: called with every readgroup after it is added, for
+    instance to check the files while the rest of the file is parsed.
     :return: a SampleGroup object
     """
-    samples = {}  # type: Dict[str, Any]
-    for row_dict in csv_to_dict_generator(samplesheet_file):
-        sample = row_dict.pop("sample")
-        # In legacy cases readgroups were labelled libraries,
-        # proper libraries didn't exist, for the new format the are
-        # the same as samples.
-        if "readgroup" in row_dict.keys():
-            lib = row_dict.pop("library")
-            readgroup = row_dict.pop("readgroup")
+    rows = csv_rows_generator(samplesheet_file)
+    samplegroup = SampleGroup()
+    try:
+        header = next(rows)
+    except StopIteration:
+        return samplegroup
+
+    # The column index of each heading is looked up once. If a heading occurs
+    # multiple times the last column is used.
+    columns = {heading: index for index, heading in enumerate(header)}
+    sample_column = columns["sample"]
+    # In legacy cases readgroups were labelled libraries,
+    # proper libraries didn't exist, for the new format the are
+    # the same as samples.
+    if "readgroup" in columns:
+        library_column = columns["library"]  # type: Optional[int]
+        readgroup_column = columns["readgroup"]
+    else:
+        library_column = None
+        readgroup_column = columns["library"]
+    r1_column = columns["R1"]
+    r1_md5_column = columns.get("R1_md5", None)
+    r2_column = columns.get("R2", None)
+    r2_md5_column = columns.get("R2_md5", None)
+    checksum_columns = [(heading, columns[heading])
+                        for heading in CHECKSUM_COLUMNS if heading in columns]
+    # All remaining columns are additional properties at the sample level.
+    property_columns = [
+        (heading, index) for heading, index in columns.items()
+        if heading not in ("sample", "library", "readgroup", "R1", "R1_md5",
+                           "R2", "R2_md5", *CHECKSUM_COLUMNS)]
+
+    sample_properties = {}  # type: Dict[str, Dict[str, Optional[str]]]
+    for row in rows:
+        if len(row) < len(header):
+            raise ValueError(f"Row has fewer fields than the header: {row}")
+        sample_id = row[sample_column]
+        library_id = (row[library_column] if library_column is not None
+                      else sample_id)
+        readgroup_id = row[readgroup_column]
+
+        sample = samplegroup.get(sample_id)
+        if sample is None:
+            properties = {
+                heading: row[index] if row[index] != "" else None
+                for heading, index in property_columns}
+            sample = Sample(sample_id,
+                            additional_properties=properties or
+                            EMPTY_PROPERTIES)
+            sample_properties[sample_id] = properties
+            samplegroup.append(sample)
         else:
-            lib = sample
-            readgroup = row_dict.pop("library")
-
-        rg_id = f"{sample}-{lib}-{readgroup}"
-        if sample not in samples.keys():
-            samples[sample] = {}
-        if lib not in samples[sample].keys():
-            samples[sample][lib] = {}
-        if readgroup in samples[sample][lib].keys():
-            raise ValueError(f"Duplicate readgroup id {rg_id}")
-        read1_md5 = row_dict.pop("R1_md5", None)
-        read2_md5 = row_dict.pop("R2_md5", None)
-        read2 = row_dict.pop("R2", None)
-        samples[sample][lib][readgroup] = {
-            "R1": row_dict.pop("R1"),
-            "R1_md5": read1_md5 if read1_md5 != "" else None,
-            "R2": read2 if read2 != "" else None,
-            "R2_md5": read2_md5 if read2_md5 != "" else None
-        }
-        # Add all remaining properties to additional properties at the
-        # sample level
-        if "additional_properties" not in samples[sample].keys():
-            samples[sample]["additional_properties"] = {}
-        for key, value in row_dict.items():
-            existing_value = samples[sample][
-                "additional_properties"].get(key, None)
-
-            updated_value = value if value != "" else None
-
-            if existing_value is None:
-                samples[sample]["additional_properties"][key] = updated_value
-            else:
-                if (updated_value is not None
-                        and existing_value != updated_value):
+            properties = sample_properties[sample_id]
+            for heading, index in property_columns:
+                value = row[index]
+                if value == "":
+                    continue
+                existing_value = properties[heading]
+                if existing_value is None:
+                    properties[heading] = value
+                elif existing_value != value:
                     raise ValueError(
-                        f"Conflicting fields in column '{key}' for sample "
-                        f"'{sample}'!"
+                        f"Conflicting fields in column '{heading}' for "
+                        f"sample '{sample_id}'!"
                     )
 
-    return SampleGroup.from_dict_of_dicts(samples)
+        library = sample.get(library_id)
+        if library is None:
+            library = Library(library_id)
+            sample.append(library)
+
+        if readgroup_id in library:
+            raise ValueError(f"Duplicate readgroup id "
+                             f"{sample_id}-{library_id}-{readgroup_id}")
+        checksums = ({heading: row[index] for heading, index
+                      in checksum_columns if row[index] != ""}
+                     if checksum_columns else None)
+        readgroup = ReadGroup(
+            id=readgroup_id,
+            R1=row[r1_column],
+            R1_md5=(row[r1_md5_column] or None
+                    if r1_md5_column is not None else None),
+            R2=row[r2_column] or None if r2_column is not None else None,
+            R2_md5=(row[r2_md5_column] or None
+                    if r2_md5_column is not None else None),
+            checksums=checksums or EMPTY_PROPERTIES
+        )
+        library.append(readgroup)
+        if on_readgroup is not None:
+            on_readgroup(readgroup)
+    return samplegroup
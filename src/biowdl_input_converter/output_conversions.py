@@ -21,11 +21,67 @@
 """
 All conversions from samplestructure.SampleGroup to a variety of formats.
 """
+import csv
 import json
+import os
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Set, TextIO
 
-import yaml
+from .samplestructure import CHECKSUM_COLUMNS, Sample, SampleGroup
 
-from .samplestructure import SampleGroup
+
+def _add_total_size(sample: Sample, sample_dict: Dict[str, Any]):
+    """Adds the total size of the reads if the sizes were recorded."""
+    total_size = sample.total_size
+    if total_size is not None:
+        sample_dict["total_size"] = total_size
+
+
+def sample_to_biowdl_old_structure(sample: Sample) -> Dict[str, Any]:
+    """
+    Converts a Sample object to a sample in the biowdl old structure.
+    :param sample: A sample object
+    :return: a structure in dictionaries that can be converted to a WDL struct.
+    """
+    libraries = []
+    for library in sample:
+        readgroups = []
+        for readgroup in library:
+            reads = {
+                "R1": readgroup.R1,
+            }
+            if readgroup.R1_md5 is not None:
+                reads["R1_md5"] = readgroup.R1_md5
+            if readgroup.R2 is not None:
+                reads["R2"] = readgroup.R2
+            if readgroup.R2_md5 is not None:
+                reads["R2_md5"] = readgroup.R2_md5
+            reads.update(readgroup.checksums)
+            if readgroup.R1_size is not None:
+                reads["R1_size"] = readgroup.R1_size
+            if readgroup.R2_size is not None:
+                reads["R2_size"] = readgroup.R2_size
+            readgroup_dict = {
+                "reads": reads,
+                "id": readgroup.id
+            }
+            readgroup_dict.update(readgroup.additional_properties)
+            if readgroup.total_size is not None:
+                readgroup_dict["total_size"] = readgroup.total_size
+            readgroups.append(readgroup_dict)
+        library_dict = {
+            "readgroups": readgroups,
+            "id": library.id
+        }
+        library_dict.update(library.additional_properties)
+        libraries.append(library_dict)
+    sample_dict = {
+        "libraries": libraries,
+        "id": sample.id
+    }  # type: Dict[str, Any]
+    sample_dict.update(sample.additional_properties)
+    _add_total_size(sample, sample_dict)
+    return sample_dict
 
 
 def samplegroup_to_biowdl_old_structure(samplegroup: SampleGroup):
@@ -35,40 +91,8 @@ def samplegroup_to_biowdl_old_structure(samplegroup: SampleGroup):
     :param samplegroup: A samplegroup object
     :return: a structure in dictionaries that can be converted to a WDL struct.
     """
-    samples = []
-    for sample in samplegroup:
-        libraries = []
-        for library in sample:
-            readgroups = []
-            for readgroup in library:
-                reads = {
-                    "R1": readgroup.R1,
-                }
-                if readgroup.R1_md5 is not None:
-                    reads["R1_md5"] = readgroup.R1_md5
-                if readgroup.R2 is not None:
-                    reads["R2"] = readgroup.R2
-                if readgroup.R2_md5 is not None:
-                    reads["R2_md5"] = readgroup.R2_md5
-                readgroup_dict = {
-                    "reads": reads,
-                    "id": readgroup.id
-                }
-                readgroup_dict.update(readgroup.additional_properties)
-                readgroups.append(readgroup_dict)
-            library_dict = {
-                "readgroups": readgroups,
-                "id": library.id
-            }
-            library_dict.update(library.additional_properties)
-            libraries.append(library_dict)
-        sample_dict = {
-            "libraries": libraries,
-            "id": sample.id
-        }
-        sample_dict.update(sample.additional_properties)
-        samples.append(sample_dict)
-    return {"samples": samples}
+    return {"samples": [sample_to_biowdl_old_structure(sample)
+                        for sample in samplegroup]}
 
 
 def samplegroup_to_biowdl_old_yaml(samplegroup: SampleGroup):
@@ -79,7 +103,12 @@ def samplegroup_to_biowdl_old_yaml(samplegroup: SampleGroup):
     :return: a structure in dictionaries that can be converted to a WDL struct
     in YAML format.
     """
-    return yaml.safe_dump(samplegroup_to_biowdl_old_structure(samplegroup))
+    import yaml
+    # The libyaml based dumper is a lot faster than the python implementation.
+    # It is not available when PyYAML was installed without libyaml.
+    dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+    return yaml.dump(samplegroup_to_biowdl_old_structure(samplegroup),
+                     Dumper=dumper)
 
 
 def samplegroup_to_biowdl_old_json(samplegroup: SampleGroup):
@@ -93,6 +122,23 @@ def samplegroup_to_biowdl_old_json(samplegroup: SampleGroup):
     return json.dumps(samplegroup_to_biowdl_old_structure(samplegroup))
 
 
+def sample_to_biowdl_new_structure(sample: Sample) -> Dict[str, Any]:
+    """
+    Converts a Sample object to a sample in the biowdl new structure.
+    :param sample: A sample object
+    :return: a structure in dictionaries that can be converted to a WDL struct.
+    """
+    sample_dict = {"readgroups": [], "id": sample.id}  # type: Dict[str, Any]
+    sample_dict.update(sample.additional_properties)
+    for library in sample:
+        for readgroup in library:
+            rg_dict = readgroup.as_dict()
+            rg_dict["lib_id"] = library.id
+            sample_dict["readgroups"].append(rg_dict)
+    _add_total_size(sample, sample_dict)
+    return sample_dict
+
+
 def samplegroup_to_biowdl_new_structure(samplegroup: SampleGroup):
     """
     Converts a SampleGroup object to biowdl new structure as used in
@@ -100,17 +146,8 @@ def samplegroup_to_biowdl_new_structure(samplegroup: SampleGroup):
     :param samplegroup: A samplegroup object
     :return: a structure in dictionaries that can be converted to a WDL struct.
     """
-    samples = []
-    for sample in samplegroup:
-        sample_dict = {"readgroups": [], "id": sample.id}
-        sample_dict.update(sample.additional_properties)
-        for library in sample:
-            for readgroup in library:
-                rg_dict = readgroup.as_dict()
-                rg_dict["lib_id"] = library.id
-                sample_dict["readgroups"].append(rg_dict)
-        samples.append(sample_dict)
-    return {"samples": samples}
+    return {"samples": [sample_to_biowdl_new_structure(sample)
+                        for sample in samplegroup]}
 
 
 def samplegroup_to_biowdl_new_json(samplegroup: SampleGroup) -> str:
@@ -122,3 +159,159 @@ def samplegroup_to_biowdl_new_json(samplegroup: SampleGroup) -> str:
     in JSON format.
     """
     return json.dumps(samplegroup_to_biowdl_new_structure(samplegroup))
+
+
+def _write_samples_json(samplegroup: Iterable[Sample],
+                        sample_to_structure: Callable[[Sample],
+                                                      Dict[str, Any]],
+                        output: TextIO):
+    """
+    Writes the samples as a JSON object to the output. Only one sample is
+    converted at a time, so the complete structure is never in memory. The
+    result is identical to json.dumps on the complete structure.
+    :param samplegroup: A samplegroup object or a list of samples
+    :param sample_to_structure: Converts a sample to its structure.
+    :param output: A file object to write to.
+    """
+    output.write('{"samples": [')
+    for index, sample in enumerate(samplegroup):
+        if index > 0:
+            output.write(", ")
+        output.write(json.dumps(sample_to_structure(sample)))
+    output.write("]}")
+
+
+def write_biowdl_old_json(samplegroup: SampleGroup, output: TextIO):
+    """
+    Writes a SampleGroup object in biowdl old structure as used in
+    Germline-DNA and RNA-seq pipelines version 1 to a file in JSON format.
+    :param samplegroup: A samplegroup object
+    :param output: A file object to write to.
+    """
+    _write_samples_json(samplegroup, sample_to_biowdl_old_structure, output)
+
+
+def write_biowdl_new_json(samplegroup: SampleGroup, output: TextIO):
+    """
+    Writes a SampleGroup object in biowdl new structure as used in
+    the small-rna pipeline version 1 to a file in JSON format.
+    :param samplegroup: A samplegroup object
+    :param output: A file object to write to.
+    """
+    _write_samples_json(samplegroup, sample_to_biowdl_new_structure, output)
+
+
+def write_sharded_json(samplegroup: SampleGroup, directory: Path,
+                       samples_per_shard: int = 1,
+                       old_style_json: bool = False) -> Dict[str, Any]:
+    """
+    Writes the samples to JSON files in a directory, with samples_per_shard
+    samples in each file. Every file has the same structure as the JSON of
+    the complete SampleGroup. The files are written one sample at a time,
+    so the complete structure is never in memory. Shard files from an
+    earlier run in the directory are removed first, so they are not mixed
+    up with the new shards. Other files are kept.
+    :param samplegroup: A samplegroup object
+    :param directory: The directory for the files, which must exist.
+    :param samples_per_shard: The maximum number of samples in a file.
+    :param old_style_json: Write the biowdl old structure as used in
+    Germline-DNA and RNA-seq pipelines version 1.
+    :return: An index with the absolute path and the sample ids of every
+    file, in the order of the samples.
+    """
+    if samples_per_shard < 1:
+        raise ValueError(f"The number of samples per shard must be at "
+                         f"least 1, not {samples_per_shard}.")
+    sample_to_structure = (
+        sample_to_biowdl_old_structure if old_style_json
+        else sample_to_biowdl_new_structure
+    )  # type: Callable[[Sample], Dict[str, Any]]
+    for path in directory.glob("samples_*.json"):
+        if path.stem[len("samples_"):].isdigit():
+            path.unlink()
+    samples = samplegroup.samples
+    shard_count = -(-len(samples) // samples_per_shard)
+    # The file names sort in the order of the samples.
+    width = len(str(max(shard_count - 1, 0)))
+    shards = []
+    for number in range(shard_count):
+        shard = samples[number * samples_per_shard:
+                        (number + 1) * samples_per_shard]
+        path = directory / f"samples_{number:0{width}d}.json"
+        with path.open("w") as output_h:
+            _write_samples_json(shard, sample_to_structure, output_h)
+            output_h.write("\n")
+        shards.append({"path": os.path.abspath(path),
+                       "samples": [sample.id for sample in shard]})
+    return {"shards": shards}
+
+
+def write_csv_samplesheet(samplegroup: SampleGroup, output: TextIO,
+                          delimiter: str = ","):
+    """
+    Writes a SampleGroup object as a CSV samplesheet. Additional properties
+    of samples are written as extra columns in the first row of each sample.
+    Checksums other than md5sums get a column if any readgroup has them.
+    :param samplegroup: A samplegroup object
+    :param output: A file object to write to. It should be opened with
+    newline="".
+    :param delimiter: The delimiter of the columns.
+    """
+    property_columns = {}  # type: Dict[str, None]
+    used_checksum_columns = set()  # type: Set[str]
+    for sample in samplegroup:
+        property_columns.update(dict.fromkeys(sample.additional_properties))
+        for library in sample:
+            if library.additional_properties or any(
+                    readgroup.additional_properties for readgroup in library):
+                raise ValueError(
+                    f"Additional properties of libraries and readgroups can "
+                    f"not be written to a CSV samplesheet. Sample "
+                    f"'{sample.id}', library '{library.id}' has them.")
+            for readgroup in library:
+                used_checksum_columns.update(readgroup.checksums)
+    checksum_columns = [column for column in CHECKSUM_COLUMNS
+                        if column in used_checksum_columns]
+    writer = csv.writer(output, delimiter=delimiter)
+    writer.writerow(["sample", "library", "readgroup", "R1", "R1_md5", "R2",
+                     "R2_md5", *checksum_columns, *property_columns])
+    for sample in samplegroup:
+        properties = [sample.additional_properties.get(column)
+                      for column in property_columns]  # type: List[Any]
+        for library in sample:
+            for readgroup in library:
+                writer.writerow([
+                    sample.id, library.id, readgroup.id, readgroup.R1,
+                    readgroup.R1_md5, readgroup.R2, readgroup.R2_md5,
+                    *(readgroup.checksums.get(column)
+                      for column in checksum_columns),
+                    *properties])
+                # Properties only need to be set once per sample.
+                properties = [None] * len(properties)
+
+
+# The formats that write_samplesheet can write.
+SAMPLESHEET_FORMATS = ("csv", "tsv", "yaml", "yml", "json")
+
+
+def write_samplesheet(samplegroup: SampleGroup, output: TextIO,
+                      fileformat: str):
+    """
+    Writes a SampleGroup object as a samplesheet that can be converted again.
+    :param samplegroup: A samplegroup object
+    :param output: A file object to write to.
+    :param fileformat: tsv, csv, yaml, yml, json
+    """
+    filetype = fileformat.lower().replace(".", "")
+    if filetype == "csv":
+        write_csv_samplesheet(samplegroup, output)
+    elif filetype == "tsv":
+        write_csv_samplesheet(samplegroup, output, delimiter="\t")
+    elif filetype in ["yaml", "yml"]:
+        output.write(samplegroup_to_biowdl_old_yaml(samplegroup))
+    elif filetype == "json":
+        write_biowdl_old_json(samplegroup, output)
+        output.write("\n")
+    else:
+        raise NotImplementedError(
+            f"Unsupported samplesheet format: {fileformat}")
@@ -28,42 +28,176 @@ easier.
 See this excellent talk on dataclasses,
 https://www.youtube.com/watch?v=T-TwcmT6Rcw, or the python docs,
 https://docs.python.org/3/library/dataclasses.html, for more information.
+
+Samplesheets can contain millions of readgroups. Therefore the dataclasses
+use __slots__ instead of a __dict__ per instance, and objects without
+additional properties share one empty, read-only mapping.
 """
 
+import dataclasses
 from dataclasses import dataclass, field
-from typing import Any, Dict, Generator, Iterable, List, Optional, Tuple
+from typing import Any, Dict, Generator, Iterable, List, Mapping, Optional, \
+    Tuple
+
+from .utils import DIGEST_ALGORITHMS
+
+
+class _EmptyProperties(Mapping):
+    """
+    A read-only mapping without items. One instance is shared by all objects
+    without additional properties, so adding properties to one object can
+    not change the others.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(())
+
+    def __len__(self):
+        return 0
+
+    def __hash__(self):
+        return 0
+
+    def __repr__(self):
+        return "{}"
+
+    def __reduce__(self):
+        # Unpickle as the shared instance.
+        return "EMPTY_PROPERTIES"
+
+
+EMPTY_PROPERTIES = _EmptyProperties()
+
+
+def _slotted(cls):
+    """
+    Recreates a dataclass with __slots__ for its fields. This saves the
+    memory of a __dict__ for every instance. dataclass(slots=True) does the
+    same, but it requires python 3.10.
+    """
+    class_dict = dict(cls.__dict__)
+    field_names = tuple(f.name for f in dataclasses.fields(cls))
+    class_dict["__slots__"] = field_names
+    # Default values are stored as class attributes, which conflict with
+    # the slots. The generated __init__ does not need them.
+    for name in field_names:
+        class_dict.pop(name, None)
+    class_dict.pop("__dict__", None)
+    class_dict.pop("__weakref__", None)
+    return type(cls)(cls.__name__, cls.__bases__, class_dict)
+
+
+# The samplesheet columns for checksums other than md5, such as R1_sha256.
+# md5sums have their own fields.
+CHECKSUM_COLUMNS = tuple(f"{read}_{algorithm}" for read in ("R1", "R2")
+                         for algorithm in DIGEST_ALGORITHMS
+                         if algorithm != "md5")
 
 
 class Node(Iterable):
+    __slots__ = ()
+
     def files_and_md5sums(self) -> Generator[Tuple[str, Optional[str]],
                                              None, None]:
         for node in self:
             yield from node.files_and_md5sums()
 
+    def files_and_checksums(self) -> Generator[Tuple[str, Dict[str, str]],
+                                               None, None]:
+        for node in self:
+            yield from node.files_and_checksums()
+
     def files(self) -> Generator[str, None, None]:
         for node in self:
             yield from node.files()
 
 
+class IndexedNode(Node):
+    """
+    A node with children that can be looked up by id. The index is updated
+    by append. Children that are added to the list of children directly are
+    not in the index.
+    """
+    __slots__ = ()
+    # The kind of children, used in error messages.
+    child_name = "child"
+    # The children by id. This is a field in the subclasses.
+    _index: Dict[str, Any]
+
+    def __post_init__(self):
+        for child in self:
+            self._add_to_index(child)
+
+    def _add_to_index(self, child):
+        if child.id in self._index:
+            parent_id = getattr(self, "id", None)
+            location = (f" in {type(self).__name__.lower()} '{parent_id}'"
+                        if parent_id is not None else "")
+            raise ValueError(f"Duplicate {self.child_name} id "
+                             f"'{child.id}'{location}")
+        self._index[child.id] = child
+
+    def get(self, id: str, default: Any = None) -> Any:
+        """
+        Look up a child by id.
+        :param id: the id of the child.
+        :param default: returned when there is no child with this id.
+        :return: the child or the default.
+        """
+        return self._index.get(id, default)
+
+    def __contains__(self, item) -> bool:
+        """
+        Checks for a child by id, or for a child object.
+        """
+        if isinstance(item, str):
+            return item in self._index
+        return self._index.get(item.id) == item
+
+
+@_slotted
 @dataclass()
 class ReadGroup(Node):
     """
     Contains the paths and md5sums to a forward read (R1) and reverse read
-    (R2) for a lane in the sequencer.
+    (R2) for a lane in the sequencer. Other checksums are stored by their
+    column in CHECKSUM_COLUMNS, such as R1_sha256. The sizes of the reads in
+    bytes are only set when they are recorded.
     """
     id: str
     R1: str
     R2: Optional[str] = None
     R1_md5: Optional[str] = None
     R2_md5: Optional[str] = None
-    additional_properties: Dict[str, Any] = field(default_factory=dict)
+    additional_properties: Mapping[str, Any] = EMPTY_PROPERTIES
+    checksums: Mapping[str, str] = EMPTY_PROPERTIES
+    R1_size: Optional[int] = None
+    R2_size: Optional[int] = None
+
+    @property
+    def total_size(self) -> Optional[int]:
+        """
+        The size of all reads in bytes, or None if it is not recorded.
+        """
+        if self.R1_size is None:
+            return None
+        if self.R2 is None:
+            return self.R1_size
+        if self.R2_size is None:
+            return None
+        return self.R1_size + self.R2_size
 
     def as_dict(self):
         """
         Returns a dict with all of this readgroups properties. If R2, R1_md5
         and/or R2_md5 are None they are excluded from the dict. This is to
         prevent 'R2: null' fields in the JSON or YAML outputs.
-        Additional properties are also added to the dict.
+        Additional properties, checksums and recorded sizes are also added
+        to the dict.
         :return:
         """
         rg_dict = {"id": self.id, "R1": self.R1}
@@ -74,6 +208,13 @@ class ReadGroup(Node):
             rg_dict["R2"] = self.R2
         if self.R2_md5 is not None:
             rg_dict["R2_md5"] = self.R2_md5
+        rg_dict.update(self.checksums)
+        total_size = self.total_size
+        if total_size is not None:
+            rg_dict["R1_size"] = self.R1_size
+            if self.R2_size is not None:
+                rg_dict["R2_size"] = self.R2_size
+            rg_dict["total_size"] = total_size
         return rg_dict
 
     def files_and_md5sums(self) -> Generator[Tuple[str, Optional[str]],
@@ -82,6 +223,22 @@ class ReadGroup(Node):
         if self.R2 is not None:
             yield self.R2, self.R2_md5
 
+    def files_and_checksums(self) -> Generator[Tuple[str, Dict[str, str]],
+                                               None, None]:
+        """
+        Yields every read with its checksums by algorithm, including md5.
+        """
+        for read, file, md5sum in (("R1", self.R1, self.R1_md5),
+                                   ("R2", self.R2, self.R2_md5)):
+            if file is None:
+                continue
+            checksums = {} if md5sum is None else {"md5": md5sum}
+            prefix = read + "_"
+            for column, checksum in self.checksums.items():
+                if column.startswith(prefix):
+                    checksums[column[len(prefix):]] = checksum
+            yield file, checksums
+
     def files(self) -> Generator[str, None, None]:
         yield self.R1
         if self.R2 is not None:
@@ -91,8 +248,9 @@ class ReadGroup(Node):
         return iter([self])
 
 
+@_slotted
 @dataclass()
-class Library(Node):
+class Library(IndexedNode):
     """
     Contains all the sequenced readgroups for this sample library. A sample
     library is a preparation of the sample's DNA to be sequenced. This can
@@ -100,7 +258,10 @@ class Library(Node):
     """
     id: str
     readgroups: List[ReadGroup] = field(default_factory=list)
-    additional_properties: Dict[str, Any] = field(default_factory=dict)
+    additional_properties: Mapping[str, Any] = EMPTY_PROPERTIES
+    _index: Dict[str, ReadGroup] = field(default_factory=dict, init=False,
+                                         repr=False, compare=False)
+    child_name = "readgroup"
 
     def __iter__(self):
         return iter(self.readgroups)
@@ -114,14 +275,16 @@ class Library(Node):
         :param readgroup: a Readgroup object.
         """
         if isinstance(readgroup, ReadGroup):
+            self._add_to_index(readgroup)
             self.readgroups.append(readgroup)
         else:
             raise TypeError("Only readgroup objects can be appended to the "
                             "library.")
 
 
+@_slotted
 @dataclass()
-class Sample(Node):
+class Sample(IndexedNode):
     """
     The biological sample and its libraries. While in theory you can have
     multiple preparations of the sample for sequencing (libraries) in practice
@@ -129,11 +292,29 @@ class Sample(Node):
     """
     id: str
     libraries: List[Library] = field(default_factory=list)
-    additional_properties: Dict[str, Any] = field(default_factory=dict)
+    additional_properties: Mapping[str, Any] = EMPTY_PROPERTIES
+    _index: Dict[str, Library] = field(default_factory=dict, init=False,
+                                       repr=False, compare=False)
+    child_name = "library"
 
     def __iter__(self):
         return iter(self.libraries)
 
+    @property
+    def total_size(self) -> Optional[int]:
+        """
+        The size of all reads of the sample in bytes, or None if it is not
+        recorded for all reads.
+        """
+        total_size = None  # type: Optional[int]
+        for library in self.libraries:
+            for readgroup in library.readgroups:
+                readgroup_size = readgroup.total_size
+                if readgroup_size is None:
+                    return None
+                total_size = (total_size or 0) + readgroup_size
+        return total_size
+
     def __getitem__(self, item: int):
         return self.libraries[item]
 
@@ -143,16 +324,21 @@ class Sample(Node):
         :param library: a library object
         """
         if isinstance(library, Library):
+            self._add_to_index(library)
             self.libraries.append(library)
         else:
             raise TypeError("Only library objects can be appended to the "
                             "sample.")
 
 
+@_slotted
 @dataclass()
-class SampleGroup(Node):
+class SampleGroup(IndexedNode):
     """A group of samples that are analysed together"""
     samples: List[Sample] = field(default_factory=list)
+    _index: Dict[str, Sample] = field(default_factory=dict, init=False,
+                                      repr=False, compare=False)
+    child_name = "sample"
 
     def __iter__(self):
         return iter(self.samples)
@@ -166,6 +352,7 @@ class SampleGroup(Node):
         :param sample: a Sample object.
         """
         if isinstance(sample, Sample):
+            self._add_to_index(sample)
             self.samples.append(sample)
         else:
             raise TypeError("Only sample objects can be appended to the "
@@ -184,12 +371,12 @@ class SampleGroup(Node):
             sample = Sample(
                 sample_id,
                 additional_properties=sample_dict.pop(
-                    "additional_properties", {}))
+                    "additional_properties", EMPTY_PROPERTIES))
             for lib_id, lib_dict in sample_dict.items():
                 library = Library(
                     lib_id,
                     additional_properties=lib_dict.pop(
-                        "additional_properties", {})
+                        "additional_properties", EMPTY_PROPERTIES)
                 )
                 for rg_id, rg_dict in lib_dict.items():
                     library.append(ReadGroup(
@@ -199,7 +386,10 @@ class SampleGroup(Node):
                         R2=rg_dict.get("R2", None),
                         R2_md5=rg_dict.get("R2_md5", None),
                         additional_properties=rg_dict.get(
-                            "additional_properties", {})
+                            "additional_properties", EMPTY_PROPERTIES),
+                        checksums=rg_dict.get("checksums", EMPTY_PROPERTIES),
+                        R1_size=rg_dict.get("R1_size", None),
+                        R2_size=rg_dict.get("R2_size", None)
                     ))
                 sample.append(library)
             samplegroup.append(sample)
@@ -0,0 +1,118 @@
+# Copyright (c) 2019 Leiden University Medical Center
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Measure the time spent in each stage of a conversion.
+"""
+
+import contextlib
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Generator, List, Optional
+
+
+@dataclass()
+class Stage:
+    """The measurements for one stage of a conversion."""
+    name: str
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    items: int = 0
+    bytes: int = 0
+    # Only measured when memory is traced.
+    memory_peak: Optional[int] = None
+
+
+class Timings:
+    """
+    Records wall clock time, CPU time, item counts and processed bytes for
+    each stage of a conversion. Optionally the peak memory usage of each
+    stage is traced with tracemalloc. This slows down the conversion until
+    close is called, which can also be done by using Timings as a context
+    manager.
+    """
+    def __init__(self, trace_memory: bool = False):
+        self.stages = []  # type: List[Stage]
+        self.trace_memory = trace_memory
+        # Tracing that was started by someone else is not stopped by close.
+        self._started_tracing = False
+        if trace_memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Stops tracing memory if it was started by this object. The
+        measurements are kept.
+        """
+        if self._started_tracing:
+            import tracemalloc
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Generator[Stage, None, None]:
+        """
+        Measures the code in a with block as a stage. The item count and
+        bytes can be set on the yielded Stage object.
+        :param name: The name of the stage.
+        """
+        stage = Stage(name)
+        if self.trace_memory:
+            import tracemalloc
+        # tracemalloc.reset_peak is available from python 3.9 onwards.
+        # Before that the peak is the peak since the start of tracing.
+        if self.trace_memory and hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield stage
+        finally:
+            stage.wall_time = time.perf_counter() - wall_start
+            stage.cpu_time = time.process_time() - cpu_start
+            if self.trace_memory:
+                stage.memory_peak = tracemalloc.get_traced_memory()[1]
+            self.stages.append(stage)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"stages": [asdict(stage) for stage in self.stages]}
+
+    def summary(self) -> str:
+        """
+        :return: A table with the measurements of all stages.
+        """
+        lines = [f"{'stage':<20} {'wall (s)':>10} {'cpu (s)':>10} "
+                 f"{'items':>10} {'MiB':>10} {'peak MiB':>10}"]
+        for stage in self.stages:
+            peak = ("-" if stage.memory_peak is None
+                    else f"{stage.memory_peak / 2 ** 20:.1f}")
+            lines.append(f"{stage.name:<20} {stage.wall_time:>10.3f} "
+                         f"{stage.cpu_time:>10.3f} {stage.items:>10} "
+                         f"{stage.bytes / 2 ** 20:>10.1f} {peak:>10}")
+        return "\n".join(lines)
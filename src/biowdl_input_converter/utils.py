@@ -23,20 +23,30 @@ Contains general functions that are not specific to biowdl_input_converter.
 """
 
 import collections
+import contextlib
 import csv
-import hashlib
+import functools
+import gc
+import importlib
 import os
-from typing import Dict, Generator, Iterable, Tuple, Union
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Generator, Iterable, List, \
+    Optional, Sequence, Set, TYPE_CHECKING, Tuple, Union
 
+if TYPE_CHECKING:
+    import concurrent.futures
 
-def csv_to_dict_generator(csv_file: Union[str, os.PathLike]
-                          ) -> Generator[Dict[str, str], None, None]:
+    from .cache import Md5Cache
+
+
+def csv_rows_generator(csv_file: Union[str, os.PathLike]
+                       ) -> Generator[List[str], None, None]:
     """
-    Converts a csv_file into a generator. The generator yields each row
-    (except the header) as a dictionary. {header_column1: value,
-    header_column2: value etc.}
+    Converts a csv_file into a generator. The dialect of the csv file is
+    detected automatically. The generator yields each row (including the
+    header) as a list of strings.
     :param csv_file: A pathlib.Path pointing to the csv file.
-    :return: a generator that yields rows as Dict[str,str].
+    :return: a generator that yields rows as List[str].
     """
     with open(csv_file, "r") as csvfile:
         first_ten_lines = "".join([csvfile.readline() for _ in range(10)])
@@ -45,64 +55,713 @@ def csv_to_dict_generator(csv_file: Union[str, os.PathLike]
         except csv.Error as csv_error:
             raise ValueError(f"Could not parse CSV file: {csv_error}")
         csvfile.seek(0)
-        reader = csv.reader(csvfile, dialect)
-        try:
-            header = next(reader)
-        # A proper generator never raises a stop iteration. Instead it returns.
-        except StopIteration:
+        yield from csv.reader(csvfile, dialect)
+
+
+def csv_to_dict_generator(csv_file: Union[str, os.PathLike]
+                          ) -> Generator[Dict[str, str], None, None]:
+    """
+    Converts a csv_file into a generator. The generator yields each row
+    (except the header) as a dictionary. {header_column1: value,
+    header_column2: value etc.}
+    :param csv_file: A pathlib.Path pointing to the csv file.
+    :return: a generator that yields rows as Dict[str,str].
+    """
+    rows = csv_rows_generator(csv_file)
+    try:
+        header = next(rows)
+    # A proper generator never raises a stop iteration. Instead it returns.
+    except StopIteration:
+        return
+
+    for row in rows:
+        row_dict = {heading: row[index]
+                    for index, heading in enumerate(header)}
+        yield row_dict
+
+
+# JSON libraries that can be used to parse JSON, fastest first.
+JSON_BACKENDS = ("orjson", "ujson", "json")
+
+
+def json_loads_function(backend: str = "auto"
+                        ) -> Callable[[Union[str, bytes]], Any]:
+    """
+    Returns the loads function of a JSON library.
+    :param backend: orjson, ujson or json. 'auto' selects the fastest library
+    that is installed.
+    :return: A function that parses a JSON string or bytes.
+    """
+    if backend == "auto":
+        for backend in JSON_BACKENDS:
+            try:
+                return importlib.import_module(backend).loads
+            except ImportError:
+                continue
+    if backend not in JSON_BACKENDS:
+        raise ValueError(f"Unknown JSON backend: {backend}. Choose from: "
+                         f"{', '.join(JSON_BACKENDS)}.")
+    return importlib.import_module(backend).loads
+
+
+@contextlib.contextmanager
+def gc_paused():
+    """
+    Pauses the cyclic garbage collector. Building a large tree of objects
+    triggers many garbage collections, while the tree does not contain any
+    reference cycles. Pausing the garbage collector makes this a lot faster.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+# Block sizes for hashing files. Small files are read in small blocks.
+# Large files are read in larger blocks, which saves requests on network
+# filesystems. Larger blocks than this do not make hashing faster.
+MIN_MD5_BLOCKSIZE = 64 * 1024
+MAX_MD5_BLOCKSIZE = 1024 * 1024
+# How many bytes are hashed before they are dropped from the page cache.
+_DROP_CACHE_INTERVAL = 64 * 1024 * 1024
+
+
+def md5_blocksize(size: int) -> int:
+    """
+    Chooses the block size for hashing a file. Files are read in about 64
+    blocks, with a minimum of MIN_MD5_BLOCKSIZE and a maximum of
+    MAX_MD5_BLOCKSIZE bytes. Files smaller than the minimum are read at once.
+    :param size: the file size in bytes.
+    :return: the block size in bytes.
+    """
+    if size < MIN_MD5_BLOCKSIZE:
+        # One byte extra, so the end of the file is found with one read.
+        return size + 1
+    return min(max(size // 64, MIN_MD5_BLOCKSIZE), MAX_MD5_BLOCKSIZE)
+
+
+def _fadvise(fd: int, offset: int, length: int, advice_name: str):
+    # posix_fadvise is not available on all platforms and is only advice,
+    # so errors are ignored.
+    advice = getattr(os, advice_name, None)
+    if advice is None or not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+        pass
+
+
+# Files with these suffixes are checked with check_gzip.
+GZIP_SUFFIXES = (".gz", ".bgz")
+# The maximum number of bytes decompressed at once by GzipChecker.
+_GZIP_OUTPUT_LIMIT = 4 * 1024 * 1024
+
+
+class GzipChecker:
+    """
+    Checks the integrity of gzip data that is fed in blocks, like gzip -t.
+    Every member of a multi-member file, such as a BGZF file, is checked:
+    the deflate data, the CRC32 and the length. Zero bytes after the last
+    member are allowed. The decompressed data is discarded.
+    """
+    def __init__(self):
+        import zlib
+        self._zlib = zlib
+        self._decompressor = zlib.decompressobj(wbits=31)
+        # Whether the current member has received data.
+        self._in_member = False
+        self._members = 0
+        self._padding = False
+        self.error = None  # type: Optional[str]
+
+    def update(self, data: Union[bytes, memoryview]):
+        if self.error is not None:
             return
+        try:
+            self._update(data)
+        except self._zlib.error as error:
+            self.error = str(error)
+
+    def _update(self, data: Union[bytes, memoryview]):
+        while data:
+            if self._padding or (not self._in_member and self._members > 0
+                                 and data[0] == 0):
+                self._padding = True
+                if bytes(data).strip(b"\0"):
+                    self.error = "trailing garbage after gzip data"
+                return
+            self._in_member = True
+            # The output is limited, so highly compressed data does not use
+            # a lot of memory.
+            self._decompressor.decompress(data, _GZIP_OUTPUT_LIMIT)
+            data = self._decompressor.unconsumed_tail
+            if self._decompressor.eof:
+                data = self._decompressor.unused_data
+                self._members += 1
+                self._in_member = False
+                self._decompressor = self._zlib.decompressobj(wbits=31)
+
+    def finish(self) -> Optional[str]:
+        """
+        :return: None if all data was valid, otherwise an error message.
+        """
+        if self.error is None and self._in_member:
+            self.error = "unexpected end of file"
+        elif self.error is None and self._members == 0:
+            self.error = "not in gzip format"
+        return self.error
+
+
+def is_gzip_file(filepath: Union[str, os.PathLike]) -> bool:
+    return os.fspath(filepath).lower().endswith(GZIP_SUFFIXES)
+
+
+# The hashlib algorithms that are available on all platforms, and crc32c
+# from the optional crc32c package.
+DIGEST_ALGORITHMS = ("md5", "sha1", "sha224", "sha256", "sha384", "sha512",
+                     "blake2b", "blake2s", "crc32c")
+
+
+class _Crc32c:
+    """A hashlib like object for crc32c checksums."""
+    def __init__(self):
+        try:
+            import crc32c
+        except ImportError:
+            raise ValueError("crc32c checksums require the crc32c package. "
+                             "Install it with 'pip install crc32c'.")
+        self._crc32c = crc32c.crc32c
+        self._value = 0
+
+    def update(self, data: Union[bytes, memoryview]):
+        self._value = self._crc32c(data, self._value)
+
+    def hexdigest(self) -> str:
+        return f"{self._value:08x}"
+
+
+def new_digest(algorithm: str) -> Any:
+    """
+    :param algorithm: one of DIGEST_ALGORITHMS.
+    :return: an object with the update and hexdigest methods of hashlib.
+    """
+    if algorithm not in DIGEST_ALGORITHMS:
+        raise ValueError(f"Unknown checksum algorithm: {algorithm}. Choose "
+                         f"from: {', '.join(DIGEST_ALGORITHMS)}.")
+    if algorithm == "crc32c":
+        return _Crc32c()
+    import hashlib
+    # md5 and sha1 are only used for file integrity.
+    return hashlib.new(algorithm)  # nosec
 
-        for row in reader:
-            row_dict = {heading: row[index]
-                        for index, heading in enumerate(header)}
-            yield row_dict
+
+def scan_file(filepath: Union[str, os.PathLike],
+              check_gzip: bool = False,
+              blocksize: Optional[int] = None,
+              drop_cache: bool = True,
+              algorithms: Sequence[str] = ("md5",)
+              ) -> Tuple[Dict[str, str], Optional[str]]:
+    """
+    Reads a file once to generate its checksums and optionally to check its
+    gzip integrity. The file is read in blocks into one reused buffer, so
+    no memory is allocated for each block. The kernel is told that the file
+    is read sequentially, so it can read ahead.
+    :param filepath: a pathlib.Path to the file
+    :param check_gzip: Check the integrity of the gzip data in the file.
+    :param blocksize: the number of bytes that is read at once. Chosen with
+    md5_blocksize from the file size by default.
+    :param drop_cache: Tell the kernel that the read parts of the file are
+    no longer needed. Reading many large files then does not push the files
+    of other processes out of the page cache. Parts that were cached before
+    are dropped as well.
+    :param algorithms: the checksums that are calculated. See
+    DIGEST_ALGORITHMS.
+    :return: the checksums by algorithm as hexadecimal strings, and None if
+    the gzip data is valid or not checked, otherwise an error message.
+    """
+    hashers = [new_digest(algorithm) for algorithm in algorithms]
+    updates = [hasher.update for hasher in hashers]
+    gzip_checker = GzipChecker() if check_gzip else None
+    if gzip_checker is not None:
+        updates.append(gzip_checker.update)
+    # Unbuffered, so the blocks are read directly into the buffer.
+    with open(filepath, "rb", buffering=0) as file_handler:
+        fd = file_handler.fileno()
+        size = os.fstat(fd).st_size
+        if blocksize is None:
+            blocksize = md5_blocksize(size)
+        # The hints cost more than they save for small files.
+        drop_cache = drop_cache and size >= MIN_MD5_BLOCKSIZE
+        if size >= MIN_MD5_BLOCKSIZE:
+            _fadvise(fd, 0, 0, "POSIX_FADV_SEQUENTIAL")
+        buffer = bytearray(blocksize)
+        view = memoryview(buffer)
+        hashed = 0
+        dropped = 0
+        while True:
+            read = file_handler.readinto(buffer)
+            if not read:
+                break
+            block = view[:read]
+            for update in updates:
+                update(block)
+            hashed += read
+            if drop_cache and hashed - dropped >= _DROP_CACHE_INTERVAL:
+                _fadvise(fd, dropped, hashed - dropped,
+                         "POSIX_FADV_DONTNEED")
+                dropped = hashed
+        if drop_cache:
+            # A length of 0 means until the end of the file.
+            _fadvise(fd, dropped, 0, "POSIX_FADV_DONTNEED")
+    gzip_error = None if gzip_checker is None else gzip_checker.finish()
+    return ({algorithm: hasher.hexdigest()
+             for algorithm, hasher in zip(algorithms, hashers)}, gzip_error)
 
 
-# Copied from pytest-workflow
 def file_md5sum(filepath: Union[str, os.PathLike],
-                blocksize: int = 64 * 1024) -> str:
-    """
-    Generates a md5sum for a file. Reads file in blocks to save memory.
-    :param filepath: a pathlib. Path to the file
-    :param blocksize: An integer describing the blocksize when reading in the
-    file. Default: 64 kb. This is faster than 8kb (3.4 vs 3.74 seconds on a
-    2.3 GB file). After 64 kb the speed gains are very minimal for the increase
-    in used memory.
+                blocksize: Optional[int] = None,
+                drop_cache: bool = True) -> str:
+    """
+    Generates a md5sum for a file. See scan_file for the parameters.
     :return: a md5sum as hexadecimal string.
     """
-    hasher = hashlib.md5()  # nosec: only used for file integrity
-    with open(filepath, 'rb') as file_handler:  # Read the file in bytes
-        # Hardcode the blocksize at 8192 bytes here.
-        # This can be changed or made variable when the requirements compel us
-        # to do so.
-        for block in iter(lambda: file_handler.read(blocksize), b''):
-            hasher.update(block)
-    return hasher.hexdigest()
+    return scan_file(filepath, blocksize=blocksize,
+                     drop_cache=drop_cache)[0]["md5"]
+
+
+def _directory_listing(directory: str) -> Optional[Dict[str, bool]]:
+    """
+    Lists a directory.
+    :param directory: The directory. An empty string is the current directory.
+    :return: A dictionary with the names in the directory as keys and whether
+    they are symlinks as values. None if the directory can not be listed.
+    """
+    try:
+        with os.scandir(directory or os.curdir) as entries:
+            return {entry.name: entry.is_symlink() for entry in entries}
+    except OSError:
+        return None
+
+
+class StatCache:
+    """
+    Caches directory listings and stat results. When the same files are
+    checked multiple times, for example because they are in several
+    samplesheets, the filesystem is only queried once per directory and file.
+    The cache can be shared between threads. Changes to the filesystem after
+    a path was looked up are not noticed.
+    """
+    def __init__(self):
+        self._listings = {}  # type: Dict[str, Optional[Dict[str, bool]]]
+        self._stats = {}  # type: Dict[str, Optional[os.stat_result]]
+
+    def listing(self, directory: str) -> Optional[Dict[str, bool]]:
+        """
+        Lists a directory.
+        :param directory: The directory. An empty string is the current
+        directory.
+        :return: See _directory_listing.
+        """
+        try:
+            return self._listings[directory]
+        except KeyError:
+            listing = _directory_listing(directory)
+            self._listings[directory] = listing
+            return listing
+
+    def stat(self, path: Union[str, os.PathLike]
+             ) -> Optional[os.stat_result]:
+        """
+        :param path: a pathlib.Path to the file.
+        :return: The os.stat result or None if the file can not be accessed.
+        """
+        key = os.fspath(path)
+        try:
+            return self._stats[key]
+        except KeyError:
+            try:
+                stat = os.stat(key)  # type: Optional[os.stat_result]
+            except OSError:
+                stat = None
+            self._stats[key] = stat
+            return stat
 
+    def exists(self, path: Union[str, os.PathLike]) -> bool:
+        return self.stat(path) is not None
 
-def check_existence_list_of_files(files: Iterable[Union[str, os.PathLike]]):
-    # Create a list of files that do not exist
-    non_existing_files = [file for file in files if not os.path.exists(file)]
+
+def files_exist(files: Iterable[Union[str, os.PathLike]],
+                stat_cache: Optional[StatCache] = None) -> List[bool]:
+    """
+    Checks whether files exist. Files are grouped by their directory. A
+    directory that contains multiple files is listed once with os.scandir,
+    instead of querying the filesystem for every file. This saves a lot of
+    metadata requests on network filesystems. Files in directories that can
+    not be listed are checked one by one. So are files that are not in a
+    listing, as case-insensitive or Unicode normalizing filesystems accept
+    names that differ from the listed names.
+    :param files: An iterable of files.
+    :param stat_cache: Reuse the directory listings and stat results of
+    earlier checks.
+    :return: A list of booleans in the same order as the files.
+    """
+    if stat_cache is None:
+        list_directory = _directory_listing
+        exists = os.path.exists  # type: Callable[[Any], bool]
+    else:
+        list_directory = stat_cache.listing
+        exists = stat_cache.exists
+    files = list(files)
+    files_per_directory = collections.defaultdict(
+        list)  # type: Dict[str, List[Tuple[int, str]]]
+    for index, file in enumerate(files):
+        directory, name = os.path.split(os.fspath(file))
+        files_per_directory[directory].append((index, name))
+
+    existence = [False] * len(files)
+    for directory, indexes_and_names in files_per_directory.items():
+        listing = None
+        if len(indexes_and_names) > 1:
+            listing = list_directory(directory)
+        for index, name in indexes_and_names:
+            if listing is None or name in ("", os.curdir, os.pardir):
+                existence[index] = exists(files[index])
+            elif name in listing:
+                # A symlink only exists if its target exists.
+                existence[index] = (not listing[name] or
+                                    exists(files[index]))
+            else:
+                existence[index] = exists(files[index])
+    return existence
+
+
+def find_missing_files(files: Iterable[Union[str, os.PathLike]],
+                       stat_cache: Optional[StatCache] = None
+                       ) -> List[Union[str, os.PathLike]]:
+    """
+    :param files: An iterable of files.
+    :param stat_cache: Reuse the directory listings and stat results of
+    earlier checks.
+    :return: The files that do not exist.
+    """
+    files = list(files)
+    return [file for file, exists in zip(files, files_exist(files, stat_cache))
+            if not exists]
+
+
+def check_existence_list_of_files(files: Iterable[Union[str, os.PathLike]],
+                                  stat_cache: Optional[StatCache] = None):
+    non_existing_files = find_missing_files(files, stat_cache)
     if len(non_existing_files) > 0:
         raise FileNotFoundError(f"The following files can not be found: "
                                 f"{', '.join(map(str, non_existing_files))}.")
 
 
-def check_md5sums(files_and_sums: Iterable[Tuple[Union[str, os.PathLike], str]]
-                  ):
-    incorrect_files = [file for file, sum in files_and_sums
-                       if not file_md5sum(file) == sum]
+def file_size(filepath: Union[str, os.PathLike]) -> int:
+    """
+    Returns the size of a file in bytes or 0 if the file can not be accessed.
+    :param filepath: a pathlib.Path to the file.
+    :return: The size in bytes.
+    """
+    try:
+        return os.stat(filepath).st_size
+    except OSError:
+        return 0
+
+
+def _cached_file_size(stat_cache: StatCache,
+                      filepath: Union[str, os.PathLike]) -> int:
+    stat = stat_cache.stat(filepath)
+    return 0 if stat is None else stat.st_size
+
+
+def device_queues(files: Sequence[Union[str, os.PathLike]],
+                  stat_cache: Optional[StatCache] = None
+                  ) -> List[Deque[int]]:
+    """
+    Groups files by the device they are stored on. The files of each device
+    are ordered by inode, which is the closest to the order on disk that
+    can be found without special permissions on most filesystems. This
+    reduces seeking on spinning disks. Files that can not be accessed are
+    grouped together.
+    :param files: The files.
+    :param stat_cache: Reuse the stat results of earlier checks.
+    :return: A queue of file indexes for every device. The devices with the
+    most bytes come first.
+    """
+    if stat_cache is None:
+        stat_cache = StatCache()
+    indexes_per_device = collections.defaultdict(
+        list)  # type: Dict[Optional[int], List[Tuple[int, int]]]
+    bytes_per_device = collections.Counter(
+    )  # type: Dict[Optional[int], int]
+    for index, file in enumerate(files):
+        stat = stat_cache.stat(file)
+        if stat is None:
+            indexes_per_device[None].append((0, index))
+            continue
+        indexes_per_device[stat.st_dev].append((stat.st_ino, index))
+        bytes_per_device[stat.st_dev] += stat.st_size
+    devices = sorted(indexes_per_device, key=bytes_per_device.__getitem__,
+                     reverse=True)
+    return [collections.deque(index for _, index
+                              in sorted(indexes_per_device[device]))
+            for device in devices]
+
+
+@dataclass()
+class FileScan:
+    """The results of scan_files."""
+    # The checksums by algorithm, in the same order as the scanned files.
+    digests: List[Dict[str, str]]
+    # The number of bytes that were read.
+    hashed_bytes: int
+    # Error messages of the files with invalid gzip data, by file index.
+    gzip_errors: Dict[int, str] = field(default_factory=dict)
+
+    @property
+    def md5sums(self) -> List[str]:
+        return [digests["md5"] for digests in self.digests]
+
+
+def scan_files(
+        files: Iterable[Union[str, os.PathLike]],
+        threads: int = 1,
+        md5_cache: Optional["Md5Cache"] = None,
+        executor: Optional["concurrent.futures.Executor"] = None,
+        stat_cache: Optional[StatCache] = None,
+        per_device: Optional[int] = None,
+        check_gzip: bool = False,
+        algorithms: Sequence[str] = ("md5",)
+) -> FileScan:
+    """
+    Calculates the checksums of files and optionally checks the integrity of
+    the gzip files in the same read. Every file is read once, regardless of
+    the number of algorithms.
+    :param files: an iterable of files.
+    :param threads: the number of files that are hashed at the same time.
+    :param md5_cache: a cache with md5sums of files that were hashed before.
+    Unchanged files in the cache are not hashed again, unless they are
+    gzip files that are checked or other algorithms are requested.
+    :param executor: hash the files with this executor instead of a new
+    thread pool, so a pool can be shared by multiple checks. threads is
+    ignored when an executor is given.
+    :param stat_cache: look up the file sizes and fingerprints in this
+    cache.
+    :param per_device: the maximum number of files on the same device that
+    are hashed at the same time. Files on each device are hashed in inode
+    order. By default the largest files are hashed first, regardless of the
+    device.
+    :param check_gzip: check the integrity of the files with a suffix in
+    GZIP_SUFFIXES.
+    :param algorithms: the checksums that are calculated. See
+    DIGEST_ALGORITHMS.
+    :return: the checksums, the number of bytes that were hashed and the
+    gzip errors.
+    """
+    files = list(files)
+    algorithms = tuple(algorithms)
+    # Unknown algorithms and missing packages are reported before any file
+    # is read.
+    for algorithm in algorithms:
+        new_digest(algorithm)
+    # The cache only stores md5sums.
+    use_cached = algorithms == ("md5",)
+    if per_device is not None and stat_cache is None:
+        # The devices and inodes are needed for the schedule.
+        stat_cache = StatCache()
+    digests = {}  # type: Dict[int, Dict[str, str]]
+    gzip_errors = {}  # type: Dict[int, str]
+    gzip_indexes = (
+        {index for index, file in enumerate(files) if is_gzip_file(file)}
+        if check_gzip else set())  # type: Set[int]
+    fingerprints = {}
+    for index, file in enumerate(files):
+        if md5_cache is not None:
+            fingerprint = md5_cache.fingerprint(
+                file, None if stat_cache is None else stat_cache.stat(file))
+            fingerprints[index] = fingerprint
+            # Gzip files that are checked are read anyway.
+            if not use_cached or index in gzip_indexes:
+                continue
+            cached_md5sum = md5_cache.get(fingerprint)
+            if cached_md5sum is not None:
+                digests[index] = {"md5": cached_md5sum}
+    hash_order = [index for index in range(len(files))
+                  if index not in digests]
+    if stat_cache is None:
+        size_function = file_size
+    else:
+        size_function = functools.partial(_cached_file_size, stat_cache)
+    sizes = {index: size_function(files[index]) for index in hash_order}
+    # The largest files are hashed first. Otherwise a big file at the end of
+    # the queue keeps one thread busy while the others are idle.
+    hash_order.sort(key=sizes.__getitem__, reverse=True)
+
+    def scan(index: int):
+        digests[index], gzip_error = scan_file(
+            files[index], check_gzip=index in gzip_indexes,
+            algorithms=algorithms)
+        if gzip_error is not None:
+            gzip_errors[index] = gzip_error
+
+    with contextlib.ExitStack() as stack:
+        if executor is None:
+            import concurrent.futures
+            # hashlib releases the GIL while hashing, so threads suffice.
+            executor = stack.enter_context(
+                concurrent.futures.ThreadPoolExecutor(max(threads, 1)))
+        if per_device is None:
+            # Consume the iterator, so exceptions are raised.
+            collections.deque(executor.map(scan, hash_order), maxlen=0)
+        else:
+            queues = device_queues([files[index] for index in hash_order],
+                                   stat_cache)
+
+            def scan_queue(queue: Deque[int]):
+                # Each task hashes the files of one device one after
+                # another. Multiple tasks can share the queue of a device.
+                while True:
+                    try:
+                        position = queue.popleft()
+                    except IndexError:
+                        return
+                    scan(hash_order[position])
+            # The first task for every device is submitted first, so all
+            # devices are busy when there are fewer threads than tasks.
+            futures = [
+                executor.submit(scan_queue, queue)
+                for lane in range(max(per_device, 1)) for queue in queues
+                if lane < len(queue)]
+            for future in futures:
+                future.result()
+    if md5_cache is not None and "md5" in algorithms:
+        for index in hash_order:
+            md5_cache.set(fingerprints[index], digests[index]["md5"])
+        md5_cache.commit()
+    return FileScan([digests[index] for index in range(len(files))],
+                    sum(sizes.values()),
+                    dict(sorted(gzip_errors.items())))
+
+
+def compute_md5sums(
+        files: Iterable[Union[str, os.PathLike]],
+        threads: int = 1,
+        md5_cache: Optional["Md5Cache"] = None,
+        executor: Optional["concurrent.futures.Executor"] = None,
+        stat_cache: Optional[StatCache] = None,
+        per_device: Optional[int] = None
+) -> Tuple[List[str], int]:
+    """
+    Calculates the md5sums of files. See scan_files for the parameters.
+    :return: the md5sums, in the same order as files, and the number of
+    bytes that were hashed.
+    """
+    result = scan_files(files, threads, md5_cache, executor, stat_cache,
+                        per_device)
+    return result.md5sums, result.hashed_bytes
+
+
+def find_incorrect_md5sums(
+        files_and_sums: Iterable[Tuple[Union[str, os.PathLike], str]],
+        threads: int = 1,
+        md5_cache: Optional["Md5Cache"] = None,
+        executor: Optional["concurrent.futures.Executor"] = None,
+        stat_cache: Optional[StatCache] = None,
+        per_device: Optional[int] = None
+) -> Tuple[List[Union[str, os.PathLike]], int]:
+    """
+    Checks the md5sums of files. See compute_md5sums for the parameters.
+    :param files_and_sums: an iterable of (file, md5sum) tuples.
+    :return: the files with an incorrect md5sum, in the same order as
+    files_and_sums, and the number of bytes that were hashed.
+    """
+    files_and_sums = list(files_and_sums)
+    md5sums, hashed_bytes = compute_md5sums(
+        (file for file, _ in files_and_sums), threads, md5_cache, executor,
+        stat_cache, per_device)
+    incorrect_files = [file for (file, sum), md5sum
+                       in zip(files_and_sums, md5sums) if md5sum != sum]
+    return incorrect_files, hashed_bytes
+
+
+def check_md5sums(
+        files_and_sums: Iterable[Tuple[Union[str, os.PathLike], str]],
+        threads: int = 1,
+        md5_cache: Optional["Md5Cache"] = None,
+        executor: Optional["concurrent.futures.Executor"] = None,
+        stat_cache: Optional[StatCache] = None,
+        per_device: Optional[int] = None) -> int:
+    """
+    Checks the md5sums of files. All files with an incorrect md5sum are
+    reported together in one error. See find_incorrect_md5sums for the
+    parameters.
+    :return: the number of bytes that were hashed.
+    """
+    incorrect_files, hashed_bytes = find_incorrect_md5sums(
+        files_and_sums, threads, md5_cache, executor, stat_cache, per_device)
     if len(incorrect_files) > 0:
         raise ValueError(f"The following files have incorrect md5sums: "
                          f"{', '.join(map(str, incorrect_files))}")
+    return hashed_bytes
+
+
+# "path" compares normalized paths. "inode" compares the device and inode of
+# files, which also finds files that are reached through symlinks and
+# hardlinks. Paths that can not be accessed are compared by their real path.
+DUPLICATE_CHECK_MODES = ("path", "inode")
+
+
+def find_duplicate_files(files: Iterable[Union[str, os.PathLike]],
+                         mode: str = "path",
+                         stat_cache: Optional[StatCache] = None
+                         ) -> List[str]:
+    """
+    :param files: An iterable of files.
+    :param mode: How files are compared. See DUPLICATE_CHECK_MODES.
+    :param stat_cache: Reuse the stat results of earlier checks in inode
+    mode.
+    :return: The normalized paths that refer to a file that occurs multiple
+    times.
+    """
+    if mode == "path":
+        # Normpath is used to eliminate meaningless differences between
+        # paths.
+        counted_files = collections.Counter(os.path.normpath(file)
+                                            for file in files)
+        return [path for path, count in counted_files.items() if count > 1]
+    if mode != "inode":
+        raise ValueError(f"Unknown duplicate check mode: {mode}. Choose "
+                         f"from: {', '.join(DUPLICATE_CHECK_MODES)}.")
+    if stat_cache is None:
+        stat_cache = StatCache()
+    paths_per_file = collections.defaultdict(
+        dict)  # type: Dict[Union[str, Tuple[int, int]], Dict[str, None]]
+    occurrences = collections.Counter(
+    )  # type: Dict[Union[str, Tuple[int, int]], int]
+    for file in files:
+        stat = stat_cache.stat(file)
+        key = (os.path.realpath(file) if stat is None
+               else (stat.st_dev, stat.st_ino)
+               )  # type: Union[str, Tuple[int, int]]
+        # A dict keeps the paths unique and in order.
+        paths_per_file[key][os.path.normpath(file)] = None
+        occurrences[key] += 1
+    duplicated_paths = []  # type: List[str]
+    for key, paths in paths_per_file.items():
+        if occurrences[key] > 1:
+            duplicated_paths.extend(paths)
+    return duplicated_paths
 
 
-def check_duplicate_files(files: Iterable[Union[str, os.PathLike]]):
-    # Normpath is used to eliminate meaningless differences between paths.
-    counted_files = collections.Counter(os.path.normpath(file)
-                                        for file in files)
-    duplicated_paths = [path for path, count in counted_files.items()
-                        if count > 1]
+def check_duplicate_files(files: Iterable[Union[str, os.PathLike]],
+                          mode: str = "path",
+                          stat_cache: Optional[StatCache] = None):
+    duplicated_paths = find_duplicate_files(files, mode, stat_cache)
     if len(duplicated_paths) > 0:
         raise ValueError(f"The following files occur multiple times: "
-                         f"{', '.join(map(str, set(duplicated_paths)))}")
+                         f"{', '.join(duplicated_paths)}")
@@ -0,0 +1,638 @@
+# Copyright (c) 2019 Leiden University Medical Center
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Validate the files in a SampleGroup in one pass. The files are collected in
+a flat table once, and every path is looked up on the filesystem at most
+once. The existence, md5sum and duplicate checks all use these results. All
+problems are collected in a report instead of stopping at the first check
+that fails.
+"""
+
+import collections
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, \
+    Sequence, Set, TYPE_CHECKING, Tuple
+
+from . import utils
+from .samplestructure import ReadGroup, SampleGroup
+from .timings import Timings
+from .utils import StatCache, find_duplicate_files, find_missing_files, \
+    is_gzip_file, scan_files
+
+if TYPE_CHECKING:
+    import concurrent.futures
+
+    from .cache import Md5Cache
+
+
+@dataclass()
+class ValidationReport:
+    """All problems with the files in a SampleGroup."""
+    missing_files: List[str] = field(default_factory=list)
+    incorrect_md5sums: List[str] = field(default_factory=list)
+    # "file (algorithm)" for every incorrect checksum other than md5.
+    incorrect_checksums: List[str] = field(default_factory=list)
+    duplicate_files: List[str] = field(default_factory=list)
+    # "file: error" for every gzip file that is not valid.
+    gzip_errors: List[str] = field(default_factory=list)
+    # The number of files in the SampleGroup.
+    files: int = 0
+    hashed_bytes: int = 0
+    # The checksums by algorithm of all files that were read, so they do
+    # not have to be read again to generate missing checksums.
+    digests: Dict[str, Dict[str, str]] = field(default_factory=dict,
+                                               repr=False, compare=False)
+
+    @property
+    def ok(self) -> bool:
+        return not (self.missing_files or self.incorrect_md5sums or
+                    self.incorrect_checksums or self.duplicate_files or
+                    self.gzip_errors)
+
+    def problems(self) -> List[str]:
+        """
+        :return: A message for every check that failed.
+        """
+        messages = []
+        if self.missing_files:
+            messages.append(f"The following files can not be found: "
+                            f"{', '.join(self.missing_files)}.")
+        if self.incorrect_md5sums:
+            messages.append(f"The following files have incorrect md5sums: "
+                            f"{', '.join(self.incorrect_md5sums)}")
+        if self.incorrect_checksums:
+            messages.append(f"The following files have incorrect checksums: "
+                            f"{', '.join(self.incorrect_checksums)}")
+        if self.duplicate_files:
+            messages.append(f"The following files occur multiple times: "
+                            f"{', '.join(self.duplicate_files)}")
+        if self.gzip_errors:
+            messages.append(f"The following files are not valid gzip files: "
+                            f"{', '.join(self.gzip_errors)}")
+        return messages
+
+    def raise_for_problems(self):
+        """
+        Raises an error with all problems in the report. This is a
+        FileNotFoundError if files are missing, otherwise a ValueError.
+        """
+        if self.ok:
+            return
+        message = "\n".join(self.problems())
+        if self.missing_files:
+            raise FileNotFoundError(message)
+        raise ValueError(message)
+
+
+@dataclass()
+class ScannedFile:
+    """The results of reading a file."""
+    digests: Dict[str, str]
+    # Whether the gzip integrity was checked.
+    gzip_checked: bool = False
+    gzip_error: Optional[str] = None
+    # 0 if the md5sum was found in the md5 cache.
+    hashed_bytes: int = 0
+
+    def covers(self, algorithms: Iterable[str], gzip_check: bool) -> bool:
+        """
+        :return: Whether the file does not have to be read again for these
+        checksums and gzip check.
+        """
+        return (self.digests.keys() >= set(algorithms) and
+                (self.gzip_checked or not gzip_check))
+
+
+def file_table(samplegroup: SampleGroup
+               ) -> List[Tuple[str, Dict[str, str]]]:
+    """
+    :param samplegroup: a SampleGroup object.
+    :return: A (file, checksums) tuple for every read in the samplegroup, in
+    the order of the samplesheet. The checksums are by algorithm, including
+    the md5sum.
+    """
+    table = []  # type: List[Tuple[str, Dict[str, str]]]
+    extend = table.extend
+    for sample in samplegroup.samples:
+        for library in sample.libraries:
+            for readgroup in library.readgroups:
+                extend(readgroup.files_and_checksums())
+    return table
+
+
+def validate_samplegroup(samplegroup: SampleGroup,
+                         file_presence_check: bool = True,
+                         file_md5_check: bool = False,
+                         file_duplication_check: bool = True,
+                         duplicate_check_mode: str = "path",
+                         threads: int = 1,
+                         threads_per_device: Optional[int] = None,
+                         md5_cache: Optional["Md5Cache"] = None,
+                         executor: Optional[
+                             "concurrent.futures.Executor"] = None,
+                         stat_cache: Optional[StatCache] = None,
+                         timings: Optional[Timings] = None,
+                         file_gzip_check: bool = False,
+                         scanned_files: Optional[
+                             Mapping[str, "ScannedFile"]] = None
+                         ) -> ValidationReport:
+    """
+    Checks the files in a SampleGroup.
+    :param samplegroup: a SampleGroup object.
+    :param file_presence_check: Check if the files are present
+    :param file_md5_check: Check if the md5sums and other checksums for the
+    files are correct. All checksums of a file are calculated in one read.
+    Files that do not exist are reported as missing instead.
+    :param file_duplication_check: Check if files occur more than once
+    :param duplicate_check_mode: How files are compared in the duplication
+    check: path or inode
+    :param threads: The number of files that are hashed simultaneously
+    :param threads_per_device: The number of files on one device that are
+    hashed simultaneously
+    :param md5_cache: A cache with md5sums of previously checked files
+    :param executor: Hashes the files instead of a new thread pool
+    :param stat_cache: Reuses directory listings and stat results of files
+    that were checked before. A new cache is used if not given.
+    :param timings: Records the time spent in each check
+    :param file_gzip_check: Check the integrity of gzip files. The md5sums
+    are calculated in the same read.
+    :param scanned_files: Files that were read before, for example by a
+    FilePrefetcher. They are not read again if they have all checksums
+    that are needed.
+    :return: a ValidationReport with all problems.
+    """
+    if timings is None:
+        timings = Timings()
+    if stat_cache is None:
+        stat_cache = StatCache()
+    if scanned_files is None:
+        scanned_files = {}
+    table = file_table(samplegroup)
+    report = ValidationReport(files=len(table))
+
+    if file_presence_check:
+        with timings.stage("check_existence") as stage:
+            if file_duplication_check and duplicate_check_mode == "inode":
+                # Every file is stat'ed for the duplication check anyway, so
+                # listing the directories would only add requests.
+                report.missing_files = [file for file, _ in table
+                                        if not stat_cache.exists(file)]
+            else:
+                report.missing_files = [
+                    str(file) for file in find_missing_files(
+                        (file for file, _ in table), stat_cache)]
+            stage.items = len(table)
+    if file_md5_check or file_gzip_check:
+        stage_name = "check_md5sums" if file_md5_check else "check_gzip"
+        with timings.stage(stage_name) as stage:
+            missing = set(report.missing_files)
+            # Every file is read at most once, even if it occurs multiple
+            # times in the samplesheet.
+            expected = {}  # type: Dict[str, Dict[str, str]]
+            for file, checksums in table:
+                if file_md5_check and checksums:
+                    expected.setdefault(file, {}).update(checksums)
+                elif file_gzip_check and is_gzip_file(file):
+                    expected.setdefault(file, {})
+            files_to_read = {}  # type: Dict[str, Tuple[str, ...]]
+            for file, checksums in expected.items():
+                if file in missing:
+                    continue
+                if not stat_cache.exists(file):
+                    missing.add(file)
+                    report.missing_files.append(file)
+                    continue
+                # md5sums are calculated for gzip files that are only
+                # checked, so they can be reused for missing md5sums.
+                files_to_read[file] = tuple(checksums) or ("md5",)
+            files_to_scan = {}  # type: Dict[str, Tuple[str, ...]]
+            for file, algorithms in files_to_read.items():
+                scanned = scanned_files.get(file)
+                if scanned is None or not scanned.covers(
+                        algorithms, file_gzip_check and is_gzip_file(file)):
+                    files_to_scan[file] = algorithms
+            digests_by_file, gzip_errors, report.hashed_bytes = \
+                _scan_by_algorithms(
+                    files_to_scan, threads=threads, md5_cache=md5_cache,
+                    executor=executor, stat_cache=stat_cache,
+                    per_device=threads_per_device, check_gzip=file_gzip_check)
+            for file in files_to_read:
+                if file in files_to_scan:
+                    continue
+                scanned = scanned_files[file]
+                digests_by_file[file] = scanned.digests
+                if scanned.gzip_error is not None:
+                    gzip_errors[file] = scanned.gzip_error
+                report.hashed_bytes += scanned.hashed_bytes
+            # In the same order as without scanned files.
+            report.digests = {file: digests_by_file[file]
+                              for file in files_to_read}
+            for file in files_to_read:
+                digests = report.digests[file]
+                for algorithm, checksum in expected[file].items():
+                    if digests[algorithm] == checksum:
+                        continue
+                    if algorithm == "md5":
+                        report.incorrect_md5sums.append(file)
+                    else:
+                        report.incorrect_checksums.append(
+                            f"{file} ({algorithm})")
+            report.gzip_errors = [f"{file}: {gzip_errors[file]}"
+                                  for file in files_to_read
+                                  if file in gzip_errors]
+            stage.items = len(files_to_read)
+            stage.bytes = report.hashed_bytes
+    if file_duplication_check:
+        with timings.stage("check_duplicates") as stage:
+            report.duplicate_files = find_duplicate_files(
+                (file for file, _ in table), duplicate_check_mode,
+                stat_cache)
+            stage.items = len(table)
+    return report
+
+
+def _scan_by_algorithms(files: Mapping[str, Tuple[str, ...]],
+                        **scan_arguments: Any
+                        ) -> Tuple[Dict[str, Dict[str, str]],
+                                   Dict[str, str], int]:
+    """
+    Reads files once with scan_files. Files that need the same algorithms
+    are scanned together. In samplesheets with the same checksum columns for
+    all reads this is a single scan.
+    :param files: the algorithms for every file.
+    :param scan_arguments: passed to scan_files.
+    :return: the checksums of every file, the gzip errors by file and the
+    number of bytes that were hashed.
+    """
+    files_per_algorithms = collections.defaultdict(
+        list)  # type: Dict[Tuple[str, ...], List[str]]
+    for file, algorithms in files.items():
+        files_per_algorithms[algorithms].append(file)
+    digests = {}  # type: Dict[str, Dict[str, str]]
+    gzip_errors = {}  # type: Dict[str, str]
+    hashed_bytes = 0
+    for algorithms, group in files_per_algorithms.items():
+        scan = scan_files(group, algorithms=algorithms, **scan_arguments)
+        digests.update(zip(group, scan.digests))
+        gzip_errors.update((group[index], error)
+                           for index, error in scan.gzip_errors.items())
+        hashed_bytes += scan.hashed_bytes
+    # Errors are reported in the order of the files.
+    return digests, {file: gzip_errors[file] for file in files
+                     if file in gzip_errors}, hashed_bytes
+
+
+def _missing_checksums(samplegroup: SampleGroup, algorithms: Sequence[str]
+                       ) -> List[Tuple[ReadGroup, str, str, str]]:
+    """
+    :return: The readgroup, column, file and algorithm of every missing
+    checksum.
+    """
+    missing = []  # type: List[Tuple[ReadGroup, str, str, str]]
+    for sample in samplegroup.samples:
+        for library in sample.libraries:
+            for readgroup in library.readgroups:
+                for read in ("R1", "R2"):
+                    file = getattr(readgroup, read)
+                    if file is None:
+                        continue
+                    for algorithm in algorithms:
+                        column = f"{read}_{algorithm}"
+                        checksum = (getattr(readgroup, column)
+                                    if algorithm == "md5"
+                                    else readgroup.checksums.get(column))
+                        if checksum is None:
+                            missing.append(
+                                (readgroup, column, file, algorithm))
+    return missing
+
+
+def _files_to_read(missing: Iterable[Tuple[ReadGroup, str, str, str]],
+                   known_digests: Mapping[str, Mapping[str, str]]
+                   ) -> Dict[str, Tuple[str, ...]]:
+    files_to_read = {}  # type: Dict[str, Dict[str, None]]
+    for _, _, file, algorithm in missing:
+        if algorithm not in known_digests.get(file, {}):
+            # A dict keeps the algorithms unique and in order.
+            files_to_read.setdefault(file, {})[algorithm] = None
+    return {file: tuple(file_algorithms)
+            for file, file_algorithms in files_to_read.items()}
+
+
+def files_without_checksums(samplegroup: SampleGroup,
+                            algorithms: Sequence[str] = ("md5",),
+                            known_digests: Optional[
+                                Mapping[str, Mapping[str, str]]] = None
+                            ) -> Dict[str, Tuple[str, ...]]:
+    """
+    :param samplegroup: a SampleGroup object.
+    :param algorithms: The checksums that generate_missing_checksums adds.
+    :param known_digests: See generate_missing_checksums.
+    :return: The algorithms for every file that generate_missing_checksums
+    reads. Files that are read in advance, and passed as known_digests,
+    are not read by generate_missing_checksums.
+    """
+    return _files_to_read(_missing_checksums(samplegroup, algorithms),
+                          known_digests or {})
+
+
+def generate_missing_checksums(samplegroup: SampleGroup,
+                               algorithms: Sequence[str] = ("md5",),
+                               threads: int = 1,
+                               threads_per_device: Optional[int] = None,
+                               md5_cache: Optional["Md5Cache"] = None,
+                               executor: Optional[
+                                   "concurrent.futures.Executor"] = None,
+                               stat_cache: Optional[StatCache] = None,
+                               known_digests: Optional[
+                                   Mapping[str, Mapping[str, str]]] = None
+                               ) -> Tuple[int, int]:
+    """
+    Calculates the missing checksums of reads and sets them on the
+    readgroups. Existing checksums are not changed or checked. All missing
+    checksums of a file are calculated in one read.
+    See validate_samplegroup for the parameters.
+    :param samplegroup: a SampleGroup object.
+    :param algorithms: The checksums that are added. See DIGEST_ALGORITHMS.
+    :param known_digests: checksums by algorithm by file that were
+    calculated before, such as ValidationReport.digests. These are not
+    calculated again.
+    :return: The number of checksums that were added and the number of
+    bytes that were hashed.
+    """
+    if known_digests is None:
+        known_digests = {}
+    missing = _missing_checksums(samplegroup, algorithms)
+    digests, _, hashed_bytes = _scan_by_algorithms(
+        _files_to_read(missing, known_digests),
+        threads=threads, md5_cache=md5_cache, executor=executor,
+        stat_cache=stat_cache, per_device=threads_per_device)
+    for readgroup, column, file, algorithm in missing:
+        file_digests = digests.get(file, {})
+        checksum = (file_digests[algorithm] if algorithm in file_digests
+                    else known_digests[file][algorithm])
+        if algorithm == "md5":
+            setattr(readgroup, column, checksum)
+        else:
+            # The shared empty checksums can not be changed.
+            readgroup.checksums = {**readgroup.checksums, column: checksum}
+    return len(missing), hashed_bytes
+
+
+def generate_missing_md5sums(samplegroup: SampleGroup,
+                             threads: int = 1,
+                             threads_per_device: Optional[int] = None,
+                             md5_cache: Optional["Md5Cache"] = None,
+                             executor: Optional[
+                                 "concurrent.futures.Executor"] = None,
+                             stat_cache: Optional[StatCache] = None,
+                             known_digests: Optional[
+                                 Mapping[str, Mapping[str, str]]] = None
+                             ) -> Tuple[int, int]:
+    """
+    Calculates the md5sums of reads without an md5sum and sets them on the
+    readgroups. See generate_missing_checksums.
+    :return: The number of md5sums that were added and the number of bytes
+    that were hashed.
+    """
+    return generate_missing_checksums(
+        samplegroup, ("md5",), threads=threads,
+        threads_per_device=threads_per_device, md5_cache=md5_cache,
+        executor=executor, stat_cache=stat_cache, known_digests=known_digests)
+
+
+def record_file_sizes(samplegroup: SampleGroup,
+                      threads: int = 1,
+                      stat_cache: Optional[StatCache] = None) -> int:
+    """
+    Sets the sizes of the reads in bytes on the readgroups. Every file is
+    stat'ed once, and not at all if it was stat'ed before by the checks
+    that used the same StatCache.
+    :param samplegroup: a SampleGroup object.
+    :param threads: The number of files that are stat'ed simultaneously
+    :param stat_cache: Reuses stat results of files that were checked
+    before. A new cache is used if not given.
+    :return: The total size of all files in bytes. Files that occur multiple
+    times are counted once.
+    """
+    if stat_cache is None:
+        stat_cache = StatCache()
+    files = list(dict.fromkeys(samplegroup.files()))
+    if threads > 1:
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+            stats = list(executor.map(stat_cache.stat, files))
+    else:
+        stats = [stat_cache.stat(file) for file in files]
+    missing = [file for file, stat in zip(files, stats) if stat is None]
+    if missing:
+        raise FileNotFoundError(
+            f"The sizes of the following files can not be recorded because "
+            f"they can not be found: {', '.join(missing)}.")
+    sizes = {file: stat.st_size for file, stat in zip(files, stats)
+             if stat is not None}
+    for sample in samplegroup.samples:
+        for library in sample.libraries:
+            for readgroup in library.readgroups:
+                readgroup.R1_size = sizes[readgroup.R1]
+                if readgroup.R2 is not None:
+                    readgroup.R2_size = sizes[readgroup.R2]
+    return sum(sizes.values())
+
+
+# The maximum number of tasks that wait for the FilePrefetcher workers. The
+# parser blocks when the workers fall behind.
+PREFETCH_QUEUE_SIZE = 10_000
+
+
+class FileTasks:
+    """
+    Splits the checks of the files of readgroups into separate tasks, which
+    can run in any thread while the samplesheet is parsed. The directory
+    listings and stat results are stored in the StatCache and the read files
+    in scanned_files. validate_samplegroup uses both afterwards, so its
+    report is the same as without these tasks.
+
+    Errors in the tasks are not raised by run. The files are checked again
+    by validate_samplegroup, which reports the errors.
+    """
+    def __init__(self,
+                 file_presence_check: bool = True,
+                 file_md5_check: bool = False,
+                 file_duplication_check: bool = True,
+                 duplicate_check_mode: str = "path",
+                 md5_cache: Optional["Md5Cache"] = None,
+                 stat_cache: Optional[StatCache] = None,
+                 file_gzip_check: bool = False):
+        """
+        See validate_samplegroup for the parameters, which should be the
+        same as for the validation.
+        """
+        self.file_md5_check = file_md5_check
+        self.file_gzip_check = file_gzip_check
+        self.md5_cache = md5_cache
+        self.stat_cache = StatCache() if stat_cache is None else stat_cache
+        self.scanned_files = {}  # type: Dict[str, ScannedFile]
+        # Files are stat'ed for the inode duplication check. Otherwise the
+        # directories are listed, like in files_exist.
+        self._stat_files = file_duplication_check and \
+            duplicate_check_mode == "inode"
+        self._file_presence_check = file_presence_check
+        self._directory_files = collections.Counter(
+        )  # type: Dict[str, int]
+        self._seen = set()  # type: Set[str]
+
+    def tasks(self, readgroup: ReadGroup) -> Iterator[Tuple[Any, ...]]:
+        """
+        :return: The tasks for the files of a readgroup that were not
+        checked before. A task is a function followed by its arguments.
+        """
+        for file, checksums in readgroup.files_and_checksums():
+            if self._file_presence_check:
+                directory = os.path.dirname(file)
+                self._directory_files[directory] += 1
+                if self._stat_files or \
+                        self._directory_files[directory] == 1:
+                    yield (self.stat_cache.stat, file)
+                elif self._directory_files[directory] == 2:
+                    yield (self.stat_cache.listing, directory)
+            if file in self._seen:
+                continue
+            self._seen.add(file)
+            if self.file_md5_check and checksums:
+                yield (self.scan, file, tuple(checksums))
+            elif self.file_gzip_check and is_gzip_file(file):
+                yield (self.scan, file, ("md5",))
+
+    @staticmethod
+    def run(task: Tuple[Any, ...]):
+        """
+        Runs a task from tasks. Errors are ignored, so a worker thread never
+        dies. The validation checks a file again and reports the error when
+        its task did not store a result.
+        """
+        function, *arguments = task
+        try:
+            function(*arguments)
+        except Exception:
+            pass
+
+    def scan(self, file: str, algorithms: Tuple[str, ...]):
+        """
+        Reads a file once for the checksums and the gzip check and stores
+        the result in scanned_files. Cached md5sums are used if only the
+        md5sum is needed.
+        """
+        stat = self.stat_cache.stat(file)
+        if stat is None:
+            return
+        gzip_check = self.file_gzip_check and is_gzip_file(file)
+        fingerprint = None
+        if self.md5_cache is not None:
+            fingerprint = self.md5_cache.fingerprint(file, stat)
+            if algorithms == ("md5",) and not gzip_check:
+                md5sum = self.md5_cache.get(fingerprint)
+                if md5sum is not None:
+                    self.scanned_files[file] = ScannedFile({"md5": md5sum})
+                    return
+        digests, gzip_error = utils.scan_file(
+            file, check_gzip=gzip_check, algorithms=algorithms)
+        self.scanned_files[file] = ScannedFile(
+            digests, gzip_check, gzip_error, stat.st_size)
+        if self.md5_cache is not None and "md5" in digests:
+            self.md5_cache.set(fingerprint, digests["md5"])
+
+
+class FilePrefetcher(FileTasks):
+    """
+    Runs the FileTasks of readgroups in worker threads while the samplesheet
+    is parsed, so the CPU bound parsing and the I/O bound checks overlap.
+    The parser passes every readgroup to add.
+    """
+    def __init__(self,
+                 file_presence_check: bool = True,
+                 file_md5_check: bool = False,
+                 file_duplication_check: bool = True,
+                 duplicate_check_mode: str = "path",
+                 threads: int = 1,
+                 md5_cache: Optional["Md5Cache"] = None,
+                 stat_cache: Optional[StatCache] = None,
+                 file_gzip_check: bool = False,
+                 queue_size: int = PREFETCH_QUEUE_SIZE):
+        """
+        See validate_samplegroup for the parameters, which should be the
+        same as for the validation.
+        :param queue_size: The maximum number of waiting tasks.
+        """
+        super().__init__(
+            file_presence_check=file_presence_check,
+            file_md5_check=file_md5_check,
+            file_duplication_check=file_duplication_check,
+            duplicate_check_mode=duplicate_check_mode,
+            md5_cache=md5_cache,
+            stat_cache=stat_cache,
+            file_gzip_check=file_gzip_check)
+        import queue
+        self._queue = queue.Queue(
+            queue_size)  # type: queue.Queue[Optional[Tuple[Any, ...]]]
+        self._cancelled = False
+        self._workers = [threading.Thread(target=self._work, daemon=True)
+                         for _ in range(max(threads, 1))]
+        for worker in self._workers:
+            worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(cancel=exc_type is not None)
+
+    def add(self, readgroup: ReadGroup):
+        """
+        Queues the checks of the files of a readgroup. Blocks when the queue
+        is full.
+        """
+        for task in self.tasks(readgroup):
+            self._queue.put(task)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            if not self._cancelled:
+                self.run(task)
+
+    def close(self, cancel: bool = False):
+        """
+        Waits until all queued tasks are done.
+        :param cancel: Skip the tasks that did not start yet.
+        """
+        self._cancelled = cancel
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        if self.md5_cache is not None:
+            self.md5_cache.commit()
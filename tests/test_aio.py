@@ -0,0 +1,151 @@
+# Copyright (c) 2019 Leiden University Medical Center
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import asyncio
+import collections
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from biowdl_input_converter import samplesheet_to_json, utils
+from biowdl_input_converter.aio import samplesheet_to_json_async, \
+    samplesheet_to_samplegroup_async
+from biowdl_input_converter.output_conversions import write_samplesheet
+from biowdl_input_converter.samplestructure import Library, ReadGroup, \
+    Sample, SampleGroup
+
+import pytest
+
+from . import FILESDIR
+
+R1 = str(FILESDIR / "data" / "R1.fq")
+R2 = str(FILESDIR / "data" / "R2.fq")
+R1_MD5 = "d8e8fca2dc0f896fd7cb4cb0031ba249"
+R2_MD5 = "126a8a51b9d1bbd07fddc65819a542c3"
+
+
+def write_readgroups(path: Path, readgroups: List[ReadGroup]) -> Path:
+    samplegroup = SampleGroup([Sample("s1", [Library("lib1", readgroups)])])
+    with path.open("w", newline="") as samplesheet_h:
+        write_samplesheet(samplegroup, samplesheet_h, path.suffix)
+    return path
+
+
+def test_samplesheet_to_json_async(tmp_path):
+    reads = tmp_path / "reads.fq"
+    reads.write_bytes(Path(R2).read_bytes())
+    samplesheet = write_readgroups(tmp_path / "samplesheet.csv", [
+        ReadGroup("rg1", R1, R2, R1_MD5, R2_MD5),
+        ReadGroup("rg2", str(reads))])
+    options = dict(file_md5_check=True, generate_md5sums=True,
+                   generate_checksums=["sha256"])
+    progress = []  # type: List[Tuple[str, int, int]]
+    output_json = asyncio.run(samplesheet_to_json_async(
+        samplesheet, progress=lambda *args: progress.append(args),
+        **options))
+    assert output_json == samplesheet_to_json(samplesheet, **options)
+    # Stat R1, list the directory of R1 and R2, hash R1 and R2 and stat
+    # the other reads. Then hash every file for the sha256 checksums.
+    assert progress == [("check_files", done, 5) for done in range(6)] + [
+        ("generate_checksums", done, 3) for done in range(4)]
+
+
+def test_samplesheet_to_samplegroup_async_problems(tmp_path):
+    samplesheet = write_readgroups(tmp_path / "samplesheet.yml", [
+        ReadGroup("rg1", R1, R2, R1_MD5, "XXXX"),
+        ReadGroup("rg2", "missing.fq", R1)])
+    with pytest.raises(FileNotFoundError) as sequential_error:
+        samplesheet_to_json(samplesheet, file_md5_check=True)
+    with pytest.raises(FileNotFoundError) as error:
+        asyncio.run(samplesheet_to_samplegroup_async(
+            samplesheet, file_md5_check=True))
+    assert str(error.value) == str(sequential_error.value)
+
+
+def test_samplesheet_to_samplegroup_async_concurrency(monkeypatch,
+                                                      tmp_path):
+    readgroups = [ReadGroup(f"rg{number}", str(tmp_path / f"{number}.fq"),
+                            R1_md5="XXXX") for number in range(10)]
+    for readgroup in readgroups:
+        Path(readgroup.R1).write_bytes(b"")
+    samplesheet = write_readgroups(tmp_path / "samplesheet.csv", readgroups)
+    running = collections.Counter()  # type: Dict[str, int]
+    threads = set()
+    lock = threading.Lock()
+    scan_file = utils.scan_file
+
+    def slow_scan_file(path, *args, **kwargs):
+        with lock:
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+        threads.add(threading.current_thread())
+        time.sleep(0.01)
+        with lock:
+            running["now"] -= 1
+        return scan_file(path, *args, **kwargs)
+    monkeypatch.setattr(utils, "scan_file", slow_scan_file)
+
+    async def convert_and_count_ticks() -> int:
+        conversion = asyncio.ensure_future(samplesheet_to_samplegroup_async(
+            samplesheet, file_md5_check=True, max_concurrency=3))
+        ticks = 0
+        while not conversion.done():
+            ticks += 1
+            await asyncio.sleep(0.001)
+        with pytest.raises(ValueError):
+            conversion.result()
+        return ticks
+    # The event loop keeps running while the files are hashed.
+    assert asyncio.run(convert_and_count_ticks()) > 10
+    assert threading.main_thread() not in threads
+    assert running["max"] == 3
+
+
+def test_samplesheet_to_samplegroup_async_cancel(monkeypatch, tmp_path):
+    readgroups = [ReadGroup(f"rg{number}", str(tmp_path / f"{number}.fq"),
+                            R1_md5=R1_MD5) for number in range(10)]
+    for readgroup in readgroups:
+        Path(readgroup.R1).write_bytes(b"")
+    samplesheet = write_readgroups(tmp_path / "samplesheet.csv", readgroups)
+    started = threading.Event()
+    release = threading.Event()
+    scanned = []  # type: List[str]
+
+    def blocking_scan_file(path, *args, **kwargs):
+        scanned.append(path)
+        started.set()
+        release.wait(5)
+        return {"md5": R1_MD5}, None
+    monkeypatch.setattr(utils, "scan_file", blocking_scan_file)
+
+    async def cancel_conversion():
+        conversion = asyncio.ensure_future(samplesheet_to_samplegroup_async(
+            samplesheet, file_md5_check=True, max_concurrency=2))
+        while not started.is_set():
+            await asyncio.sleep(0.001)
+        conversion.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await conversion
+        release.set()
+    asyncio.run(cancel_conversion())
+    # Only the files that were being hashed are read.
+    assert len(scanned) <= 2
@@ -0,0 +1,143 @@
+# Copyright (c) 2019 Leiden University Medical Center
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import json
+import sys
+from pathlib import Path
+
+from biowdl_input_converter import batch, input_conversions, \
+    output_conversions
+from biowdl_input_converter.batch import BatchResult, convert_samplesheets, \
+    output_paths, read_manifest
+from biowdl_input_converter.cache import Md5Cache
+
+import pytest
+
+from . import FILESDIR
+
+R1 = (FILESDIR / "data" / "R1.fq").absolute()
+R2 = (FILESDIR / "data" / "R2.fq").absolute()
+
+
+def write_samplesheet(path: Path, sample: str, r1_md5: str):
+    path.write_text(
+        f'"sample","library","readgroup","R1","R1_md5","R2","R2_md5"\n'
+        f'"{sample}","lib1","rg1","{R1}","{r1_md5}",'
+        f'"{R2}","126a8a51b9d1bbd07fddc65819a542c3"\n')
+
+
+@pytest.fixture()
+def samplesheets(tmp_path):
+    good1 = tmp_path / "flowcell1.csv"
+    good2 = tmp_path / "flowcell2.csv"
+    bad = tmp_path / "flowcell3.csv"
+    write_samplesheet(good1, "s1", "d8e8fca2dc0f896fd7cb4cb0031ba249")
+    write_samplesheet(good2, "s2", "d8e8fca2dc0f896fd7cb4cb0031ba249")
+    write_samplesheet(bad, "s3", "XXXX")
+    return [good1, bad, good2]
+
+
+def expected_json(samplesheet: Path) -> str:
+    return output_conversions.samplegroup_to_biowdl_new_json(
+        input_conversions.samplesheet_csv_to_samplegroup(samplesheet)) + "\n"
+
+
+def test_read_manifest(tmp_path):
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("# Flowcells\na.csv\n\n  /data/b.yml  \n")
+    assert read_manifest(manifest) == [tmp_path / "a.csv",
+                                       Path("/data/b.yml")]
+
+
+def test_output_paths_duplicate_names(tmp_path):
+    with pytest.raises(ValueError) as error:
+        output_paths([Path("a/sheet.csv"), Path("b/sheet.yml"),
+                      Path("c.csv")], tmp_path)
+    error.match("sheet.json")
+
+
+def test_convert_samplesheets(samplesheets, tmp_path):
+    output_dir = tmp_path / "output"
+    results = convert_samplesheets(samplesheets, output_dir,
+                                   file_md5_check=True, jobs=3, threads=2)
+    assert [result.samplesheet for result in results] == samplesheets
+    good1, bad, good2 = results
+    assert good1 == BatchResult(samplesheets[0],
+                                output_dir / "flowcell1.json")
+    assert good1.output.read_text() == expected_json(samplesheets[0])
+    assert good2.output.read_text() == expected_json(samplesheets[2])
+    assert isinstance(bad.error, ValueError)
+    assert "incorrect md5sums" in str(bad.error)
+    assert not bad.output.exists()
+
+
+def test_convert_samplesheets_validate(samplesheets, tmp_path):
+    results = convert_samplesheets(samplesheets)
+    assert all(result.output is None and result.error is None
+               for result in results)
+    assert list(tmp_path.glob("*.json")) == []
+
+
+def test_main(samplesheets, tmp_path, capsys):
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("flowcell3.csv\nflowcell2.csv\n")
+    md5_cache = tmp_path / "md5cache.sqlite"
+    sys.argv = ["biowdl-input-converter-batch", "--check-file-md5sums",
+                "--old", "--md5-cache", str(md5_cache),
+                "-o", str(tmp_path / "output"), "-m", str(manifest),
+                str(samplesheets[0])]
+    with pytest.raises(SystemExit) as error:
+        batch.main()
+    assert error.value.code == "1 of 3 samplesheets failed."
+    assert "flowcell3.csv: ValueError" in capsys.readouterr().err
+    output = json.loads((tmp_path / "output" / "flowcell1.json").read_text())
+    assert "s1" in output["samples"][0]["id"]
+    assert (tmp_path / "output" / "flowcell2.json").exists()
+    # Both reads of every samplesheet point to the same two files.
+    with Md5Cache(md5_cache) as cache:
+        assert len(cache) == 2
+
+
+def test_main_no_output_dir(samplesheets):
+    sys.argv = ["biowdl-input-converter-batch", str(samplesheets[0])]
+    with pytest.raises(SystemExit):
+        batch.main()
+
+
+def test_main_validate(samplesheets, capsys):
+    sys.argv = ["biowdl-input-converter-batch", "--validate",
+                str(samplesheets[0]), str(samplesheets[2])]
+    batch.main()
+    assert capsys.readouterr().err == ""
+
+
+def test_convert_samplesheets_generate_md5sums(tmp_path):
+    samplesheet = tmp_path / "flowcell.csv"
+    write_samplesheet(samplesheet, "s1", "")
+    results = convert_samplesheets(
+        [samplesheet], samplesheet_output_dir=tmp_path / "samplesheets",
+        generate_md5sums=True)
+    assert results[0].error is None
+    assert results[0].samplesheet_output == \
+        tmp_path / "samplesheets" / "flowcell.csv"
+    samplegroup = input_conversions.samplesheet_csv_to_samplegroup(
+        results[0].samplesheet_output)
+    assert samplegroup[0][0][0].R1_md5 == "d8e8fca2dc0f896fd7cb4cb0031ba249"
@@ -18,10 +18,18 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import io
 import json
+from pathlib import Path
 
 from biowdl_input_converter.output_conversions import \
-    samplegroup_to_biowdl_new_json
+    samplegroup_to_biowdl_new_json, samplegroup_to_biowdl_new_structure, \
+    samplegroup_to_biowdl_old_structure, write_biowdl_new_json, \
+    write_sharded_json
+from biowdl_input_converter.samplestructure import Library, ReadGroup, \
+    Sample, SampleGroup
+
+import pytest
 
 from . import COMPLETE_WITH_CONTROL_SAMPLEGROUP, \
     WITHOUT_MD5_SAMPLEGROUP
@@ -82,3 +90,69 @@ def test_without_md5sum_to_biowdl_new_json():
     result_json_loaded = json.loads(result_json)
     assert result_json_loaded == json.loads(samplegroup_to_biowdl_new_json(
         WITHOUT_MD5_SAMPLEGROUP))
+
+
+@pytest.mark.parametrize("samplegroup", [COMPLETE_WITH_CONTROL_SAMPLEGROUP,
+                                         WITHOUT_MD5_SAMPLEGROUP,
+                                         SampleGroup()])
+def test_write_biowdl_new_json(samplegroup):
+    output = io.StringIO()
+    write_biowdl_new_json(samplegroup, output)
+    assert output.getvalue() == samplegroup_to_biowdl_new_json(samplegroup)
+
+
+def test_sizes_to_biowdl_new_structure():
+    samplegroup = SampleGroup([Sample("s1", [Library("lib1", [
+        ReadGroup("rg1", "r1.fq", R1_size=3),
+        ReadGroup("rg2", "r1.fq", "r2.fq", R1_size=3, R2_size=4)])])])
+    assert samplegroup_to_biowdl_new_structure(samplegroup) == {"samples": [
+        {"id": "s1", "total_size": 10, "readgroups": [
+            {"id": "rg1", "R1": "r1.fq", "R1_size": 3, "total_size": 3,
+             "lib_id": "lib1"},
+            {"id": "rg2", "R1": "r1.fq", "R2": "r2.fq", "R1_size": 3,
+             "R2_size": 4, "total_size": 7, "lib_id": "lib1"}]}]}
+
+
+@pytest.mark.parametrize(["samples_per_shard", "old_style_json"],
+                         [(1, False), (2, False), (3, True), (100, True)])
+def test_write_sharded_json(tmp_path, samples_per_shard, old_style_json):
+    samplegroup = SampleGroup([Sample(f"s{number}", [Library("lib1", [
+        ReadGroup("rg1", f"s{number}_r1.fq")])]) for number in range(11)])
+    index = write_sharded_json(samplegroup, tmp_path, samples_per_shard,
+                               old_style_json)
+    shards = index["shards"]
+    assert len(shards) == -(-11 // samples_per_shard)
+    assert sorted(tmp_path.iterdir()) == [
+        Path(shard["path"]) for shard in shards]
+    # Together the shards are the complete structure.
+    samples = []
+    for shard in shards:
+        shard_samples = json.loads(Path(shard["path"]).read_text())["samples"]
+        assert [sample["id"] for sample in shard_samples] == shard["samples"]
+        assert len(shard_samples) <= samples_per_shard
+        samples.extend(shard_samples)
+    structure = (samplegroup_to_biowdl_old_structure if old_style_json
+                 else samplegroup_to_biowdl_new_structure)
+    assert {"samples": samples} == structure(samplegroup)
+
+
+def test_write_sharded_json_samples_per_shard(tmp_path):
+    with pytest.raises(ValueError) as error:
+        write_sharded_json(COMPLETE_WITH_CONTROL_SAMPLEGROUP, tmp_path, 0)
+    error.match("at least 1, not 0")
+    assert write_sharded_json(SampleGroup(), tmp_path) == {"shards": []}
+
+
+def test_write_sharded_json_same_directory(tmp_path):
+    samplegroup = SampleGroup([Sample(f"s{number}", [Library("lib1", [
+        ReadGroup("rg1", f"s{number}_r1.fq")])]) for number in range(11)])
+    write_sharded_json(samplegroup, tmp_path)
+    other_file = tmp_path / "samples_meta.json"
+    other_file.write_text("{}")
+    index = write_sharded_json(samplegroup, tmp_path, samples_per_shard=5)
+    # The width of the numbers changes from 2 to 1.
+    assert sorted(tmp_path.iterdir()) == sorted(
+        [Path(shard["path"]) for shard in index["shards"]] + [other_file])
+    assert [shard["samples"] for shard in index["shards"]] == [
+        ["s0", "s1", "s2", "s3", "s4"], ["s5", "s6", "s7", "s8", "s9"],
+        ["s10"]]
@@ -18,12 +18,18 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import io
 import json
 from pathlib import Path
 
-from biowdl_input_converter.input_conversions import biowdl_yaml_to_samplegroup
+from biowdl_input_converter.input_conversions import \
+    biowdl_dict_to_samplegroup, biowdl_json_to_samplegroup, \
+    biowdl_yaml_to_samplegroup
 from biowdl_input_converter.output_conversions import \
-    samplegroup_to_biowdl_old_json, samplegroup_to_biowdl_old_yaml
+    samplegroup_to_biowdl_old_json, samplegroup_to_biowdl_old_structure, \
+    samplegroup_to_biowdl_old_yaml, write_biowdl_old_json
+
+import pytest
 
 import yaml
 
@@ -37,6 +43,22 @@ def test_import_biowdl_old_yaml_all_fields():
     assert COMPLETE_WITH_CONTROL_SAMPLEGROUP == samplegroup
 
 
+def test_import_biowdl_old_json_all_fields():
+    samplegroup = biowdl_json_to_samplegroup(
+        FILESDIR / Path("complete_with_control.json"))
+    assert COMPLETE_WITH_CONTROL_SAMPLEGROUP == samplegroup
+
+
+def test_export_biowdl_old_yaml_same_as_pure_python():
+    # The libyaml based dumper should give the same result as the python
+    # implementation.
+    yaml_exported = samplegroup_to_biowdl_old_yaml(
+        COMPLETE_WITH_CONTROL_SAMPLEGROUP)
+    assert yaml_exported == yaml.dump(
+        samplegroup_to_biowdl_old_structure(COMPLETE_WITH_CONTROL_SAMPLEGROUP),
+        Dumper=yaml.SafeDumper)
+
+
 def test_export_biowdl_old_yaml_all_fields():
     with (FILESDIR / Path("complete_with_control.yml")).open("r") as yaml_h:
         yaml_contents = yaml_h.read()
@@ -85,3 +107,49 @@ def test_old_style_conversion_yaml_to_json():
     """
     assert json.loads(
         samplegroup_to_biowdl_old_json(samplegroup)) == json.loads(json_result)
+
+
+def test_write_biowdl_old_json():
+    output = io.StringIO()
+    write_biowdl_old_json(COMPLETE_WITH_CONTROL_SAMPLEGROUP, output)
+    assert output.getvalue() == samplegroup_to_biowdl_old_json(
+        COMPLETE_WITH_CONTROL_SAMPLEGROUP)
+
+
+def test_duplicate_sample_id():
+    with pytest.raises(ValueError) as error:
+        biowdl_dict_to_samplegroup({"samples": [
+            {"id": "s1", "libraries": []}, {"id": "s1", "libraries": []}]})
+    error.match("Duplicate sample id 's1'")
+
+
+def test_checksums():
+    samplegroup = biowdl_dict_to_samplegroup({"samples": [
+        {"id": "s1", "libraries": [{"id": "lib1", "readgroups": [
+            {"id": "rg1", "reads": {"R1": "r1.fq", "R1_md5": "aa",
+                                    "R1_sha512": "bb", "unknown": "cc"}}]}]}]})
+    readgroup = samplegroup[0][0][0]
+    assert readgroup.R1_md5 == "aa"
+    assert readgroup.checksums == {"R1_sha512": "bb"}
+    assert json.loads(samplegroup_to_biowdl_old_json(samplegroup))[
+        "samples"][0]["libraries"][0]["readgroups"][0]["reads"] == {
+        "R1": "r1.fq", "R1_md5": "aa", "R1_sha512": "bb"}
+
+
+def test_sizes():
+    samplegroup = biowdl_dict_to_samplegroup({"samples": [
+        {"id": "s1", "libraries": [{"id": "lib1", "readgroups": [
+            {"id": "rg1", "reads": {"R1": "r1.fq", "R1_size": 3,
+                                    "R2": "r2.fq", "R2_size": 4},
+             "total_size": 7}]}],
+         "total_size": 7}]})
+    readgroup = samplegroup[0][0][0]
+    assert (readgroup.R1_size, readgroup.R2_size) == (3, 4)
+    # The totals are calculated, not read as additional properties.
+    assert readgroup.additional_properties == {}
+    assert samplegroup[0].additional_properties == {}
+    sample = samplegroup_to_biowdl_old_structure(samplegroup)["samples"][0]
+    assert sample["total_size"] == 7
+    assert sample["libraries"][0]["readgroups"][0] == {
+        "id": "rg1", "total_size": 7,
+        "reads": {"R1": "r1.fq", "R1_size": 3, "R2": "r2.fq", "R2_size": 4}}
@@ -0,0 +1,213 @@
+# Copyright (c) 2019 Leiden University Medical Center
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import shutil
+from pathlib import Path
+
+from biowdl_input_converter import input_conversions, samplesheet_to_json, \
+    utils
+from biowdl_input_converter.cache import Md5Cache, ResultCache
+
+import pytest
+
+from . import FILESDIR
+
+EMPTY_MD5 = "d41d8cd98f00b204e9800998ecf8427e"
+
+
+@pytest.fixture()
+def md5_cache(tmp_path):
+    with Md5Cache(tmp_path / "md5cache.sqlite") as cache:
+        yield cache
+
+
+def test_md5_cache_set_and_get(md5_cache):
+    fingerprint = md5_cache.fingerprint(FILESDIR / "empty.csv")
+    assert md5_cache.get(fingerprint) is None
+    md5_cache.set(fingerprint, EMPTY_MD5)
+    assert md5_cache.get(fingerprint) == EMPTY_MD5
+
+
+def test_md5_cache_persistent(tmp_path):
+    fingerprint = Md5Cache.fingerprint(FILESDIR / "empty.csv")
+    with Md5Cache(tmp_path / "md5cache.sqlite") as cache:
+        cache.set(fingerprint, EMPTY_MD5)
+    with Md5Cache(tmp_path / "md5cache.sqlite") as cache:
+        assert cache.get(fingerprint) == EMPTY_MD5
+
+
+def test_md5_cache_changed_file(md5_cache, tmp_path):
+    test_file = tmp_path / "test.txt"
+    test_file.write_text("test")
+    fingerprint = md5_cache.fingerprint(test_file)
+    md5_cache.set(fingerprint, "test_md5")
+    test_file.write_text("changed")
+    os.utime(test_file, ns=(0, 0))
+    new_fingerprint = md5_cache.fingerprint(test_file)
+    assert md5_cache.get(new_fingerprint) is None
+    md5_cache.set(new_fingerprint, "changed_md5")
+    # The entry of the old file is removed.
+    assert md5_cache.get(fingerprint) is None
+    assert len(md5_cache) == 1
+
+
+def test_md5_cache_missing_file(md5_cache):
+    fingerprint = md5_cache.fingerprint(Path("illuminati.txt"))
+    assert fingerprint is None
+    assert md5_cache.get(fingerprint) is None
+
+
+def test_md5_cache_eviction(tmp_path):
+    with Md5Cache(tmp_path / "md5cache.sqlite", max_entries=2) as cache:
+        for name in ("empty.csv", "complete.csv", "complete.yml"):
+            cache.set(cache.fingerprint(FILESDIR / name), name)
+        # Make sure the first file is the most recently used.
+        cache.get(cache.fingerprint(FILESDIR / "empty.csv"))
+        cache.commit()
+        assert len(cache) == 2
+        assert cache.get(cache.fingerprint(FILESDIR / "empty.csv")) == \
+            "empty.csv"
+        assert cache.get(cache.fingerprint(FILESDIR / "complete.csv")) is None
+
+
+def locked_out_quickly(cache):
+    # Fail fast instead of after the timeout of 60 seconds.
+    cache.connection.execute("PRAGMA busy_timeout = 100")
+    return cache
+
+
+def test_md5_cache_shared_by_jobs(tmp_path):
+    path = tmp_path / "md5cache.sqlite"
+    empty, complete = FILESDIR / "empty.csv", FILESDIR / "complete.csv"
+    with Md5Cache(path) as cache:
+        cache.set(cache.fingerprint(empty), EMPTY_MD5)
+    with Md5Cache(path) as job1, locked_out_quickly(Md5Cache(path)) as job2:
+        # A cache hit and a new md5sum while job1 is still hashing.
+        assert job1.get(job1.fingerprint(empty)) == EMPTY_MD5
+        job1.set(job1.fingerprint(complete), "complete")
+        assert not job1.connection.in_transaction
+        job2.set(job2.fingerprint(FILESDIR / "complete.yml"), "yml")
+        job2.commit()
+        job1.commit()
+        assert len(job2) == 3
+
+
+def test_md5_cache_commit_only_prunes_when_full(md5_cache):
+    statements = []
+    md5_cache.connection.set_trace_callback(statements.append)
+    md5_cache.set(md5_cache.fingerprint(FILESDIR / "empty.csv"), EMPTY_MD5)
+    md5_cache.commit()
+    assert not [statement for statement in statements
+                if "ORDER BY last_used" in statement]
+
+
+def test_check_md5sums_uses_cache(md5_cache, monkeypatch):
+    utils.check_md5sums([(FILESDIR / "empty.csv", EMPTY_MD5)],
+                        md5_cache=md5_cache)
+    assert md5_cache.get(md5_cache.fingerprint(FILESDIR / "empty.csv")) == \
+        EMPTY_MD5
+
+    def fail(filepath, *args, **kwargs):
+        raise AssertionError(f"{filepath} should not be hashed.")
+    monkeypatch.setattr(utils, "scan_file", fail)
+    utils.check_md5sums([(FILESDIR / "empty.csv", EMPTY_MD5)],
+                        md5_cache=md5_cache)
+
+
+@pytest.fixture()
+def result_cache(tmp_path):
+    with ResultCache(tmp_path / "results.sqlite") as cache:
+        yield cache
+
+
+def test_result_cache_key():
+    key = ResultCache.key(b"samplesheet", {"a": 1, "b": [2]})
+    assert key == ResultCache.key(b"samplesheet", {"b": [2], "a": 1})
+    assert key != ResultCache.key(b"samplesheet2", {"a": 1, "b": [2]})
+    assert key != ResultCache.key(b"samplesheet", {"a": 2, "b": [2]})
+
+
+def test_result_cache_changed_files(result_cache, tmp_path):
+    existing = tmp_path / "existing.fq"
+    existing.write_text("reads")
+    added = tmp_path / "added.fq"
+    for change in (lambda: os.utime(existing, ns=(0, 0)),
+                   lambda: added.write_text("reads"),
+                   lambda: added.unlink()):
+        result_cache.set("key", [str(existing), str(added)], "result")
+        assert result_cache.get("key") == "result"
+        change()
+        assert result_cache.get("key") is None
+        # The invalid result is removed.
+        assert len(result_cache) == 0
+
+
+def test_result_cache_persistent(tmp_path):
+    with ResultCache(tmp_path / "results.sqlite") as cache:
+        cache.set("key", [str(FILESDIR / "empty.csv")], "result")
+    with ResultCache(tmp_path / "results.sqlite") as cache:
+        assert cache.get("key") == "result"
+
+
+def test_samplesheet_to_json_result_cache(result_cache, tmp_path,
+                                          monkeypatch):
+    data_dir = tmp_path / "data"
+    shutil.copytree(FILESDIR / "data", data_dir)
+    samplesheet = tmp_path / "samplesheet.csv"
+    samplesheet.write_text(
+        '"sample","library","readgroup","R1","R1_md5"\n'
+        f'"s1","lib1","rg1","{data_dir / "R1.fq"}",'
+        f'"d8e8fca2dc0f896fd7cb4cb0031ba249"\n')
+    output_json = samplesheet_to_json(samplesheet, file_md5_check=True,
+                                      result_cache=result_cache)
+    parse = input_conversions.samplesheet_csv_to_samplegroup
+
+    def fail(samplesheet_file):
+        raise AssertionError("The samplesheet should not be parsed.")
+    monkeypatch.setattr(input_conversions, "samplesheet_csv_to_samplegroup",
+                        fail)
+    assert samplesheet_to_json(samplesheet, file_md5_check=True,
+                               result_cache=result_cache) == output_json
+    # Other options, samplesheets or files are converted again.
+    monkeypatch.setattr(input_conversions, "samplesheet_csv_to_samplegroup",
+                        parse)
+    assert samplesheet_to_json(samplesheet, result_cache=result_cache,
+                               old_style_json=True) != output_json
+    (data_dir / "R1.fq").write_text("changed")
+    with pytest.raises(ValueError) as error:
+        samplesheet_to_json(samplesheet, file_md5_check=True,
+                            result_cache=result_cache)
+    error.match("incorrect md5sums")
+
+
+def test_result_cache_shared_by_jobs(tmp_path):
+    path = tmp_path / "results.sqlite"
+    files = [str(FILESDIR / "empty.csv")]
+    with ResultCache(path) as cache:
+        cache.set("key", files, "result")
+    with ResultCache(path) as service, \
+            locked_out_quickly(ResultCache(path)) as job:
+        assert service.get("key") == "result"
+        assert not service.connection.in_transaction
+        job.set("other key", files, "other result")
+        job.commit()
+        assert service.get("other key") == "other result"
@@ -18,12 +18,15 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import io
 from pathlib import Path
 
 from biowdl_input_converter.input_conversions import \
     samplesheet_csv_to_samplegroup
 from biowdl_input_converter.output_conversions import \
-    samplegroup_to_biowdl_old_yaml
+    samplegroup_to_biowdl_old_yaml, write_csv_samplesheet
+from biowdl_input_converter.samplestructure import Library, ReadGroup, \
+    Sample, SampleGroup
 
 import pytest
 
@@ -112,3 +115,55 @@ def test_duplicate_readgroup():
         samplesheet_csv_to_samplegroup(
             FILESDIR / Path("duplicate_readgroup.csv"))
     assert error.match("Duplicate readgroup id s2-lib1-rg1")
+
+
+def test_row_with_missing_fields(tmp_path):
+    samplesheet = tmp_path / "samplesheet.csv"
+    samplesheet.write_text('"sample","library","readgroup","R1","R2"\n'
+                           '"s1","lib1","rg1","r1.fq","r2.fq"\n'
+                           '"s1","lib1","rg2","r1.fq"\n')
+    with pytest.raises(ValueError) as error:
+        samplesheet_csv_to_samplegroup(samplesheet)
+    assert error.match("Row has fewer fields than the header")
+
+
+@pytest.mark.parametrize(["samplesheet", "delimiter"], [
+    ("complete.csv", ","),
+    ("mixed_empty_filled_addprops.csv", ","),
+    ("without_readgroup.tsv", "\t")])
+def test_write_csv_samplesheet_round_trip(samplesheet, delimiter, tmp_path):
+    samplegroup = samplesheet_csv_to_samplegroup(FILESDIR / samplesheet)
+    output = tmp_path / ("output" + Path(samplesheet).suffix)
+    with output.open("w", newline="") as output_h:
+        write_csv_samplesheet(samplegroup, output_h, delimiter)
+    assert samplesheet_csv_to_samplegroup(output) == samplegroup
+
+
+def test_write_csv_samplesheet_library_properties(tmp_path):
+    samplegroup = SampleGroup([Sample("s1", [Library(
+        "lib1", [ReadGroup("rg1", "r1.fq")],
+        additional_properties={"kit": "x"})])])
+    with pytest.raises(ValueError) as error:
+        write_csv_samplesheet(samplegroup, io.StringIO())
+    error.match("Sample 's1', library 'lib1'")
+
+
+def test_checksum_columns(tmp_path):
+    samplesheet = tmp_path / "samplesheet.csv"
+    samplesheet.write_text(
+        '"sample","library","readgroup","R1","R1_sha256","R2","R2_blake2b",'
+        '"batch"\n'
+        '"s1","lib1","rg1","r1.fq","aa","r2.fq","bb","b1"\n'
+        '"s1","lib1","rg2","r1b.fq",,"r2b.fq","cc",\n')
+    samplegroup = samplesheet_csv_to_samplegroup(samplesheet)
+    readgroups = samplegroup[0][0].readgroups
+    assert readgroups[0].checksums == {"R1_sha256": "aa", "R2_blake2b": "bb"}
+    assert readgroups[1].checksums == {"R2_blake2b": "cc"}
+    assert samplegroup[0].additional_properties == {"batch": "b1"}
+    output = tmp_path / "output.csv"
+    with output.open("w", newline="") as output_h:
+        write_csv_samplesheet(samplegroup, output_h)
+    assert output.read_text().splitlines()[0] == (
+        "sample,library,readgroup,R1,R1_md5,R2,R2_md5,R1_sha256,R2_blake2b,"
+        "batch")
+    assert samplesheet_csv_to_samplegroup(output) == samplegroup
@@ -18,14 +18,22 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import gzip
+import hashlib
+import json
 import os
+import pstats
+import subprocess  # nosec
 import sys
 import tempfile
+import tracemalloc
 from pathlib import Path
 
 import biowdl_input_converter
 from biowdl_input_converter import input_conversions, \
     output_conversions, samplesheet_to_json
+from biowdl_input_converter.cache import Md5Cache
+from biowdl_input_converter.utils import JSON_BACKENDS
 
 import pytest
 
@@ -75,6 +83,32 @@ def test_yaml_samplesheet_to_json():
     assert output == correct_output
 
 
+def test_json_samplesheet_to_json():
+    samplesheet = FILESDIR / Path("complete_with_control.json")
+    output = samplesheet_to_json(samplesheet, file_presence_check=False,
+                                 file_duplication_check=False)
+    correct_output = output_conversions.samplegroup_to_biowdl_new_json(
+        input_conversions.biowdl_yaml_to_samplegroup(
+            FILESDIR / Path("complete_with_control.yml")))
+    assert output == correct_output
+
+
+@pytest.mark.parametrize("backend", JSON_BACKENDS)
+def test_json_backends_identical_output(backend, tmp_path):
+    pytest.importorskip(backend)
+    samplesheet = tmp_path / "samplesheet.json"
+    samplesheet.write_text(json.dumps({"samples": [{
+        "id": "s\u00e9", "control": None, "number": 1.5, "big": 2 ** 70,
+        "nan": float("nan"),
+        "libraries": [{"id": "lib/1", "readgroups": [{
+            "id": "rg\t1", "reads": {"R1": "/data/r1 \u2603.fq"}}]}]}]}))
+    output = samplesheet_to_json(samplesheet, file_presence_check=False,
+                                 json_backend=backend)
+    assert output == samplesheet_to_json(samplesheet,
+                                         file_presence_check=False,
+                                         json_backend="json")
+
+
 def test_nosuffix():
     samplesheet = FILESDIR / Path("804935870934875")
     output = samplesheet_to_json(samplesheet, fileformat='yaml')
@@ -108,6 +142,90 @@ def test_main(correct_md5sum_samplesheet, capsys):
     assert stdout == correct_output
 
 
+@pytest.mark.parametrize("options", [[], ["--threads-per-device", "1"],
+                                     ["--pipeline"]])
+def test_main_threads(correct_md5sum_samplesheet, capsys, options):
+    sys.argv = ["biowdl-input-converter",
+                "--check-file-md5sums",
+                "--threads", "2",
+                *options,
+                str(correct_md5sum_samplesheet)]
+    biowdl_input_converter.main()
+    stdout = capsys.readouterr().out
+    correct_output = output_conversions.samplegroup_to_biowdl_new_json(
+        input_conversions.samplesheet_csv_to_samplegroup(
+            correct_md5sum_samplesheet)) + '\n'
+    assert stdout == correct_output
+
+
+def test_main_old_style_json(correct_md5sum_samplesheet, capsys):
+    sys.argv = ["biowdl-input-converter", "--old",
+                str(correct_md5sum_samplesheet)]
+    biowdl_input_converter.main()
+    stdout = capsys.readouterr().out
+    correct_output = output_conversions.samplegroup_to_biowdl_old_json(
+        input_conversions.samplesheet_csv_to_samplegroup(
+            correct_md5sum_samplesheet)) + '\n'
+    assert stdout == correct_output
+
+
+def test_main_md5_cache(correct_md5sum_samplesheet, tmp_path):
+    md5_cache = tmp_path / "md5cache.sqlite"
+    sys.argv = ["biowdl-input-converter",
+                "--check-file-md5sums",
+                "--md5-cache", str(md5_cache),
+                "--validate",
+                str(correct_md5sum_samplesheet)]
+    biowdl_input_converter.main()
+    with Md5Cache(md5_cache) as cache:
+        assert len(cache) == 2
+
+
+def test_main_timings(correct_md5sum_samplesheet, tmp_path):
+    timings_file = tmp_path / "timings.json"
+    sys.argv = ["biowdl-input-converter",
+                "--check-file-md5sums",
+                "--timings", str(timings_file),
+                "-o", str(tmp_path / "output.json"),
+                str(correct_md5sum_samplesheet)]
+    biowdl_input_converter.main()
+    stages = json.loads(timings_file.read_text())["stages"]
+    assert [stage["name"] for stage in stages] == [
+        "parse", "check_existence", "check_md5sums", "check_duplicates",
+        "output"]
+    assert stages[0]["items"] == 1
+    assert stages[2]["items"] == 2
+    assert stages[2]["bytes"] == sum(
+        (FILESDIR / "data" / read).stat().st_size
+        for read in ("R1.fq", "R2.fq"))
+
+
+def test_main_timings_summary(correct_md5sum_samplesheet, capsys):
+    sys.argv = ["biowdl-input-converter", "--timings", "--validate",
+                str(correct_md5sum_samplesheet)]
+    biowdl_input_converter.main()
+    stderr = capsys.readouterr().err
+    assert "check_existence" in stderr
+
+
+def test_main_trace_memory(correct_md5sum_samplesheet, capsys):
+    sys.argv = ["biowdl-input-converter", "--timings", "--trace-memory",
+                "--validate", str(correct_md5sum_samplesheet)]
+    biowdl_input_converter.main()
+    assert "peak MiB" in capsys.readouterr().err
+    # Tracing stops with the conversion.
+    assert not tracemalloc.is_tracing()
+
+
+def test_main_profile(correct_md5sum_samplesheet, tmp_path):
+    profile = tmp_path / "profile.pstats"
+    sys.argv = ["biowdl-input-converter", "--profile", str(profile),
+                "--validate", str(correct_md5sum_samplesheet)]
+    biowdl_input_converter.main()
+    assert "samplesheet_to_samplegroup" in str(
+        pstats.Stats(str(profile)).stats)
+
+
 def test_main_validate(correct_md5sum_samplesheet, capsys):
     sys.argv = ["biowdl-input-converter",
                 "--check-file-md5sums",
@@ -131,3 +249,193 @@ def test_main_output_file(correct_md5sum_samplesheet):
             correct_md5sum_samplesheet)) + '\n'
     assert output_contents == correct_output
     os.remove(str(output_file))
+
+
+def test_lazy_imports():
+    # Modules that are only needed for some options or formats should not
+    # slow down the startup of the command line tool.
+    package_dir = Path(biowdl_input_converter.__file__).parent.parent
+    result = subprocess.run(  # nosec
+        [sys.executable, "-c",
+         "import sys, biowdl_input_converter; print(' '.join(sys.modules))"],
+        stdout=subprocess.PIPE, check=True, universal_newlines=True,
+        env=dict(os.environ, PYTHONPATH=str(package_dir)))
+    imported_modules = set(result.stdout.split())
+    for module in ("yaml", "sqlite3", "hashlib", "concurrent.futures",
+                   "cProfile", "tracemalloc", "queue", "asyncio"):
+        assert module not in imported_modules
+
+
+def test_main_duplicate_check_mode(correct_md5sum_samplesheet, tmp_path):
+    link = tmp_path / "link.fq"
+    os.symlink(FILESDIR / "data" / "R1.fq", link)
+    samplesheet = tmp_path / "samplesheet.csv"
+    samplesheet.write_text(correct_md5sum_samplesheet.read_text() +
+                           f'"s1","lib1","rg2","{link}",,,\n')
+    sys.argv = ["biowdl-input-converter", "--validate", str(samplesheet)]
+    biowdl_input_converter.main()
+    sys.argv = ["biowdl-input-converter", "--validate",
+                "--duplicate-check-mode", "inode", str(samplesheet)]
+    with pytest.raises(ValueError) as error:
+        biowdl_input_converter.main()
+    error.match("occur multiple times")
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".tsv", ".yml", ".json"])
+def test_main_generate_md5sums(correct_md5sum_samplesheet, tmp_path, capsys,
+                               suffix):
+    samplesheet = tmp_path / "samplesheet.csv"
+    samplesheet.write_text(correct_md5sum_samplesheet.read_text().replace(
+        "d8e8fca2dc0f896fd7cb4cb0031ba249", "").replace(
+        "126a8a51b9d1bbd07fddc65819a542c3", ""))
+    updated_samplesheet = tmp_path / ("updated" + suffix)
+    sys.argv = ["biowdl-input-converter", "--generate-md5sums",
+                "--write-samplesheet", str(updated_samplesheet),
+                str(samplesheet)]
+    biowdl_input_converter.main()
+    expected = input_conversions.samplesheet_csv_to_samplegroup(
+        correct_md5sum_samplesheet)
+    assert capsys.readouterr().out == \
+        output_conversions.samplegroup_to_biowdl_new_json(expected) + "\n"
+    assert biowdl_input_converter.samplesheet_to_samplegroup(
+        updated_samplesheet) == expected
+
+
+def test_main_write_samplesheet_unsupported_format(correct_md5sum_samplesheet,
+                                                   tmp_path, monkeypatch,
+                                                   capsys):
+    updated_samplesheet = tmp_path / "updated.txt"
+    sys.argv = ["biowdl-input-converter",
+                "--write-samplesheet", str(updated_samplesheet),
+                str(correct_md5sum_samplesheet)]
+
+    def fail(samplesheet_file, **kwargs):
+        raise AssertionError("The samplesheet should not be parsed.")
+    monkeypatch.setattr(input_conversions, "samplesheet_csv_to_samplegroup",
+                        fail)
+    with pytest.raises(SystemExit):
+        biowdl_input_converter.main()
+    assert "--write-samplesheet must end in one of" in \
+        capsys.readouterr().err
+    assert not updated_samplesheet.exists()
+
+
+def test_write_samplesheet_file_unsupported_format(
+        correct_md5sum_samplesheet, tmp_path):
+    samplegroup = biowdl_input_converter.samplesheet_to_samplegroup(
+        correct_md5sum_samplesheet)
+    updated_samplesheet = tmp_path / "updated.txt"
+    with pytest.raises(NotImplementedError):
+        biowdl_input_converter.write_samplesheet_file(
+            samplegroup, updated_samplesheet)
+    assert not updated_samplesheet.exists()
+
+
+def test_main_check_gzip(tmp_path):
+    reads = (FILESDIR / "data" / "R1.fq").read_bytes()
+    valid = tmp_path / "valid.fq.gz"
+    valid.write_bytes(gzip.compress(reads))
+    truncated = tmp_path / "truncated.fq.gz"
+    truncated.write_bytes(gzip.compress(reads)[:-1])
+    samplesheet = tmp_path / "samplesheet.csv"
+    samplesheet.write_text('"sample","library","readgroup","R1","R2"\n'
+                           f'"s1","lib1","rg1","{valid}","{truncated}"\n')
+    sys.argv = ["biowdl-input-converter", "--validate", str(samplesheet)]
+    biowdl_input_converter.main()
+    sys.argv = ["biowdl-input-converter", "--validate", "--check-gzip",
+                str(samplesheet)]
+    with pytest.raises(ValueError) as error:
+        biowdl_input_converter.main()
+    error.match(f"not valid gzip files: {truncated}: unexpected end of file")
+
+
+def test_main_generate_checksums(correct_md5sum_samplesheet, tmp_path, capsys):
+    updated_samplesheet = tmp_path / "updated.csv"
+    sys.argv = ["biowdl-input-converter", "--check-file-md5sums",
+                "--generate-checksums", "sha256", "blake2s",
+                "--write-samplesheet", str(updated_samplesheet),
+                str(correct_md5sum_samplesheet)]
+    biowdl_input_converter.main()
+    readgroup = json.loads(capsys.readouterr().out)[
+        "samples"][0]["readgroups"][0]
+    r1, r2 = FILESDIR / "data" / "R1.fq", FILESDIR / "data" / "R2.fq"
+    assert {key: value for key, value in readgroup.items()
+            if key[3:] in ("sha256", "blake2s")} == {
+        "R1_sha256": hashlib.sha256(r1.read_bytes()).hexdigest(),
+        "R1_blake2s": hashlib.blake2s(r1.read_bytes()).hexdigest(),
+        "R2_sha256": hashlib.sha256(r2.read_bytes()).hexdigest(),
+        "R2_blake2s": hashlib.blake2s(r2.read_bytes()).hexdigest()}
+    # The generated checksums are checked when the samplesheet is read.
+    updated_samplesheet.write_text(updated_samplesheet.read_text().replace(
+        readgroup["R2_sha256"], "0" * 64))
+    sys.argv = ["biowdl-input-converter", "--check-file-md5sums",
+                str(updated_samplesheet)]
+    with pytest.raises(ValueError) as error:
+        biowdl_input_converter.main()
+    error.match(r"incorrect checksums: .*R2.fq \(sha256\)")
+
+
+@pytest.mark.parametrize("old", [[], ["--old"]])
+def test_main_record_sizes(correct_md5sum_samplesheet, capsys, old):
+    sys.argv = ["biowdl-input-converter", "--record-sizes", *old,
+                str(correct_md5sum_samplesheet)]
+    biowdl_input_converter.main()
+    sample = json.loads(capsys.readouterr().out)["samples"][0]
+    r1_size = (FILESDIR / "data" / "R1.fq").stat().st_size
+    r2_size = (FILESDIR / "data" / "R2.fq").stat().st_size
+    readgroup = (sample["libraries"][0]["readgroups"][0] if old
+                 else sample["readgroups"][0])
+    reads = readgroup["reads"] if old else readgroup
+    assert (reads["R1_size"], reads["R2_size"]) == (r1_size, r2_size)
+    assert readgroup["total_size"] == r1_size + r2_size
+    assert sample["total_size"] == r1_size + r2_size
+
+
+def test_main_shard_dir(correct_md5sum_samplesheet, tmp_path, capsys):
+    shard_dir = tmp_path / "shards"
+    sys.argv = ["biowdl-input-converter", "--shard-dir", str(shard_dir),
+                str(correct_md5sum_samplesheet)]
+    biowdl_input_converter.main()
+    index = json.loads(capsys.readouterr().out)
+    shard = shard_dir / "samples_0.json"
+    assert index == {"shards": [{"path": str(shard), "samples": ["s1"]}]}
+    assert shard.read_text() == \
+        output_conversions.samplegroup_to_biowdl_new_json(
+            input_conversions.samplesheet_csv_to_samplegroup(
+                correct_md5sum_samplesheet)) + "\n"
+    sys.argv = ["biowdl-input-converter", "--shard-dir", str(shard_dir),
+                "--samples-per-shard", "0", str(correct_md5sum_samplesheet)]
+    with pytest.raises(SystemExit):
+        biowdl_input_converter.main()
+    assert "--samples-per-shard must be at least 1" in \
+        capsys.readouterr().err
+
+
+def test_main_result_cache(correct_md5sum_samplesheet, tmp_path, capsys,
+                           monkeypatch):
+    sys.argv = ["biowdl-input-converter", "--check-file-md5sums",
+                str(correct_md5sum_samplesheet)]
+    biowdl_input_converter.main()
+    expected = capsys.readouterr().out
+    sys.argv = ["biowdl-input-converter", "--check-file-md5sums",
+                "--result-cache", str(tmp_path / "results.sqlite"),
+                str(correct_md5sum_samplesheet)]
+    biowdl_input_converter.main()
+    assert capsys.readouterr().out == expected
+
+    def fail(samplesheet_file):
+        raise AssertionError("The samplesheet should not be parsed.")
+    monkeypatch.setattr(input_conversions, "samplesheet_csv_to_samplegroup",
+                        fail)
+    biowdl_input_converter.main()
+    assert capsys.readouterr().out == expected
+
+
+def test_main_result_cache_write_samplesheet(correct_md5sum_samplesheet,
+                                             tmp_path):
+    sys.argv = ["biowdl-input-converter",
+                "--result-cache", str(tmp_path / "results.sqlite"),
+                "--write-samplesheet", str(tmp_path / "samplesheet.csv"),
+                str(correct_md5sum_samplesheet)]
+    with pytest.raises(SystemExit):
+        biowdl_input_converter.main()
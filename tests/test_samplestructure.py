@@ -18,8 +18,10 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from biowdl_input_converter.samplestructure import Library, ReadGroup, \
-    Sample, SampleGroup
+import pickle
+
+from biowdl_input_converter.samplestructure import EMPTY_PROPERTIES, \
+    Library, ReadGroup, Sample, SampleGroup
 
 import pytest
 
@@ -58,6 +60,20 @@ def test_readgroup_with_md5s_as_dict():
     assert readgroup.as_dict() == rg_dict
 
 
+def test_readgroup_checksums():
+    readgroup = ReadGroup("rg1", "r1.fq", "r2.fq", R1_md5="aa",
+                          checksums={"R1_sha256": "bb", "R2_sha256": "cc",
+                                     "R2_crc32c": "dd"})
+    assert readgroup.as_dict() == dict(
+        id="rg1", R1="r1.fq", R1_md5="aa", R2="r2.fq", R1_sha256="bb",
+        R2_sha256="cc", R2_crc32c="dd")
+    assert list(readgroup.files_and_checksums()) == [
+        ("r1.fq", {"md5": "aa", "sha256": "bb"}),
+        ("r2.fq", {"sha256": "cc", "crc32c": "dd"})]
+    assert list(ReadGroup("rg2", "r1.fq").files_and_checksums()) == [
+        ("r1.fq", {})]
+
+
 def test_library_append_and_access():
     readgroup = ReadGroup(id="bla", R1="bla.fq")
     library = Library(id="blalib")
@@ -117,3 +133,89 @@ def test_samplegroup_from_dict_of_dicts():
             ])])
     ])
     assert SampleGroup.from_dict_of_dicts(dict_of_dicts) == samplegroup
+
+
+@pytest.mark.parametrize("node", [ReadGroup(id="rg1", R1="r1.fq"),
+                                  Library(id="lib1"),
+                                  Sample(id="s1"),
+                                  SampleGroup()])
+def test_nodes_have_no_dict(node):
+    assert not hasattr(node, "__dict__")
+    with pytest.raises(AttributeError):
+        node.undefined_attribute = "bla"
+
+
+def test_empty_properties_shared():
+    library = Library(id="lib1")
+    sample = Sample(id="s1")
+    assert library.additional_properties is sample.additional_properties
+    assert library.additional_properties == {}
+    with pytest.raises(TypeError):
+        library.additional_properties["bla"] = "bla"  # type: ignore
+
+
+def test_pickle_samplegroup():
+    samplegroup = SampleGroup([
+        Sample(id="s1", additional_properties=dict(control="s2"), libraries=[
+            Library(id="lib1", readgroups=[
+                ReadGroup(id="rg1", R1="r1.fq")])])])
+    unpickled = pickle.loads(pickle.dumps(samplegroup))
+    assert unpickled == samplegroup
+    assert unpickled[0][0][0].additional_properties is EMPTY_PROPERTIES
+    assert unpickled.get("s1").get("lib1").get("rg1") == ReadGroup(
+        id="rg1", R1="r1.fq")
+
+
+def test_get_and_contains():
+    readgroup = ReadGroup(id="rg1", R1="r1.fq")
+    library = Library(id="lib1", readgroups=[readgroup])
+    sample = Sample(id="s1")
+    sample.append(library)
+    samplegroup = SampleGroup([sample])
+    assert samplegroup.get("s1") is sample
+    assert sample.get("lib1") is library
+    assert library.get("rg1") is readgroup
+    assert library.get("rg2") is None
+    assert library.get("rg2", readgroup) is readgroup
+    assert "s1" in samplegroup
+    assert "s2" not in samplegroup
+    assert library in sample
+    assert Library(id="lib1") not in sample
+
+
+@pytest.mark.parametrize(["parent", "child", "message"], [
+    (Library(id="lib1"), ReadGroup(id="rg1", R1="r1.fq"),
+     "Duplicate readgroup id 'rg1' in library 'lib1'"),
+    (Sample(id="s1"), Library(id="lib1"),
+     "Duplicate library id 'lib1' in sample 's1'"),
+    (SampleGroup(), Sample(id="s1"), "Duplicate sample id 's1'$"),
+])
+def test_append_duplicate_id(parent, child, message):
+    parent.append(child)
+    with pytest.raises(ValueError) as error:
+        parent.append(child)
+    error.match(message)
+    assert len(list(parent)) == 1
+
+
+def test_duplicate_ids_in_constructor():
+    with pytest.raises(ValueError) as error:
+        Sample(id="s1", libraries=[Library(id="lib1"), Library(id="lib1")])
+    error.match("Duplicate library id 'lib1' in sample 's1'")
+
+
+def test_total_size():
+    single = ReadGroup("rg1", "r1.fq", R1_size=10)
+    paired = ReadGroup("rg2", "r1.fq", "r2.fq", R1_size=10, R2_size=5)
+    assert single.total_size == 10
+    assert paired.total_size == 15
+    assert ReadGroup("rg3", "r1.fq", "r2.fq", R1_size=10).total_size is None
+    assert paired.as_dict() == dict(id="rg2", R1="r1.fq", R2="r2.fq",
+                                    R1_size=10, R2_size=5, total_size=15)
+    sample = Sample("s1", [Library("lib1", [single]), Library("lib2",
+                                                              [paired])])
+    assert sample.total_size == 25
+    sample[0].append(ReadGroup("rg4", "r1.fq"))
+    assert sample.total_size is None
+    # Nothing is recorded for an empty sample.
+    assert Sample("s2").total_size is None
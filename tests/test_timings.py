@@ -0,0 +1,81 @@
+# Copyright (c) 2019 Leiden University Medical Center
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import time
+import tracemalloc
+
+from biowdl_input_converter.timings import Timings
+
+import pytest
+
+
+def test_timings_stage():
+    timings = Timings()
+    with timings.stage("sleep") as stage:
+        time.sleep(0.01)
+        stage.items = 3
+        stage.bytes = 2 ** 20
+    assert len(timings.stages) == 1
+    assert timings.stages[0].name == "sleep"
+    assert timings.stages[0].wall_time >= 0.01
+    assert timings.stages[0].cpu_time < timings.stages[0].wall_time
+    assert timings.stages[0].memory_peak is None
+    assert timings.as_dict()["stages"][0]["items"] == 3
+    assert "sleep" in timings.summary()
+
+
+def test_timings_stage_with_error():
+    timings = Timings()
+    with pytest.raises(ValueError):
+        with timings.stage("failing"):
+            raise ValueError("failed")
+    assert timings.stages[0].name == "failing"
+
+
+def test_timings_trace_memory():
+    timings = Timings(trace_memory=True)
+    with timings.stage("allocate"):
+        data = bytearray(2 ** 20)
+    del data
+    memory_peak = timings.stages[0].memory_peak
+    assert memory_peak is not None
+    assert memory_peak >= 2 ** 20
+    timings.close()
+    assert not tracemalloc.is_tracing()
+    # The measurements are kept.
+    assert timings.stages[0].memory_peak == memory_peak
+
+
+def test_timings_trace_memory_context_manager():
+    with Timings(trace_memory=True):
+        assert tracemalloc.is_tracing()
+    assert not tracemalloc.is_tracing()
+
+
+def test_timings_close_keeps_tracing_of_others():
+    tracemalloc.start()
+    try:
+        with Timings(trace_memory=True) as timings:
+            with timings.stage("allocate"):
+                pass
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
@@ -18,12 +18,28 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import collections
+import gzip
+import hashlib
+import os
+import sys
+import threading
+import time
 from pathlib import Path
+from typing import Dict, Tuple
 
-from biowdl_input_converter.utils import (check_duplicate_files,
+from biowdl_input_converter import utils
+from biowdl_input_converter.utils import (DIGEST_ALGORITHMS, JSON_BACKENDS,
+                                          StatCache,
+                                          check_duplicate_files,
                                           check_existence_list_of_files,
                                           check_md5sums,
-                                          csv_to_dict_generator)
+                                          csv_to_dict_generator,
+                                          device_queues, file_md5sum,
+                                          files_exist,
+                                          find_duplicate_files,
+                                          json_loads_function, md5_blocksize,
+                                          new_digest, scan_file, scan_files)
 
 import pytest
 
@@ -56,6 +72,166 @@ def test_check_existence_list_of_files_with_fails():
     assert error.match("trolls.txt")
 
 
+def test_files_exist(tmp_path):
+    (tmp_path / "a.fq").touch()
+    (tmp_path / "b.fq").touch()
+    (tmp_path / "dir").mkdir()
+    os.symlink(tmp_path / "a.fq", tmp_path / "link.fq")
+    os.symlink(tmp_path / "missing.fq", tmp_path / "broken_link.fq")
+    files = [tmp_path / "a.fq", tmp_path / "b.fq", tmp_path / "dir",
+             tmp_path / "link.fq", tmp_path / "broken_link.fq",
+             tmp_path / "missing.fq", tmp_path / "dir" / "c.fq",
+             str(tmp_path / "dir") + "/", tmp_path / "nodir" / "a.fq",
+             tmp_path / "nodir" / "b.fq"]
+    assert files_exist(files) == [os.path.exists(file) for file in files]
+    assert files_exist(files) == [True, True, True, True, False, False,
+                                  False, True, False, False]
+
+
+def test_files_exist_unlistable_directory(tmp_path, monkeypatch):
+    (tmp_path / "a.fq").touch()
+
+    def scandir(path):
+        raise PermissionError(f"Permission denied: {path}")
+    monkeypatch.setattr(os, "scandir", scandir)
+    assert files_exist([tmp_path / "a.fq", tmp_path / "b.fq"]) == \
+        [True, False]
+
+
+@pytest.mark.parametrize("stat_cache", [None, StatCache()])
+def test_files_exist_listing_differs_in_case(tmp_path, monkeypatch,
+                                             stat_cache):
+    (tmp_path / "a.fq").touch()
+    (tmp_path / "b.fq").touch()
+    # A case-insensitive filesystem lists the names as they were created,
+    # but opens files by names in any case.
+    monkeypatch.setattr(utils, "_directory_listing",
+                        lambda directory: {"A.FQ": False, "B.FQ": False})
+    assert files_exist([tmp_path / "a.fq", tmp_path / "b.fq",
+                        tmp_path / "c.fq"], stat_cache) == [True, True, False]
+
+
+def test_files_exist_stat_cache(tmp_path, monkeypatch):
+    (tmp_path / "a.fq").touch()
+    (tmp_path / "b.fq").touch()
+    files = [tmp_path / "a.fq", tmp_path / "b.fq", tmp_path / "c.fq",
+             tmp_path / "single" / "d.fq"]
+    stat_cache = StatCache()
+    assert files_exist(files, stat_cache) == [True, True, False, False]
+
+    # The second check only uses the cache.
+    def fail(path):
+        raise AssertionError(f"{path} was looked up again.")
+    monkeypatch.setattr(os, "scandir", fail)
+    monkeypatch.setattr(os, "stat", fail)
+    assert files_exist(files, stat_cache) == [True, True, False, False]
+
+
+@pytest.mark.parametrize("size", [0, 1, 64 * 1024 - 1, 64 * 1024,
+                                  3 * 1024 * 1024 + 7])
+def test_file_md5sum(size, tmp_path):
+    data = os.urandom(size)
+    path = tmp_path / "data.bin"
+    path.write_bytes(data)
+    expected = hashlib.md5(data).hexdigest()  # nosec
+    assert file_md5sum(path) == expected
+    assert file_md5sum(path, blocksize=1000, drop_cache=False) == expected
+
+
+def test_file_md5sum_without_fadvise(tmp_path, monkeypatch):
+    path = tmp_path / "data.bin"
+    path.write_bytes(b"A" * 200_000)
+    monkeypatch.delattr(os, "posix_fadvise", raising=False)
+    assert file_md5sum(path) == hashlib.md5(  # nosec
+        b"A" * 200_000).hexdigest()
+
+
+GZIP_DATA = gzip.compress(b"@read1\nACGT\n+\nIIII\n" * 1000)
+
+
+@pytest.mark.parametrize(["data", "error"], [
+    (GZIP_DATA, None),
+    # Multi-member files such as BGZF, including the empty BGZF EOF block.
+    (GZIP_DATA + GZIP_DATA + gzip.compress(b""), None),
+    (GZIP_DATA + bytes(100), None),
+    (GZIP_DATA[:-4], "unexpected end of file"),
+    (GZIP_DATA[:len(GZIP_DATA) // 2], "unexpected end of file"),
+    (GZIP_DATA[:-8] + bytes(4) + GZIP_DATA[-4:], "incorrect data check"),
+    (GZIP_DATA[:-1] + b"\xff", "incorrect length check"),
+    (GZIP_DATA + bytes(10) + b"x", "trailing garbage after gzip data"),
+    (b"@read1\nACGT\n+\nIIII\n", "incorrect header check"),
+    (b"", "not in gzip format"),
+])
+@pytest.mark.parametrize("blocksize", [7, 64 * 1024])
+def test_scan_file_gzip_check(data, error, blocksize, tmp_path):
+    path = tmp_path / "reads.fq.gz"
+    path.write_bytes(data)
+    digests, gzip_error = scan_file(path, check_gzip=True,
+                                    blocksize=blocksize)
+    assert digests == {"md5": hashlib.md5(data).hexdigest()}
+    if error is None:
+        assert gzip_error is None
+    else:
+        assert error in gzip_error
+
+
+def test_scan_files_gzip_check(tmp_path):
+    valid = tmp_path / "valid.fq.gz"
+    valid.write_bytes(GZIP_DATA)
+    truncated = tmp_path / "truncated.fq.bgz"
+    truncated.write_bytes(GZIP_DATA[:-4])
+    # Only files with a gzip suffix are checked.
+    uncompressed = tmp_path / "reads.fq"
+    uncompressed.write_bytes(b"not gzip")
+    not_gzip = tmp_path / "reads.fq.gz"
+    not_gzip.write_bytes(b"not gzip")
+    files = [valid, truncated, uncompressed, not_gzip]
+    result = scan_files(files, threads=2, check_gzip=True)
+    assert result.md5sums == [hashlib.md5(file.read_bytes()).hexdigest()
+                              for file in files]
+    assert result.hashed_bytes == sum(file.stat().st_size for file in files)
+    assert list(result.gzip_errors) == [1, 3]
+    assert result.gzip_errors[1] == "unexpected end of file"
+    assert scan_files(files).gzip_errors == {}
+
+
+@pytest.mark.parametrize("blocksize", [7, None])
+def test_scan_file_algorithms(blocksize, tmp_path):
+    algorithms = [algorithm for algorithm in DIGEST_ALGORITHMS
+                  if algorithm != "crc32c"]
+    path = tmp_path / "reads.fq"
+    data = b"@read1\nACGT\n+\nIIII\n" * 1000
+    path.write_bytes(data)
+    digests, _ = scan_file(path, blocksize=blocksize, algorithms=algorithms)
+    assert digests == {algorithm: hashlib.new(algorithm, data).hexdigest()
+                       for algorithm in algorithms}
+
+
+def test_scan_file_crc32c(tmp_path):
+    pytest.importorskip("crc32c")
+    path = tmp_path / "check.txt"
+    path.write_bytes(b"123456789")
+    assert scan_file(path, blocksize=4, algorithms=["crc32c"])[0] == {
+        "crc32c": "e3069283"}
+
+
+def test_new_digest_unknown_algorithm(tmp_path):
+    with pytest.raises(ValueError) as error:
+        new_digest("md4")
+    error.match("Unknown checksum algorithm: md4")
+    # Raised before any file is read.
+    with pytest.raises(ValueError):
+        scan_files([tmp_path / "missing.fq"], algorithms=["md5", "md4"])
+
+
+def test_md5_blocksize():
+    assert md5_blocksize(0) == 1
+    assert md5_blocksize(1000) == 1001
+    assert md5_blocksize(64 * 1024) == 64 * 1024
+    assert md5_blocksize(32 * 1024 * 1024) == 512 * 1024
+    assert md5_blocksize(10 * 1024 ** 3) == 1024 * 1024
+
+
 def test_check_md5sums():
     check_md5sums([(
         FILESDIR / "empty.csv", "d41d8cd98f00b204e9800998ecf8427e")])
@@ -85,3 +261,128 @@ def test_check_duplicate_files_with_fails():
     assert "bla2" not in str(error)
     assert "bla" in str(error)
     assert "bla3" in str(error)
+
+
+def test_find_duplicate_files_inode_mode(tmp_path):
+    (tmp_path / "a.fq").touch()
+    (tmp_path / "b.fq").touch()
+    (tmp_path / "c.fq").touch()
+    os.symlink(tmp_path / "a.fq", tmp_path / "symlink.fq")
+    os.link(tmp_path / "b.fq", tmp_path / "hardlink.fq")
+    files = [tmp_path / "a.fq", tmp_path / "b.fq", tmp_path / "c.fq",
+             tmp_path / "symlink.fq", tmp_path / "hardlink.fq"]
+    assert find_duplicate_files(files) == []
+    assert find_duplicate_files(files, mode="inode") == [
+        str(tmp_path / "a.fq"), str(tmp_path / "symlink.fq"),
+        str(tmp_path / "b.fq"), str(tmp_path / "hardlink.fq")]
+
+
+def test_find_duplicate_files_inode_mode_missing_files(tmp_path):
+    os.symlink(tmp_path / "missing.fq", tmp_path / "broken_link.fq")
+    assert find_duplicate_files(
+        ["missing.fq", "./missing.fq", "other.fq"], mode="inode") == [
+        "missing.fq"]
+    assert find_duplicate_files(
+        [tmp_path / "missing.fq", tmp_path / "broken_link.fq"],
+        mode="inode") == [str(tmp_path / "missing.fq"),
+                          str(tmp_path / "broken_link.fq")]
+
+
+def test_find_duplicate_files_unknown_mode():
+    with pytest.raises(ValueError) as error:
+        find_duplicate_files(["a.fq"], mode="checksum")
+    error.match("Unknown duplicate check mode: checksum")
+
+
+def test_check_md5sums_multiple_threads_with_fails():
+    with pytest.raises(ValueError) as error:
+        check_md5sums([
+            (FILESDIR / "empty.csv", "d41d8cd98f00b204e9800998ecf8427e"),
+            (FILESDIR / "extra_fields.csv", "XXXX"),
+            (FILESDIR / "complete.yml", "XXXX"),
+            (FILESDIR / "missing_field.csv", "XXXX")
+        ], threads=3)
+    assert "empty.csv" not in str(error)
+    # Files are reported in the order of the samplesheet, not the order in
+    # which they were hashed.
+    assert error.match("extra_fields.csv, .*complete.yml, .*missing_field.csv")
+
+
+def test_check_md5sums_shared_executor():
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        check_md5sums([
+            (FILESDIR / "empty.csv", "d41d8cd98f00b204e9800998ecf8427e")],
+            executor=executor, stat_cache=StatCache())
+        with pytest.raises(ValueError) as error:
+            check_md5sums([(FILESDIR / "extra_fields.csv", "XXXX")],
+                          executor=executor)
+        error.match("extra_fields.csv")
+        # The executor is not shut down by check_md5sums.
+        assert executor.submit(len, "abc").result() == 3
+
+
+def fake_stat_cache(files: Dict[str, Tuple[int, int, int]]) -> StatCache:
+    """A StatCache with (device, inode, size) for each file."""
+    stat_cache = StatCache()
+    for file, (device, inode, size) in files.items():
+        stat_cache._stats[file] = os.stat_result(
+            (0o100644, inode, device, 1, 0, 0, size, 0, 0, 0))
+    return stat_cache
+
+
+def test_device_queues():
+    stat_cache = fake_stat_cache({
+        "a": (1, 30, 10), "b": (2, 5, 100), "c": (1, 10, 10),
+        "d": (2, 1, 100), "e": (1, 20, 10)})
+    queues = device_queues(["a", "b", "c", "d", "e", "missing"], stat_cache)
+    # Device 2 has the most bytes. Missing files come last.
+    assert [list(queue) for queue in queues] == [[3, 1], [2, 4, 0], [5]]
+
+
+def test_find_incorrect_md5sums_per_device(monkeypatch):
+    files = {f"dev{device}_{number}": (device, number, 10)
+             for device in range(3) for number in range(4)}
+    stat_cache = fake_stat_cache(files)
+    active = collections.Counter()  # type: Dict[str, int]
+    maximum_active = collections.Counter()  # type: Dict[str, int]
+    lock = threading.Lock()
+
+    def fake_scan_file(file, check_gzip=False, algorithms=("md5",)):
+        device = file.split("_")[0]
+        with lock:
+            active[device] += 1
+            maximum_active[device] = max(maximum_active[device],
+                                         active[device])
+        time.sleep(0.01)
+        with lock:
+            active[device] -= 1
+        return {"md5": "correct" if file != "dev1_2" else "different"}, None
+    monkeypatch.setattr(utils, "scan_file", fake_scan_file)
+    incorrect_files, hashed_bytes = utils.find_incorrect_md5sums(
+        [(file, "correct") for file in files], threads=6,
+        stat_cache=stat_cache, per_device=2)
+    assert incorrect_files == ["dev1_2"]
+    assert hashed_bytes == 120
+    assert maximum_active == {"dev0": 2, "dev1": 2, "dev2": 2}
+
+
+@pytest.mark.parametrize("backend", JSON_BACKENDS)
+def test_json_loads_function(backend):
+    pytest.importorskip(backend)
+    loads = json_loads_function(backend)
+    assert loads(b'{"a": ["b", 1, null, 1.5, "\\u00e9/"]}') == \
+        {"a": ["b", 1, None, 1.5, "\u00e9/"]}
+
+
+def test_json_loads_function_unknown_backend():
+    with pytest.raises(ValueError) as error:
+        json_loads_function("simplejson")
+    assert error.match("Unknown JSON backend: simplejson")
+
+
+def test_crc32c_without_package(monkeypatch):
+    monkeypatch.setitem(sys.modules, "crc32c", None)
+    with pytest.raises(ValueError) as error:
+        new_digest("crc32c")
+    error.match("crc32c checksums require the crc32c package")
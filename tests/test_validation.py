@@ -0,0 +1,408 @@
+# Copyright (c) 2019 Leiden University Medical Center
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import collections
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict
+
+from biowdl_input_converter import samplesheet_to_samplegroup, utils, \
+    write_samplesheet_file
+from biowdl_input_converter.cache import Md5Cache
+from biowdl_input_converter.samplestructure import Library, ReadGroup, \
+    Sample, SampleGroup
+from biowdl_input_converter.timings import Timings
+from biowdl_input_converter.validation import FilePrefetcher, \
+    ValidationReport, file_table, generate_missing_checksums, \
+    generate_missing_md5sums, record_file_sizes, validate_samplegroup
+
+import pytest
+
+from . import FILESDIR
+
+R1 = str(FILESDIR / "data" / "R1.fq")
+R2 = str(FILESDIR / "data" / "R2.fq")
+R1_MD5 = "d8e8fca2dc0f896fd7cb4cb0031ba249"
+R2_MD5 = "126a8a51b9d1bbd07fddc65819a542c3"
+
+
+def samplegroup_with_problems() -> SampleGroup:
+    return SampleGroup([
+        Sample("s1", [Library("lib1", [
+            ReadGroup("rg1", R1, R2, R1_MD5, "XXXX"),
+            ReadGroup("rg2", "missing_R1.fq", R1),
+        ])]),
+        Sample("s2", [Library("lib1", [
+            ReadGroup("rg1", "missing_R2.fq", R1_md5=R1_MD5)])])])
+
+
+def test_file_table():
+    assert file_table(samplegroup_with_problems()) == [
+        (R1, {"md5": R1_MD5}), (R2, {"md5": "XXXX"}), ("missing_R1.fq", {}),
+        (R1, {}), ("missing_R2.fq", {"md5": R1_MD5})]
+
+
+def test_file_table_other_checksums():
+    readgroup = ReadGroup("rg1", R1, R2, R1_md5=R1_MD5, checksums={
+        "R1_sha256": "aaaa", "R2_sha256": "bbbb", "R2_sha1": "cccc"})
+    samplegroup = SampleGroup([Sample("s1", [Library("lib1", [readgroup])])])
+    assert file_table(samplegroup) == [
+        (R1, {"md5": R1_MD5, "sha256": "aaaa"}),
+        (R2, {"sha256": "bbbb", "sha1": "cccc"})]
+
+
+def test_validate_samplegroup_reports_all_problems():
+    report = validate_samplegroup(samplegroup_with_problems(),
+                                  file_md5_check=True)
+    assert report == ValidationReport(
+        missing_files=["missing_R1.fq", "missing_R2.fq"],
+        incorrect_md5sums=[R2],
+        duplicate_files=[R1],
+        files=5,
+        hashed_bytes=Path(R1).stat().st_size + Path(R2).stat().st_size)
+    assert not report.ok
+    with pytest.raises(FileNotFoundError) as error:
+        report.raise_for_problems()
+    error.match("can not be found: missing_R1.fq, missing_R2.fq")
+    error.match("incorrect md5sums")
+    error.match("occur multiple times")
+
+
+def test_validate_samplegroup_md5_check_reports_missing_files():
+    # Files that can not be hashed are missing, even without presence check.
+    report = validate_samplegroup(samplegroup_with_problems(),
+                                  file_presence_check=False,
+                                  file_md5_check=True,
+                                  file_duplication_check=False)
+    assert report.missing_files == ["missing_R2.fq"]
+    assert report.incorrect_md5sums == [R2]
+
+
+def test_validate_samplegroup_stats_each_file_once(monkeypatch, tmp_path):
+    stat = os.stat
+    looked_up = collections.Counter()  # type: Dict[str, int]
+
+    def counting_stat(path, *args, **kwargs):
+        looked_up[os.fspath(path)] += 1
+        return stat(path, *args, **kwargs)
+    with Md5Cache(tmp_path / "md5cache.sqlite") as md5_cache:
+        monkeypatch.setattr(os, "stat", counting_stat)
+        validate_samplegroup(samplegroup_with_problems(),
+                             file_md5_check=True, md5_cache=md5_cache)
+        monkeypatch.undo()
+    # Files that are not in a directory listing are looked up to confirm
+    # that they are missing.
+    assert set(looked_up) == {R1, R2, "missing_R1.fq", "missing_R2.fq"}
+    assert set(looked_up.values()) == {1}
+
+
+def test_validation_report_ok():
+    report = ValidationReport()
+    assert report.ok
+    assert report.problems() == []
+    report.raise_for_problems()
+
+
+def test_validation_report_value_error():
+    with pytest.raises(ValueError) as error:
+        ValidationReport(duplicate_files=["a.fq"]).raise_for_problems()
+    error.match("The following files occur multiple times: a.fq")
+
+
+def test_samplesheet_to_samplegroup_raises_report(tmp_path):
+    samplesheet = tmp_path / "samplesheet.csv"
+    samplesheet.write_text(
+        '"sample","library","readgroup","R1","R1_md5"\n'
+        f'"s1","lib1","rg1","{R1}","XXXX"\n'
+        f'"s1","lib1","rg2","{R1}",\n')
+    with pytest.raises(ValueError) as error:
+        samplesheet_to_samplegroup(samplesheet, file_md5_check=True)
+    error.match("incorrect md5sums(.|\n)*occur multiple times")
+
+
+def test_validate_samplegroup_inode_mode(monkeypatch, tmp_path):
+    os.symlink(R1, tmp_path / "link.fq")
+    samplegroup = SampleGroup([Sample("s1", [Library("lib1", [
+        ReadGroup("rg1", R1, R2),
+        ReadGroup("rg2", str(tmp_path / "link.fq"), "missing.fq")])])])
+    stat = os.stat
+    looked_up = collections.Counter()  # type: Dict[str, int]
+
+    def counting_stat(path, *args, **kwargs):
+        looked_up[os.fspath(path)] += 1
+        return stat(path, *args, **kwargs)
+    monkeypatch.setattr(os, "stat", counting_stat)
+    report = validate_samplegroup(samplegroup, duplicate_check_mode="inode")
+    monkeypatch.undo()
+    assert report.missing_files == ["missing.fq"]
+    assert report.duplicate_files == [R1, str(tmp_path / "link.fq")]
+    # The existence and duplication checks share one stat per file.
+    assert set(looked_up.values()) == {1}
+
+
+def test_generate_missing_md5sums(tmp_path):
+    samplegroup = SampleGroup([Sample("s1", [Library("lib1", [
+        ReadGroup("rg1", R1, R2, R1_md5="existing"),
+        ReadGroup("rg2", R2, R1),
+        ReadGroup("rg3", R2)])])])
+    with Md5Cache(tmp_path / "md5cache.sqlite") as md5_cache:
+        assert generate_missing_md5sums(samplegroup, threads=2,
+                                        md5_cache=md5_cache) == (
+            # Every file is read once.
+            4, Path(R2).stat().st_size + Path(R1).stat().st_size)
+    readgroups = samplegroup[0][0].readgroups
+    assert [(readgroup.R1_md5, readgroup.R2_md5)
+            for readgroup in readgroups] == [
+        ("existing", R2_MD5), (R2_MD5, R1_MD5), (R2_MD5, None)]
+
+
+def gzip_samplegroup(tmp_path) -> SampleGroup:
+    valid = tmp_path / "valid.fq.gz"
+    valid.write_bytes(gzip.compress(Path(R1).read_bytes()))
+    truncated = tmp_path / "truncated.fq.gz"
+    truncated.write_bytes(valid.read_bytes()[:-4])
+    corrupt = tmp_path / "corrupt.fq.gz"
+    corrupt.write_bytes(Path(R2).read_bytes())
+    return SampleGroup([Sample("s1", [Library("lib1", [
+        ReadGroup("rg1", str(valid), str(truncated),
+                  R1_md5=hashlib.md5(valid.read_bytes()).hexdigest()),
+        ReadGroup("rg2", str(corrupt), R1)])])])
+
+
+def test_validate_samplegroup_gzip_check(tmp_path):
+    samplegroup = gzip_samplegroup(tmp_path)
+    timings = Timings()
+    report = validate_samplegroup(samplegroup, file_gzip_check=True,
+                                  timings=timings)
+    # All invalid gzip files are reported together.
+    assert [error.split(": ")[0] for error in report.gzip_errors] == [
+        str(tmp_path / "truncated.fq.gz"), str(tmp_path / "corrupt.fq.gz")]
+    assert "unexpected end of file" in report.gzip_errors[0]
+    # Files without a gzip suffix are not read.
+    assert report.hashed_bytes == sum(
+        path.stat().st_size for path in tmp_path.glob("*.gz"))
+    assert [stage.name for stage in timings.stages] == [
+        "check_existence", "check_gzip", "check_duplicates"]
+    with pytest.raises(ValueError) as error:
+        report.raise_for_problems()
+    error.match("not valid gzip files: .*truncated.fq.gz: unexpected end")
+
+
+def test_validate_samplegroup_gzip_check_reads_files_once(monkeypatch,
+                                                          tmp_path):
+    samplegroup = gzip_samplegroup(tmp_path)
+    opened = collections.Counter()  # type: Dict[str, int]
+    scan_file = utils.scan_file
+
+    def counting_scan_file(path, *args, **kwargs):
+        opened[os.fspath(path)] += 1
+        return scan_file(path, *args, **kwargs)
+    monkeypatch.setattr(utils, "scan_file", counting_scan_file)
+    with Md5Cache(tmp_path / "md5cache.sqlite") as md5_cache:
+        validate_samplegroup(samplegroup, file_md5_check=True,
+                             md5_cache=md5_cache)
+        report = validate_samplegroup(samplegroup, file_md5_check=True,
+                                      file_gzip_check=True,
+                                      md5_cache=md5_cache)
+        generate_missing_md5sums(samplegroup, md5_cache=md5_cache,
+                                 known_digests=report.digests)
+    assert report.incorrect_md5sums == []
+    assert len(report.gzip_errors) == 2
+    # The md5sum and gzip checks share one read. Cached md5sums do not
+    # skip the gzip check.
+    assert opened == {str(tmp_path / "valid.fq.gz"): 2,
+                      str(tmp_path / "truncated.fq.gz"): 1,
+                      str(tmp_path / "corrupt.fq.gz"): 1,
+                      R1: 1}
+
+
+def test_validate_samplegroup_checksums(monkeypatch):
+    r1_sha256 = hashlib.sha256(Path(R1).read_bytes()).hexdigest()
+    samplegroup = SampleGroup([Sample("s1", [Library("lib1", [
+        ReadGroup("rg1", R1, R2, R1_md5=R1_MD5,
+                  checksums={"R1_sha256": r1_sha256, "R2_sha1": "XXXX",
+                             "R2_blake2b": "XXXX"})])])])
+    opened = collections.Counter()  # type: Dict[str, int]
+    scan_file = utils.scan_file
+
+    def counting_scan_file(path, *args, **kwargs):
+        opened[os.fspath(path)] += 1
+        return scan_file(path, *args, **kwargs)
+    monkeypatch.setattr(utils, "scan_file", counting_scan_file)
+    report = validate_samplegroup(samplegroup, file_md5_check=True)
+    assert report.incorrect_md5sums == []
+    assert report.incorrect_checksums == [f"{R2} (sha1)", f"{R2} (blake2b)"]
+    assert opened == {R1: 1, R2: 1}
+    with pytest.raises(ValueError) as error:
+        report.raise_for_problems()
+    error.match(f"incorrect checksums: {R2} \\(sha1\\)")
+
+
+def test_generate_missing_checksums(monkeypatch):
+    samplegroup = SampleGroup([Sample("s1", [Library("lib1", [
+        ReadGroup("rg1", R1, R2, R1_md5="existing",
+                  checksums={"R2_sha256": "existing"}),
+        ReadGroup("rg2", R2)])])])
+    opened = collections.Counter()  # type: Dict[str, int]
+    scan_file = utils.scan_file
+
+    def counting_scan_file(path, *args, **kwargs):
+        opened[os.fspath(path)] += 1
+        return scan_file(path, *args, **kwargs)
+    monkeypatch.setattr(utils, "scan_file", counting_scan_file)
+    r2_sha256 = hashlib.sha256(Path(R2).read_bytes()).hexdigest()
+    assert generate_missing_checksums(
+        samplegroup, ("md5", "sha256"),
+        known_digests={R2: {"md5": R2_MD5}}) == (
+        4, Path(R1).stat().st_size + Path(R2).stat().st_size)
+    rg1, rg2 = samplegroup[0][0].readgroups
+    assert (rg1.R1_md5, rg1.R2_md5) == ("existing", R2_MD5)
+    assert rg1.checksums == {
+        "R2_sha256": "existing",
+        "R1_sha256": hashlib.sha256(Path(R1).read_bytes()).hexdigest()}
+    assert (rg2.R1_md5, rg2.checksums) == (R2_MD5, {"R1_sha256": r2_sha256})
+    # The known md5sum of R2 is reused. Every file is read once, although
+    # it is in two readgroups.
+    assert opened == {R1: 1, R2: 1}
+
+
+@pytest.mark.parametrize(["fileformat", "duplicate_check_mode"], [
+    ("csv", "path"), ("csv", "inode"), ("yml", "path"), ("json", "inode")])
+def test_pipelined_conversion_reports_same_problems(tmp_path, fileformat,
+                                                    duplicate_check_mode):
+    samplegroup = samplegroup_with_problems()
+    samplegroup.samples.append(
+        Sample("gzip", gzip_samplegroup(tmp_path)[0].libraries))
+    samplesheet = tmp_path / f"samplesheet.{fileformat}"
+    write_samplesheet_file(samplegroup, samplesheet)
+    errors = []
+    for pipelined in (False, True):
+        with pytest.raises(FileNotFoundError) as error:
+            samplesheet_to_samplegroup(
+                samplesheet, file_md5_check=True, file_gzip_check=True,
+                duplicate_check_mode=duplicate_check_mode, threads=3,
+                pipelined=pipelined)
+        errors.append(str(error.value))
+    assert errors[0] == errors[1]
+    assert "not valid gzip files" in errors[1]
+
+
+def test_pipelined_conversion_same_samplegroup(monkeypatch, tmp_path):
+    samplegroup = gzip_samplegroup(tmp_path)
+    samplesheet = tmp_path / "samplesheet.csv"
+    write_samplesheet_file(samplegroup, samplesheet)
+    opened = collections.Counter()  # type: Dict[str, int]
+    scan_file = utils.scan_file
+
+    def counting_scan_file(path, *args, **kwargs):
+        opened[os.fspath(path)] += 1
+        return scan_file(path, *args, **kwargs)
+    monkeypatch.setattr(utils, "scan_file", counting_scan_file)
+    sequential = samplesheet_to_samplegroup(samplesheet, file_md5_check=True,
+                                            generate_md5sums=True)
+    opened.clear()
+    timings = Timings()
+    pipelined = samplesheet_to_samplegroup(samplesheet, file_md5_check=True,
+                                           generate_md5sums=True,
+                                           timings=timings, pipelined=True)
+    assert pipelined == sequential
+    # The file with an md5sum is read by the workers during parsing and
+    # not again by the check. The other files are read to generate their
+    # md5sums.
+    assert opened == {str(tmp_path / "valid.fq.gz"): 1,
+                      str(tmp_path / "truncated.fq.gz"): 1,
+                      str(tmp_path / "corrupt.fq.gz"): 1, R1: 1}
+    assert [stage.name for stage in timings.stages][:2] == [
+        "parse", "check_existence"]
+
+
+def test_file_prefetcher_cancel():
+    prefetcher = FilePrefetcher(file_md5_check=True, threads=2)
+    with pytest.raises(ValueError):
+        with prefetcher:
+            prefetcher.add(ReadGroup("rg1", R1, R2, R1_MD5, R2_MD5))
+            raise ValueError("parse error")
+    assert not any(thread.is_alive() for thread in prefetcher._workers)
+
+
+def test_file_prefetcher_survives_worker_errors(monkeypatch, tmp_path):
+    readgroups = []
+    for index in range(10):
+        path = tmp_path / f"R{index}.fq"
+        path.write_bytes(Path(R1).read_bytes())
+        readgroups.append(ReadGroup(f"rg{index}", str(path), R1_md5=R1_MD5))
+
+    def locked_scan_file(*args, **kwargs):
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(utils, "scan_file", locked_scan_file)
+    prefetcher = FilePrefetcher(file_md5_check=True, threads=1,
+                                queue_size=2)
+
+    def parse():
+        with prefetcher:
+            for readgroup in readgroups:
+                prefetcher.add(readgroup)
+    parser = threading.Thread(target=parse, daemon=True)
+    parser.start()
+    parser.join(timeout=10)
+    assert not parser.is_alive()
+    assert not any(thread.is_alive() for thread in prefetcher._workers)
+    # The files are checked again by the validation.
+    assert prefetcher.scanned_files == {}
+    monkeypatch.undo()
+    report = validate_samplegroup(
+        SampleGroup([Sample("s1", [Library("lib1", readgroups)])]),
+        file_md5_check=True, scanned_files=prefetcher.scanned_files)
+    assert report.ok
+
+
+@pytest.mark.parametrize("threads", [1, 2])
+def test_record_file_sizes(monkeypatch, threads):
+    samplegroup = SampleGroup([Sample("s1", [Library("lib1", [
+        ReadGroup("rg1", R1, R2), ReadGroup("rg2", R2)])])])
+    stat = os.stat
+    looked_up = collections.Counter()  # type: Dict[str, int]
+
+    def counting_stat(path, *args, **kwargs):
+        looked_up[os.fspath(path)] += 1
+        return stat(path, *args, **kwargs)
+    monkeypatch.setattr(os, "stat", counting_stat)
+    total = record_file_sizes(samplegroup, threads=threads)
+    monkeypatch.undo()
+    r1_size, r2_size = os.path.getsize(R1), os.path.getsize(R2)
+    assert total == r1_size + r2_size
+    assert [(readgroup.R1_size, readgroup.R2_size)
+            for readgroup in samplegroup[0][0]] == [
+        (r1_size, r2_size), (r2_size, None)]
+    assert samplegroup[0].total_size == r1_size + 2 * r2_size
+    assert looked_up == {R1: 1, R2: 1}
+
+
+def test_record_file_sizes_missing_files():
+    samplegroup = SampleGroup([Sample("s1", [Library("lib1", [
+        ReadGroup("rg1", R1, "missing.fq")])])])
+    with pytest.raises(FileNotFoundError) as error:
+        record_file_sizes(samplegroup)
+    error.match("can not be found: missing.fq")